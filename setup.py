@@ -15,6 +15,18 @@ setup(
         "plotly==5.15.0",
         "streamlit==1.25.0",
     ],
+    entry_points={
+        "console_scripts": [
+            "stock-insights-pipeline=src.utils.pipeline:main",
+        ],
+    },
+    extras_require={
+        "fast": ["orjson"],
+        "screener": ["pyarrow"],
+        "pipeline": ["pyarrow"],
+        "qmc": ["scipy"],
+        "test": ["pytest"],
+    },
     classifiers=[
         'Programming Language :: Python :: 3.11',
     ],
@@ -9,7 +9,7 @@ st.set_page_config(
 # Setting states
 st.session_state["main_ticker"] = ""
 st.session_state["peer_list"] = []
-st.session_state["data"] = None
+st.session_state["store"] = None
 for peer in range(1, 10):
     peer_idx = "peer" + str(peer)
     if peer_idx + "_name" not in st.session_state:
@@ -33,6 +33,7 @@ def main():
         How to use the tool:
         1. Set the primary ticker and its peers.
         2. Navigate to the analysis page and explore some of the KPIs to see how the stock of interest performs compared to its peers.
+        3. Or use the screener page to rank a whole watchlist against each other.
 
         Note that if you look at a metric that is not a ratio, then different currencies will naturally make the values different across the peers.
         """
@@ -8,10 +8,126 @@ path_root = Path(__file__).parents[2]
 sys.path.append(str(path_root))
 
 from src.utils.yf_extractor import YahooExtractor
+from src.utils.instrumentation import timings_sidebar
+from src.utils.metric_store import MetricStore
+from src.utils.peer_discovery import PeerDiscovery
 # from utils.yf_extractor import YahooExtractor
-import streamlit as st
 import pandas as pd
+import streamlit as st
+
+
+# How long the results of network calls are reused across reruns (in seconds).
+CACHE_TTL = float(os.environ.get("STOCK_INSIGHTS_PAGE_CACHE_TTL", 3600))
+# How long a failed lookup is reused, shorter so a ticker without results is tried again soon.
+NEGATIVE_CACHE_TTL = float(
+    os.environ.get("STOCK_INSIGHTS_PAGE_NEGATIVE_CACHE_TTL", 300)
+)
+
+
+def count_cache_call(name: str, miss: bool = False) -> None:
+    """Counting the calls and misses of a cached function for the debug sidebar.
+
+    Args:
+        name (str): The name of the cached function.
+        miss (bool, optional): Whether the call was a miss. Defaults to False.
+    """
+    counts = st.session_state.setdefault("cache_counts", {})
+    calls, misses = counts.get(name, (0, 0))
+    counts[name] = (calls + (not miss), misses + miss)
+
+
+@st.cache_data(ttl=NEGATIVE_CACHE_TTL, show_spinner=False)
+def lookup_recommended_symbols(ticker: str) -> list:
+    """Calling yahoo for the recommended symbols of a ticker, cached for a short time so a failed lookup isn't repeated on every rerun.
+
+    Args:
+        ticker (str): The ticker.
+
+    Returns:
+        list: The list of recommended tickers, empty if they couldn't be found.
+    """
+    count_cache_call("get_recommended_symbols", miss=True)  # Only runs on a miss.
+    symbols = YahooExtractor(ticker).get_recommended_symbols()
+    return symbols if symbols is not None else []
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_recommended_symbols(ticker: str) -> list:
+    """Getting the recommended symbols of a ticker, cached so reruns caused by widget edits don't call yahoo again.
+    An empty lookup raises, so it is only kept for the shorter time of lookup_recommended_symbols and not for CACHE_TTL.
+
+    Args:
+        ticker (str): The ticker.
+
+    Raises:
+        LookupError: If the recommended symbols couldn't be found.
+
+    Returns:
+        list: The list of recommended tickers.
+    """
+    symbols = lookup_recommended_symbols(ticker)
+    if len(symbols) == 0:
+        raise LookupError(f"No recommended symbols were found for {ticker}")
+    return symbols
+
+
+def cached_recommended_symbols(ticker: str) -> list:
+    """Calling the cached get_recommended_symbols and counting the call.
 
+    Returns:
+        list: The list of recommended tickers, empty if they couldn't be found.
+    """
+    count_cache_call("get_recommended_symbols")
+    try:
+        return get_recommended_symbols(ticker)
+    except LookupError:
+        return []
+
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def discover_peers(ticker: str, max_depth: int, fan_out: int) -> pd.DataFrame:
+    """Crawling the recommendation graph of a ticker, cached so the crawl only runs once per setting.
+
+    Args:
+        ticker (str): The ticker.
+        max_depth (int): How many levels of recommendations to follow.
+        fan_out (int): How many recommendations of each symbol to follow.
+
+    Returns:
+        pd.DataFrame: The ranked candidates.
+    """
+    count_cache_call("discover_peers", miss=True)  # Only runs on a miss.
+    return PeerDiscovery(max_depth=max_depth, fan_out=fan_out).discover(ticker)
+
+
+def cached_discover_peers(ticker: str, max_depth: int, fan_out: int) -> pd.DataFrame:
+    """Calling the cached discover_peers and counting the call."""
+    count_cache_call("discover_peers")
+    return discover_peers(ticker, max_depth, fan_out)
+
+
+def adopt_peers(peers: list) -> None:
+    """Filling the peer inputs with the discovered peers.
+    Used as a button callback, so the inputs are updated before they are created on the rerun.
+
+    Args:
+        peers (list): The peers to adopt.
+    """
+    st.session_state["number_of_peers"] = len(peers)
+    for i, peer in enumerate(peers):
+        st.session_state[i] = peer
+
+
+def debug_sidebar() -> None:
+    """Showing the hit and miss counts of the page cache and the shared extractor layer."""
+    with st.sidebar.expander("Debug", expanded=False):
+        st.write(f"Page cache (expires after {CACHE_TTL:.0f} seconds)")
+        for name, (calls, misses) in st.session_state.get("cache_counts", {}).items():
+            st.write(f"{name}: {calls - misses} hits, {misses} misses")
+        flight = YahooExtractor.flight
+        st.write(
+            f"Shared extractor layer: {flight.hits} hits, {flight.misses} misses, {flight.shared} shared in-flight"
+        )
 
 
 def main():
@@ -37,17 +153,55 @@ def main():
     ):
 
         # The recommended symbols from Yahoo Finance (if any)
-        main_ticker = YahooExtractor(company_ticker)
-        suggested_peers = main_ticker.get_recommended_symbols()
-        if suggested_peers is not None:
+        suggested_peers = cached_recommended_symbols(
+            st.session_state["main_ticker"]
+        )
+        if len(suggested_peers) > 0:
             suggested_peers = ", ".join(suggested_peers)
             st.write("Suggested peers", suggested_peers)
         else:
             st.write("There are no suggested peers")
 
+        # Discovering a larger peer universe from the recommendations of the recommendations
+        with st.expander("Discover peers", expanded=False):
+            depth_col, fan_out_col, n_peers_col = st.columns(3)
+            max_depth = depth_col.number_input(
+                "Depth", min_value=1, max_value=3, value=2, step=1
+            )
+            fan_out = fan_out_col.number_input(
+                "Recommendations per symbol", min_value=1, max_value=10, value=5, step=1
+            )
+            n_peers = n_peers_col.number_input(
+                "Peers to suggest", min_value=1, max_value=20, value=5, step=1
+            )
+            if st.button("Discover peers", key="discover_peers"):
+                with st.spinner("Crawling the recommended symbols"):
+                    st.session_state["discovered_peers"] = (
+                        st.session_state["main_ticker"],
+                        cached_discover_peers(
+                            st.session_state["main_ticker"], max_depth, fan_out
+                        ),
+                    )
+
+            discovered_ticker, candidates = st.session_state.get(
+                "discovered_peers", (None, None)
+            )
+            if discovered_ticker == st.session_state["main_ticker"]:
+                if len(candidates) == 0:
+                    st.write("No peers were found")
+                else:
+                    st.dataframe(candidates.head(n_peers), hide_index=True)
+                    st.button(
+                        "Adopt suggested peers",
+                        on_click=adopt_peers,
+                        args=(candidates["symbol"].head(n_peers).tolist(),),
+                    )
+
         # Create a list of peers
         peer_list = []
-        number_of_peers = st.number_input("Number of Peers", step=1, min_value=1)
+        number_of_peers = st.number_input(
+            "Number of Peers", step=1, min_value=1, key="number_of_peers"
+        )
 
         st.write("Write the Peers here")
         cols = st.columns(
@@ -62,33 +216,38 @@ def main():
             "peer_list"
         ] = peer_list  # Remembering the list of peers for the analysis page.
 
+        force_refresh = st.checkbox(
+            "Force refresh",
+            help="Download the data from yahoo again instead of using the local cache.",
+        )
         if st.button("Add Peers", key="add_peers"):
-            full_df = main_ticker.get_stats()
-            full_df["ticker"] = company_ticker
-
             # Adding a progress bar for loading the data
             progress_text = "Loading data from yahoo"
             yahoo_extract_progress = st.progress(
                 0, text=progress_text
             )  # If users move too fast the data won't be stored.
 
-            for i, peer in enumerate(peer_list):
-                # Extracting data for each peer and adding it to the dataframe
-                ticker_df = YahooExtractor(peer).get_stats()
-                ticker_df["ticker"] = peer
-
-                full_df = pd.concat([full_df, ticker_df], ignore_index=True)
-
-                progress = (i + 1.0) / (
-                    number_of_peers + 1.0
+            def update_progress(ticker, completed, total):
+                progress = completed / (
+                    total + 1.0
                 )  # Adding one so the final step is when the data is stored
                 yahoo_extract_progress.progress(progress, text=progress_text)
 
-            st.session_state[
-                "data"
-            ] = full_df  # Storing the data for the analysis page.
+            # Extracting data for the primary ticker and all peers concurrently
+            full_df = YahooExtractor.get_stats_many(
+                [company_ticker] + [peer for peer in peer_list if peer != ""],
+                on_complete=update_progress,
+                force_refresh=force_refresh,
+            )
+
+            st.session_state["store"] = MetricStore(
+                full_df
+            )  # Storing the indexed data for the analysis page.
             yahoo_extract_progress.progress(1.0, text="Done loading data")
 
+    debug_sidebar()
+    timings_sidebar()
+
 
 if __name__ == "__main__":
     main()
@@ -8,6 +8,7 @@ path_root = Path(__file__).parents[2]
 sys.path.append(str(path_root))
 
 import streamlit as st
+from src.utils.instrumentation import instrumentation, timings_sidebar
 from src.utils.plotter import Plotter
 from src.utils.yf_extractor import YahooExtractor
 
@@ -17,7 +18,7 @@ def main():
     primary_ticker_name = st.session_state["main_ticker"]
     main_ticker = YahooExtractor(primary_ticker_name)
     peer_list = st.session_state["peer_list"]
-    full_df = st.session_state["data"]
+    store = st.session_state["store"]
 
     st.write(f"The main ticker is {primary_ticker_name}")
     st.write(f"The peers are {', '.join(peer_list)}")
@@ -29,23 +30,39 @@ def main():
     ticker_limit = (
         total_tickers * 0.75
     )  # At least 75 % of the tickers must be represented in the metric before it is shown.
-    metric_df = full_df.groupby(["metric"])["ticker"].nunique().reset_index()
-    metrics = metric_df[metric_df["ticker"] >= ticker_limit]["metric"].tolist()
+    coverage = store.coverage()
+    metrics = coverage[coverage >= ticker_limit].index.tolist()
 
-    # Seleting a metric and adapting the df to it
+    # Seleting a metric and getting its date x ticker pivot
     chosen_metric = st.selectbox(label="Selected Metric", options=metrics)
-    df = full_df[full_df["metric"] == chosen_metric].copy()
-    df[chosen_metric] = df["value"]
+    pivot = store.pivot(chosen_metric)
 
     # Plotting
-    p = Plotter(df, primary_ticker=primary_ticker_name, peers=peer_list)
+    p = Plotter(
+        pivot,
+        primary_ticker=primary_ticker_name,
+        peers=peer_list,
+        data_version=(store.version, chosen_metric),
+    )
 
     development_plot = p.line(y_col=chosen_metric)
-    mask = (df["date"] == "2023-03-31").tolist()
-    current_state_plot = p.bar(y_col=chosen_metric, mask=df["date"] == "2023-03-31")
 
-    st.plotly_chart(current_state_plot)
-    st.plotly_chart(development_plot)
+    # The bars show the latest observation of every ticker, even if their quarters end on different dates.
+    latest = store.snapshot.metric_frame(
+        chosen_metric, tickers=[primary_ticker_name] + peer_list
+    )
+    latest[chosen_metric] = latest["value"]
+    current_state_plot = Plotter(
+        latest,
+        primary_ticker=primary_ticker_name,
+        peers=peer_list,
+        data_version=(store.version, chosen_metric, "latest"),
+    ).bar(y_col=chosen_metric)
+
+    with instrumentation.span("streamlit.plotly_chart"):
+        st.plotly_chart(current_state_plot)
+        st.plotly_chart(development_plot)
+    timings_sidebar()
 
 
 def blocker():
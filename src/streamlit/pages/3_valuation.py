@@ -9,32 +9,46 @@ sys.path.append(str(path_root))
 
 
 import streamlit as st
-from src.utils.simulation import MonteCarloSimulation
-from src.utils.styling import PrimaryColors
+from src.utils.simulation import MonteCarloSimulation, simulate_scenarios
+from src.utils.instrumentation import instrumentation, timings_sidebar
+from src.utils.plotter import histogram_density
+from src.utils.styling import PrimaryColors, SecondaryColors
 import plotly.graph_objects as go
 import plotly.express as px
 import numpy as np
 
 
+@instrumentation.timed("valuation.create_fig")
 def create_fig(
-    estimates, current: float = None, x_format: str = None, **kwargs
+    estimates, current: float = None, x_format: str = None, bins="auto", **kwargs
 ) -> go.Figure:
     """Creating a histogram figure based on the estimates and with a line for the current/base value. 
     This will create a graph of the distribution of the estimates.
+    The estimates are binned on the server, so the size of the figure doesn't depend on the number of simulations.
 
     Args:
         estimates (np.ndarray): An array of estimated values.
         current (float, optional): The current/base value - used to plotting a line. Defaults to None.
         x_format (str, optional): The format of the x axis ticks - can be adjusted to "%" for % values.. Defaults to None.
+        bins (optional): The number of bins or a numpy binning rule. Defaults to "auto".
 
     Returns:
         go.Figure: The graph.
     """
-    fig = px.histogram(
-        estimates,
-        histnorm="probability density",
-        color_discrete_sequence=[PrimaryColors.PURPLE.value],
-        **kwargs,
+    edges, density = histogram_density(estimates, bins=bins)
+    fig = go.Figure(
+        data=go.Bar(
+            x=edges[:-1],
+            y=density,
+            width=np.diff(edges),
+            offset=0,
+            marker_color=PrimaryColors.PURPLE.value,
+        )
+    )
+    fig.update_layout(
+        title=kwargs.get("title"),
+        xaxis=dict(title=kwargs.get("labels", {}).get("value", "value")),
+        bargap=0,
     )
     if x_format is not None:
         fig.update_layout(xaxis=dict(tickformat="0%"))
@@ -51,6 +65,49 @@ def create_fig(
     return fig
 
 
+def create_sensitivity_fig(
+    kpi_values: np.ndarray,
+    financial_values: np.ndarray,
+    probability: np.ndarray,
+    denominator: float = 1,
+    denominator_str: str = "",
+) -> go.Figure:
+    """Creating a heatmap of the probability of beating the wanted CAGR for each combination of estimated kpi and financial.
+
+    Args:
+        kpi_values (np.ndarray): The estimated kpis (rows).
+        financial_values (np.ndarray): The estimated financials (columns).
+        probability (np.ndarray): The probabilities with a row per kpi and a column per financial.
+        denominator (float, optional): The denominator used to display the financials. Defaults to 1.
+        denominator_str (str, optional): The text describing the denominator. Defaults to "".
+
+    Returns:
+        go.Figure: The heatmap.
+    """
+    fig = go.Figure(
+        data=go.Heatmap(
+            x=[str(round(val / denominator, 1)) for val in financial_values],
+            y=[str(round(val, 1)) for val in kpi_values],
+            z=probability,
+            text=[[f"{val:.0%}" for val in row] for row in probability],
+            texttemplate="%{text}",
+            zmin=0,
+            zmax=1,
+            colorscale=[
+                [0, SecondaryColors.LAVENDER.value],
+                [1, PrimaryColors.PURPLE.value],
+            ],
+            showscale=False,
+        )
+    )
+    fig.update_layout(
+        title="Probability of beating the wanted CAGR",
+        xaxis=dict(title=f"Estimated financial{denominator_str}", type="category"),
+        yaxis=dict(title="Estimated KPI", type="category"),
+    )
+    return fig
+
+
 def get_denominator(number: float):
     """Creating a more simple version of the number, i.e. converting 5.634.923 to 5.6 (Millions)
 
@@ -61,6 +118,7 @@ def get_denominator(number: float):
         float: The denominator.
         str: The text to write how the numbers have been reduced.
     """
+    number = abs(number)  # Negative numbers are simplified like positive ones.
     if number * 1.0 / 1e12 > 5:
         return 1e12, " (Trillions)"
     elif number * 1.0 / 1e9 > 5:
@@ -118,58 +176,93 @@ def valuation_overview(
         * denominator
     )
 
-    if st.button("Calculate", key=f"calc_button_{key}"):
-        vals = {
-            "kpi_current": kpi_current,
-            "kpi_estimated": kpi_estimate,
-            "kpi_std": kpi_std,
-            "financial_current": financial_current,
-            "financial_estimated": financial_estimate,
-            "financial_std": financial_std,
-        }
+    vals = {
+        "kpi_current": kpi_current,
+        "kpi_estimated": kpi_estimate,
+        "kpi_std": kpi_std,
+        "financial_current": financial_current,
+        "financial_estimated": financial_estimate,
+        "financial_std": financial_std,
+    }
+    sim = MonteCarloSimulation(**vals)
+
+    # Instant answer from the analytic solution, the simulation is only needed for the histograms.
+    probability = sim.analytic_probability_above(wanted_cagr, periods)
+    valuation_low, valuation_median, valuation_high = sim.analytic_valuation_quantiles(
+        [0.05, 0.5, 0.95]
+    )
+    st.write(
+        f"There are {str(round(probability*100, 1))} % probability of you getting a better CAGR than your needs based on these estimates. "
+        f"The estimated valuation is {get_formatted_number(valuation_median)} with a 90 % interval from {get_formatted_number(valuation_low)} to {get_formatted_number(valuation_high)}."
+    )
 
-        sim = MonteCarloSimulation(**vals)
+    if st.button("Calculate", key=f"calc_button_{key}"):
+        result = sim.run(periods=periods)
 
         # Figures
         estimated_kpi_fig = create_fig(
-            sim.get_kpi_distribution(),
+            result.kpi,
             kpi_current,
             title="Estimated KPI",
             labels={"value": "KPI"},
         )
         estimated_financial_fig = create_fig(
-            sim.get_financial_distribution(),
+            result.financial,
             financial_current,
             title="Estimated Financials",
             labels={"value": "Financials"},
         )
         estimated_valuation_fig = create_fig(
-            sim.get_valuation_distribution(),
+            result.valuation,
             market_cap,
             title="Estimated Valuation",
             labels={"value": "Estimated Valuation"},
         )
 
-        cagr = sim.get_valuation_cagr_distribution(periods=periods)
-        estimated_cagr_fig = create_fig(
-            cagr,
-            current=wanted_cagr,
-            x_format="0%",
-            title="Estimated CAGR",
-            labels={"value": "CAGR"},
-        )
-
         fig_c11, fig_c12 = st.columns(2)
-        fig_c11.plotly_chart(estimated_kpi_fig, use_container_width=True)
-        fig_c12.plotly_chart(estimated_financial_fig, use_container_width=True)
-
         fig_c21, fig_c22 = st.columns(2)
-        fig_c21.plotly_chart(estimated_valuation_fig, use_container_width=True)
-        fig_c22.plotly_chart(estimated_cagr_fig, use_container_width=True)
-
-        st.write(
-            f"There are {str(round(np.mean(cagr>wanted_cagr)*100, 1))} % probability of you getting a better CAGR than your needs based on these estimates."
+        with instrumentation.span("streamlit.plotly_chart"):
+            fig_c11.plotly_chart(estimated_kpi_fig, use_container_width=True)
+            fig_c12.plotly_chart(estimated_financial_fig, use_container_width=True)
+            fig_c21.plotly_chart(estimated_valuation_fig, use_container_width=True)
+
+        if result.cagr is None:
+            fig_c22.write(
+                "It is not possible to calculate a CAGR since some of the estimated valuations are negative."
+            )
+        else:
+            estimated_cagr_fig = create_fig(
+                result.cagr,
+                current=wanted_cagr,
+                x_format="0%",
+                title="Estimated CAGR",
+                labels={"value": "CAGR"},
+            )
+            with instrumentation.span("streamlit.plotly_chart"):
+                fig_c22.plotly_chart(estimated_cagr_fig, use_container_width=True)
+
+        # Sensitivity of the probability to the estimates, simulated as one grid
+        kpi_values = kpi_estimate * np.linspace(0.7, 1.3, 7)
+        financial_values = financial_estimate * np.linspace(0.7, 1.3, 7)
+        grid = simulate_scenarios(
+            kpi_current=kpi_current,
+            financial_current=financial_current,
+            kpi_estimated=kpi_values[:, None],
+            kpi_std=kpi_std,
+            financial_estimated=financial_values[None, :],
+            financial_std=financial_std,
+            periods=periods,
+            wanted_cagr=wanted_cagr,
+        )
+        sensitivity_fig = create_sensitivity_fig(
+            kpi_values,
+            financial_values,
+            grid["probability_above"].to_numpy().reshape(7, 7),
+            denominator=denominator,
+            denominator_str=denominator_str,
         )
+        with instrumentation.span("streamlit.plotly_chart"):
+            st.plotly_chart(sensitivity_fig, use_container_width=True)
 
 
 def main():
@@ -188,30 +281,22 @@ def main():
     print("")
     print("Starting valuation")
     primary_ticker_name = st.session_state["main_ticker"]
-    full_df = st.session_state["data"]
-    market_cap = full_df[
-        (full_df["ticker"] == primary_ticker_name)
-        & (full_df["metric"] == "quarterlyMarketCap")
-        & (full_df["date"] == "2023-03-31")
-    ]["value"].values[0]
-    price_earnings_forward = full_df[
-        (full_df["ticker"] == primary_ticker_name)
-        & (full_df["metric"] == "quarterlyForwardPeRatio")
-        & (full_df["date"] == "2023-03-31")
-    ]["value"].values[0]
-    price_book = full_df[
-        (full_df["ticker"] == primary_ticker_name)
-        & (full_df["metric"] == "quarterlyPbRatio")
-        & (full_df["date"] == "2023-03-31")
-    ]["value"].values[0]
-    price_sales = full_df[
-        (full_df["ticker"] == primary_ticker_name)
-        & (full_df["metric"] == "quarterlyPsRatio")
-        & (full_df["date"] == "2023-03-31")
-    ]["value"].values[0]
+    store = st.session_state["store"]
+    market_cap_date, market_cap = store.latest(
+        primary_ticker_name, "quarterlyMarketCap"
+    )
+    price_earnings_forward = store.latest_value(
+        primary_ticker_name, "quarterlyForwardPeRatio"
+    )
+    price_book = store.latest_value(primary_ticker_name, "quarterlyPbRatio")
+    price_sales = store.latest_value(primary_ticker_name, "quarterlyPsRatio")
 
     print("market cap: ", market_cap)
     print("pe: ", price_earnings_forward)
+    if market_cap is None:
+        st.write(f"There is no market cap available for {primary_ticker_name}.")
+        return
+    st.write(f"The latest figures are from {market_cap_date.date()}.")
 
     periods = st.number_input(
         "How far into the future is your estimates?",
@@ -231,47 +316,64 @@ def main():
     )
 
     with st.expander("Price Earnings (Forward)", expanded=False):
-        earnings = market_cap / price_earnings_forward
-        st.markdown(
-            f"""
-            The current market valuation is {get_formatted_number(market_cap)}
-            The current price earnings is {get_formatted_number(price_earnings_forward)}
-            The current earnings are {get_formatted_number(earnings)}
-            """
-        )
-        valuation_overview(
-            market_cap=market_cap,
-            periods=periods,
-            kpi_current=price_earnings_forward,
-            key="PE",
-            wanted_cagr=wanted_cagr,
-        )
+        if price_earnings_forward is None:
+            st.write("There is no forward price earnings ratio available.")
+        else:
+            earnings = market_cap / price_earnings_forward
+            st.markdown(
+                f"""
+                The current market valuation is {get_formatted_number(market_cap)}
+                The current price earnings is {get_formatted_number(price_earnings_forward)}
+                The current earnings are {get_formatted_number(earnings)}
+                """
+            )
+            valuation_overview(
+                market_cap=market_cap,
+                periods=periods,
+                kpi_current=price_earnings_forward,
+                key="PE",
+                wanted_cagr=wanted_cagr,
+            )
 
     with st.expander("Price Sales", expanded=False):
-        sales = market_cap / price_sales
-        st.markdown(
-            f"""
-            The current market valuation is {get_formatted_number(market_cap)}
-            The current price sales is {get_formatted_number(price_sales)}
-            The current sales are {get_formatted_number(sales)}
-            """
-        )
-        valuation_overview(
-            market_cap=market_cap, periods=periods, kpi_current=price_sales, key="PS"
-        )
+        if price_sales is None:
+            st.write("There is no price sales ratio available.")
+        else:
+            sales = market_cap / price_sales
+            st.markdown(
+                f"""
+                The current market valuation is {get_formatted_number(market_cap)}
+                The current price sales is {get_formatted_number(price_sales)}
+                The current sales are {get_formatted_number(sales)}
+                """
+            )
+            valuation_overview(
+                market_cap=market_cap,
+                periods=periods,
+                kpi_current=price_sales,
+                key="PS",
+            )
 
     with st.expander("Price Book", expanded=False):
-        book_value = market_cap / price_book
-        st.markdown(
-            f"""
-            The current market valuation is {get_formatted_number(market_cap)}
-            The current price book is {get_formatted_number(price_book)}
-            The current book value is {get_formatted_number(book_value)}
-            """
-        )
-        valuation_overview(
-            market_cap=market_cap, periods=periods, kpi_current=price_book, key="PB"
-        )
+        if price_book is None:
+            st.write("There is no price book ratio available.")
+        else:
+            book_value = market_cap / price_book
+            st.markdown(
+                f"""
+                The current market valuation is {get_formatted_number(market_cap)}
+                The current price book is {get_formatted_number(price_book)}
+                The current book value is {get_formatted_number(book_value)}
+                """
+            )
+            valuation_overview(
+                market_cap=market_cap,
+                periods=periods,
+                kpi_current=price_book,
+                key="PB",
+            )
+
+    timings_sidebar()
 
 
 if __name__ == "__main__":
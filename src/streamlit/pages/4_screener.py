@@ -0,0 +1,115 @@
+from pathlib import Path
+import sys
+import os
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+import streamlit as st
+from src.utils.cache import DEFAULT_CACHE_DIR
+from src.utils.instrumentation import timings_sidebar
+from src.utils.screener import Screener, ingest_watchlist, load_watchlist
+
+
+UNIVERSE_PATH = DEFAULT_CACHE_DIR / "universe.parquet"
+
+
+@st.cache_resource(show_spinner=False)
+def get_screener(path: str, modified: float) -> Screener:
+    """Loading the screener of an ingested universe, cached until the file is written again.
+
+    Args:
+        path (str): The path of the parquet file.
+        modified (float): The modification time of the file, used to invalidate the cache.
+
+    Returns:
+        Screener: The screener.
+    """
+    return Screener.from_parquet(path)
+
+
+def ingest():
+    st.subheader("Ingest a watchlist")
+    watchlist = st.file_uploader(
+        "A csv file with a ticker column (or the tickers in the first column)",
+        type="csv",
+    )
+    workers_col, rate_col = st.columns(2)
+    max_workers = workers_col.number_input(
+        "Parallel tickers", min_value=1, max_value=32, value=8, step=1
+    )
+    requests_per_second = rate_col.number_input(
+        "Requests per second", min_value=0.5, max_value=50.0, value=5.0, step=0.5
+    )
+
+    if watchlist is not None and st.button("Ingest", key="ingest"):
+        tickers = load_watchlist(watchlist)
+        progress_text = f"Loading {len(tickers)} tickers from yahoo"
+        progress_bar = st.progress(0, text=progress_text)
+
+        def update_progress(ticker, completed, total):
+            progress_bar.progress(completed / total, text=progress_text)
+
+        rows = ingest_watchlist(
+            tickers,
+            UNIVERSE_PATH,
+            max_workers=max_workers,
+            requests_per_second=requests_per_second,
+            on_complete=update_progress,
+        )
+        progress_bar.progress(1.0, text=f"Done loading {rows} observations")
+
+
+def screen():
+    st.subheader("Screen the universe")
+    if not UNIVERSE_PATH.exists():
+        st.write("Ingest a watchlist to screen it.")
+        return
+
+    screener = get_screener(str(UNIVERSE_PATH), UNIVERSE_PATH.stat().st_mtime)
+    metrics = list(screener.dates)
+    st.write(f"The universe has {len(screener.table)} tickers.")
+
+    chosen_metrics = st.multiselect("Filter on metrics", options=metrics)
+    filters = {}
+    for metric in chosen_metrics:
+        filters[metric] = st.slider(
+            f"Percentile of {metric} ({screener.dates[metric].date()})",
+            min_value=0.0,
+            max_value=1.0,
+            value=(0.0, 1.0),
+            step=0.01,
+        )
+    sort_col, order_col = st.columns(2)
+    sort_by = sort_col.selectbox("Sort by", options=[None] + metrics)
+    order = order_col.radio(
+        "Order", options=["Lowest first", "Highest first"], horizontal=True
+    )
+
+    result = screener.screen(
+        filters, sort_by=sort_by, ascending=order == "Lowest first"
+    )
+    result.columns = [f"{metric} {field}" for metric, field in result.columns]
+    st.write(f"{len(result)} tickers pass the filters.")
+    st.dataframe(result)
+
+
+def main():
+    st.title("Screener")
+    st.markdown(
+        """
+        Use this page to screen a whole watchlist or index instead of a handful of peers.
+
+        Every ticker is ranked against the rest of the universe on the most recent date that most of the tickers have reported,
+        both as a percentile (0 is the lowest value, 1 the highest) and as a z-score.
+        """
+    )
+    ingest()
+    screen()
+    timings_sidebar()
+
+
+if __name__ == "__main__":
+    main()
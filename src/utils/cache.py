@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import pandas as pd
+
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get(
+        "STOCK_INSIGHTS_CACHE_DIR", Path.home() / ".cache" / "stock_insights"
+    )
+)
+DEFAULT_TTL = 7 * 24 * 3600  # Quarterly data only changes a few times a year.
+DEFAULT_MAX_BYTES = 256 * 1024**2
+
+
+class FundamentalsCache:
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        """A persistent SQLite cache of the stats dataframes keyed by ticker and metric set.
+        Every entry has its own expiry time and the least recently used entries are evicted once the cache grows beyond max_bytes.
+
+        Args:
+            cache_dir (str, optional): The directory of the cache database. Defaults to the STOCK_INSIGHTS_CACHE_DIR environment variable or ~/.cache/stock_insights.
+            ttl (float, optional): The default time to live of an entry in seconds. Defaults to one week.
+            max_bytes (int, optional): The maximum total size of the stored entries. Defaults to 256 MB.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.cache_dir / "fundamentals.sqlite", check_same_thread=False
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                ticker TEXT NOT NULL,
+                metric_key TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (ticker, metric_key)
+            )
+            """
+        )
+        self._connection.commit()
+
+    @classmethod
+    def default(cls) -> "FundamentalsCache":
+        """Getting the cache shared by all extractors that are not given a cache explicitly.
+
+        Returns:
+            FundamentalsCache: The shared cache in the default directory.
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    @staticmethod
+    def metric_key(metrics: list) -> str:
+        """Creating a short key for a set of metrics that doesn't depend on the order of the metrics.
+
+        Args:
+            metrics (list): The metrics that were requested.
+
+        Returns:
+            str: The key of the metric set.
+        """
+        joined = ",".join(sorted(set(metrics)))
+        return hashlib.sha1(joined.encode("utf-8")).hexdigest()[:16]
+
+    def get(
+        self, ticker: str, metrics: list, allow_expired: bool = False
+    ) -> pd.DataFrame:
+        """Getting the cached stats for a ticker and metric set.
+
+        Args:
+            ticker (str): The ticker.
+            metrics (list): The metrics that were requested.
+            allow_expired (bool, optional): Whether an expired entry may be returned. Defaults to False.
+
+        Returns:
+            pd.DataFrame: The cached dataframe or None if there is no (valid) entry.
+        """
+        key = self.metric_key(metrics)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT payload, expires_at FROM entries WHERE ticker = ? AND metric_key = ?",
+                (ticker, key),
+            ).fetchone()
+            if row is None:
+                return None
+            payload, expires_at = row
+            if expires_at < now and not allow_expired:
+                return None
+            self._connection.execute(
+                "UPDATE entries SET last_access = ? WHERE ticker = ? AND metric_key = ?",
+                (now, ticker, key),
+            )
+            self._connection.commit()
+        return self._deserialize(payload)
+
+    def put(
+        self, ticker: str, metrics: list, df: pd.DataFrame, ttl: float = None
+    ) -> None:
+        """Storing the stats for a ticker and metric set and evicting old entries if the cache is full.
+
+        Args:
+            ticker (str): The ticker.
+            metrics (list): The metrics that were requested.
+            df (pd.DataFrame): The stats to store.
+            ttl (float, optional): The time to live of the entry in seconds. Defaults to the ttl of the cache.
+        """
+        payload = self._serialize(df)
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ticker,
+                    self.metric_key(metrics),
+                    payload,
+                    len(payload),
+                    now,
+                    expires_at,
+                    now,
+                ),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def invalidate(self, ticker: str = None) -> None:
+        """Removing the entries of a ticker or all entries if no ticker is given.
+
+        Args:
+            ticker (str, optional): The ticker to remove. Defaults to None.
+        """
+        with self._lock:
+            if ticker is None:
+                self._connection.execute("DELETE FROM entries")
+            else:
+                self._connection.execute(
+                    "DELETE FROM entries WHERE ticker = ?", (ticker,)
+                )
+            self._connection.commit()
+
+    def size(self) -> int:
+        """Getting the total size of the stored entries.
+
+        Returns:
+            int: The size in bytes.
+        """
+        with self._lock:
+            (total,) = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return total
+
+    def _evict(self) -> None:
+        """Deleting the least recently used entries until the cache is within max_bytes. Expects the lock to be held."""
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._connection.execute(
+            "SELECT ticker, metric_key, size FROM entries ORDER BY last_access ASC"
+        ).fetchall()
+        for ticker, key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._connection.execute(
+                "DELETE FROM entries WHERE ticker = ? AND metric_key = ?",
+                (ticker, key),
+            )
+            total -= size
+
+    @staticmethod
+    def _serialize(df: pd.DataFrame) -> bytes:
+        """Converting a dataframe into a compressed json payload which keeps the dtypes of the columns and the attrs of the dataframe.
+
+        Args:
+            df (pd.DataFrame): The dataframe to convert.
+
+        Returns:
+            bytes: The payload.
+        """
+        data = {}
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                data[col] = df[col].astype(str).tolist()
+            else:
+                data[col] = df[col].tolist()
+        dtypes = {col: str(dtype) for col, dtype in df.dtypes.items()}
+        payload = json.dumps({"dtypes": dtypes, "data": data, "attrs": df.attrs})
+        return zlib.compress(payload.encode("utf-8"))
+
+    @staticmethod
+    def _deserialize(payload: bytes) -> pd.DataFrame:
+        """Converting a payload created by _serialize back into a dataframe.
+
+        Args:
+            payload (bytes): The payload.
+
+        Returns:
+            pd.DataFrame: The dataframe.
+        """
+        content = json.loads(zlib.decompress(payload).decode("utf-8"))
+        df = pd.DataFrame(data=content["data"], columns=list(content["dtypes"]))
+        for col, dtype in content["dtypes"].items():
+            if dtype.startswith("datetime64"):
+                df[col] = pd.to_datetime(df[col])
+            elif str(df[col].dtype) != dtype:
+                df[col] = df[col].astype(dtype)
+        df.attrs = content.get("attrs", {})
+        return df
+
+
+if __name__ == "__main__":
+    cache = FundamentalsCache()
+    df = pd.DataFrame(
+        data={
+            "metric": ["quarterlyPeRatio"],
+            "date": ["2023-03-31"],
+            "value": [25.0],
+        }
+    )
+    cache.put("AAPL", ["quarterlyPeRatio"], df, ttl=60)
+    print(cache.get("AAPL", ["quarterlyPeRatio"]))
+    print(cache.size())
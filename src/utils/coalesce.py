@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+import time
+
+
+class SingleFlight:
+    def __init__(self, maxsize: int = 256, ttl: float = 300.0) -> None:
+        """Coalescing concurrent calls for the same key into one call and remembering the most recent results.
+        If a call for a key is already running, later callers wait for it and share its result instead of starting their own.
+        Finished results are kept in a bounded LRU for ttl seconds.
+
+        Args:
+            maxsize (int, optional): The maximum number of remembered results. Defaults to 256.
+            ttl (float, optional): How long a result is remembered in seconds. Defaults to 300.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, refresh: bool = False):
+        """Getting the result of fn for a key, either from the remembered results, from a running call or by calling fn.
+
+        Args:
+            key: A hashable key identifying the call.
+            fn (callable): The function to call without arguments.
+            refresh (bool, optional): Whether to ignore a remembered result. Defaults to False.
+
+        Returns:
+            The result of fn. Exceptions raised by fn are raised to every waiting caller.
+        """
+        with self._lock:
+            if not refresh and key in self._results:
+                stored_at, value = self._results[key]
+                if time.monotonic() - stored_at < self.ttl:
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._results[key]
+
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            if value is not None:
+                self._results[key] = (time.monotonic(), value)
+                self._results.move_to_end(key)
+                while len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key=None) -> None:
+        """Forgetting the remembered result of a key or all results if no key is given.
+
+        Args:
+            key (optional): The key to forget. Defaults to None.
+        """
+        with self._lock:
+            if key is None:
+                self._results.clear()
+            else:
+                self._results.pop(key, None)
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    flight = SingleFlight()
+
+    def slow_square():
+        time.sleep(0.5)
+        return 4
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: flight.do("square", slow_square), range(8)))
+    print(results, flight.misses, flight.shared, flight.hits)
@@ -0,0 +1,251 @@
+from bisect import bisect_left
+import functools
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("STOCK_INSIGHTS_INSTRUMENTATION", "") not in ("", "0")
+# The upper bounds of the duration histograms in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _NullSpan:
+    """The span returned while the instrumentation is disabled, entering and leaving it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, instrumentation: "Instrumentation", name: str) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.instrumentation.record(self.name, time.perf_counter() - self.start)
+
+
+class Instrumentation:
+    def __init__(self, enabled: bool = None) -> None:
+        """Collecting named timing spans and counters of the hot paths.
+        While disabled a span is a shared no-op context manager and a counter returns at once, so the instrumentation can stay in the code.
+
+        Args:
+            enabled (bool, optional): Whether to collect anything. Defaults to the STOCK_INSIGHTS_INSTRUMENTATION environment variable.
+        """
+        self.enabled = ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Removing all collected spans and counters."""
+        with self._lock:
+            self._spans = {}
+            self._counters = {}
+
+    def span(self, name: str):
+        """Timing a block of code.
+
+        Args:
+            name (str): The name of the span, e.g. "yahoo.fetch".
+
+        Returns:
+            A context manager recording the duration of the block.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name: str):
+        """Timing every call of a function.
+
+        Args:
+            name (str): The name of the span.
+
+        Returns:
+            A decorator.
+        """
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name: str, seconds: float) -> None:
+        """Recording the duration of a span.
+
+        Args:
+            name (str): The name of the span.
+            seconds (float): The duration.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                }
+            span["count"] += 1
+            span["total"] += seconds
+            span["max"] = max(span["max"], seconds)
+            span["buckets"][bisect_left(BUCKETS, seconds)] += 1
+
+    def count(self, name: str, value: float = 1) -> None:
+        """Increasing a counter.
+
+        Args:
+            name (str): The name of the counter, e.g. "cache.hit".
+            value (float, optional): The increase. Defaults to 1.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        """Getting the collected spans and counters.
+
+        Returns:
+            dict: The spans with their count, total, mean and max duration and the cumulative histogram, and the counters.
+        """
+        with self._lock:
+            spans = {}
+            for name, span in sorted(self._spans.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(list(BUCKETS) + ["+Inf"], span["buckets"]):
+                    cumulative += count
+                    buckets[str(bound)] = cumulative
+                spans[name] = {
+                    "count": span["count"],
+                    "total_seconds": span["total"],
+                    "mean_seconds": span["total"] / span["count"],
+                    "max_seconds": span["max"],
+                    "buckets": buckets,
+                }
+            return {
+                "enabled": self.enabled,
+                "spans": spans,
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def to_json(self) -> str:
+        """Exporting the collected spans and counters as json.
+
+        Returns:
+            str: The json document.
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "stock_insights") -> str:
+        """Exporting the collected spans and counters in the Prometheus text format.
+        The spans become one histogram with a span label and the counters one counter with a name label.
+
+        Args:
+            prefix (str, optional): The prefix of the metric names. Defaults to "stock_insights".
+
+        Returns:
+            str: The metrics in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_span_seconds The duration of the instrumented spans.",
+            f"# TYPE {prefix}_span_seconds histogram",
+        ]
+        for name, span in snapshot["spans"].items():
+            label = _escape_label(name)
+            for bound, count in span["buckets"].items():
+                lines.append(
+                    f'{prefix}_span_seconds_bucket{{span="{label}",le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'{prefix}_span_seconds_sum{{span="{label}"}} {span["total_seconds"]}'
+            )
+            lines.append(
+                f'{prefix}_span_seconds_count{{span="{label}"}} {span["count"]}'
+            )
+        lines += [
+            f"# HELP {prefix}_events_total The instrumented counters.",
+            f"# TYPE {prefix}_events_total counter",
+        ]
+        for name, value in snapshot["counters"].items():
+            lines.append(
+                f'{prefix}_events_total{{name="{_escape_label(name)}"}} {value}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    """Escaping a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def timings_sidebar(instance: Instrumentation = None) -> None:
+    """Showing the collected spans and counters in the Streamlit sidebar together with download buttons for the exports.
+    Nothing is shown while the instrumentation is disabled.
+
+    Args:
+        instance (Instrumentation, optional): The instrumentation to show. Defaults to the shared instrumentation.
+    """
+    instance = instance if instance is not None else instrumentation
+    if not instance.enabled:
+        return
+    import streamlit as st
+
+    snapshot = instance.snapshot()
+    with st.sidebar.expander("Timings", expanded=False):
+        for name, span in snapshot["spans"].items():
+            st.write(
+                f"{name}: {span['count']} calls, {span['mean_seconds'] * 1000:.1f} ms mean, {span['max_seconds'] * 1000:.1f} ms max"
+            )
+        for name, value in snapshot["counters"].items():
+            st.write(f"{name}: {value}")
+        st.download_button(
+            "Download json", instance.to_json(), file_name="timings.json"
+        )
+        st.download_button(
+            "Download prometheus",
+            instance.to_prometheus(),
+            file_name="timings.prom",
+        )
+        if st.button("Reset timings"):
+            instance.reset()
+
+
+# Shared by all modules, so a page load is collected in one place.
+instrumentation = Instrumentation()
+
+
+if __name__ == "__main__":
+    example = Instrumentation(enabled=True)
+    for _ in range(3):
+        with example.span("example.sleep"):
+            time.sleep(0.01)
+    example.count("example.counter")
+    print(example.to_json())
+    print(example.to_prometheus())
@@ -0,0 +1,410 @@
+import itertools
+import numpy as np
+import pandas as pd
+
+_versions = itertools.count(1)
+
+
+class LatestSnapshot:
+    def __init__(self, data: pd.DataFrame = None) -> None:
+        """A materialized view of the most recent observation of every (ticker, metric) series.
+        Lookups are a single dictionary access and new observations can be merged in without recomputing the view.
+
+        Args:
+            data (pd.DataFrame, optional): A long dataframe with a ticker, metric, date and value column. Defaults to None.
+        """
+        self._latest = {}
+        if data is not None:
+            self.update(data)
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def update(self, data: pd.DataFrame) -> None:
+        """Merging new observations into the view. A series is only changed if the new observation is at least as recent.
+
+        Args:
+            data (pd.DataFrame): A long dataframe with a ticker, metric, date and value column.
+        """
+        if len(data) == 0:
+            return
+        df = pd.DataFrame(
+            data={
+                "ticker": data["ticker"].astype(str).to_numpy(),
+                "metric": data["metric"].astype(str).to_numpy(),
+                "date": pd.to_datetime(data["date"]).to_numpy(),
+                "value": data["value"].to_numpy(dtype=np.float64),
+            }
+        )
+        # The last row of every series after sorting by date is its most recent observation.
+        latest = (
+            df.sort_values(by="date", kind="stable")
+            .groupby(["ticker", "metric"], sort=False)
+            .tail(1)
+        )
+        self._merge(
+            latest["ticker"].tolist(),
+            latest["metric"].tolist(),
+            latest["date"].tolist(),
+            latest["value"].tolist(),
+        )
+
+    def _merge(self, tickers: list, metrics: list, dates: list, values: list) -> None:
+        """Merging the most recent observations of a set of series into the view."""
+        for ticker, metric, date, value in zip(tickers, metrics, dates, values):
+            current = self._latest.get((ticker, metric))
+            if current is None or current[0] <= date:
+                self._latest[(ticker, metric)] = (date, value)
+
+    def get(self, ticker: str, metric: str) -> tuple:
+        """Getting the most recent observation of a metric for a ticker.
+
+        Args:
+            ticker (str): The ticker.
+            metric (str): The metric.
+
+        Returns:
+            tuple: The date and the value, or (None, None) if there are no observations.
+        """
+        return self._latest.get((ticker, metric), (None, None))
+
+    def copy(self) -> "LatestSnapshot":
+        snapshot = LatestSnapshot()
+        snapshot._latest = dict(self._latest)
+        return snapshot
+
+    def metric_frame(self, metric: str, tickers: list = None) -> pd.DataFrame:
+        """Getting the most recent observation of a metric for every ticker.
+
+        Args:
+            metric (str): The metric.
+            tickers (list, optional): The tickers to include. Defaults to all tickers with observations of the metric.
+
+        Returns:
+            pd.DataFrame: A dataframe with a ticker, metric, date and value column.
+        """
+        if tickers is None:
+            tickers = [ticker for ticker, key in self._latest if key == metric]
+        rows = [
+            (ticker, metric) + self._latest[(ticker, metric)]
+            for ticker in tickers
+            if (ticker, metric) in self._latest
+        ]
+        return pd.DataFrame(rows, columns=["ticker", "metric", "date", "value"])
+
+
+class MetricStore:
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        value_dtype=np.float64,
+        snapshot: LatestSnapshot = None,
+    ) -> None:
+        """A compact store of the stats of multiple tickers indexed by (ticker, metric, date).
+        Tickers and metrics are stored as integer codes, dates as days since epoch and the rows are sorted by ticker, metric and date,
+        so every (ticker, metric) series is a contiguous slice of the arrays. Of duplicate observations only the last one is kept.
+
+        Args:
+            data (pd.DataFrame): A long dataframe with a ticker, metric, date and value column.
+            value_dtype (optional): The dtype of the stored values, e.g. np.float32 to halve the memory. Defaults to np.float64.
+            snapshot (LatestSnapshot, optional): An up to date snapshot of the latest observations of the data. Defaults to building it from the data.
+        """
+        ticker_codes, tickers = pd.factorize(data["ticker"].astype(str))
+        metric_codes, metrics = pd.factorize(data["metric"].astype(str))
+        self.tickers = tickers.tolist()
+        self.metrics = metrics.tolist()
+        self._ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+
+        # A store is never changed after it is built, so every store is its own version of the data.
+        self.version = next(_versions)
+
+        dates = self._to_days(data["date"])
+        order = np.lexsort((dates, metric_codes, ticker_codes))
+        # The sort is stable, so of duplicate (ticker, metric, date) rows the last one of the data is kept,
+        # the same row the pivots and the latest snapshot use.
+        if len(order) > 0:
+            last = np.r_[
+                (np.diff(ticker_codes[order]) != 0)
+                | (np.diff(metric_codes[order]) != 0)
+                | (np.diff(dates[order]) != 0),
+                True,
+            ]
+            order = order[last]
+        self._ticker_codes = ticker_codes[order].astype(np.int32)
+        self._metric_codes = metric_codes[order].astype(np.int16)
+        self._dates = dates[order]
+        self._values = data["value"].to_numpy(dtype=value_dtype)[order]
+
+        # The start and end of the slice of every (ticker, metric) series.
+        keys = self._ticker_codes.astype(np.int64) * max(len(self.metrics), 1)
+        keys += self._metric_codes
+        starts = np.flatnonzero(np.r_[True, np.diff(keys) != 0]) if len(keys) else []
+        ends = np.r_[starts[1:], len(keys)] if len(keys) else []
+        self._slices = {
+            (int(self._ticker_codes[start]), int(self._metric_codes[start])): (
+                int(start),
+                int(end),
+            )
+            for start, end in zip(starts, ends)
+        }
+
+        # The rows of every metric, still sorted by ticker and date.
+        by_metric = np.argsort(self._metric_codes, kind="stable")
+        counts = np.bincount(self._metric_codes, minlength=len(self.metrics))
+        self._metric_rows = np.split(by_metric, np.cumsum(counts)[:-1])
+
+        # The latest observation of a series is the last row of its slice.
+        if snapshot is None:
+            snapshot = LatestSnapshot()
+            last = np.array(
+                [end - 1 for _, end in self._slices.values()], dtype=np.int64
+            )
+            snapshot._merge(
+                np.array(self.tickers, dtype=object)[self._ticker_codes[last]].tolist(),
+                np.array(self.metrics, dtype=object)[self._metric_codes[last]].tolist(),
+                pd.DatetimeIndex(
+                    self._dates[last].astype("datetime64[D]").astype("datetime64[ns]")
+                ).tolist(),
+                self._values[last].astype(np.float64).tolist(),
+            )
+        self.snapshot = snapshot
+
+        # The number of tickers of every metric.
+        series_metrics = np.array(
+            [metric for _, metric in self._slices], dtype=np.int64
+        )
+        self._coverage = pd.Series(
+            np.bincount(series_metrics, minlength=len(self.metrics)),
+            index=self.metrics,
+            name="ticker",
+        )
+
+        # A date x ticker pivot of every metric, so switching metric doesn't touch the other observations.
+        ticker_index = pd.Index(self.tickers, name="ticker")
+        self._pivots = []
+        for rows in self._metric_rows:
+            days, date_codes = np.unique(self._dates[rows], return_inverse=True)
+            values = np.full((len(days), len(self.tickers)), np.nan, dtype=value_dtype)
+            values[date_codes, self._ticker_codes[rows]] = self._values[rows]
+            self._pivots.append(
+                pd.DataFrame(
+                    values,
+                    index=pd.DatetimeIndex(
+                        days.astype("datetime64[D]").astype("datetime64[ns]"),
+                        name="date",
+                    ),
+                    columns=ticker_index,
+                    copy=False,
+                )
+            )
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def _to_days(dates) -> np.ndarray:
+        """Converting dates into the number of days since epoch.
+
+        Args:
+            dates: A date, a string or an array-like of them.
+
+        Returns:
+            np.ndarray: The days since epoch.
+        """
+        if np.isscalar(dates) or isinstance(dates, pd.Timestamp):
+            return np.datetime64(pd.Timestamp(dates), "D").astype(np.int32)
+        return pd.to_datetime(dates).to_numpy(dtype="datetime64[D]").astype(np.int32)
+
+    def _slice(self, ticker: str, metric: str) -> tuple:
+        """Getting the start and end of the rows of a (ticker, metric) series.
+
+        Returns:
+            tuple: The start and end index, or (0, 0) if the series doesn't exist.
+        """
+        ticker_code = self._ticker_index.get(ticker)
+        metric_code = self._metric_index.get(metric)
+        if ticker_code is None or metric_code is None:
+            return 0, 0
+        return self._slices.get((ticker_code, metric_code), (0, 0))
+
+    def value(self, ticker: str, metric: str, date) -> float:
+        """Getting the value of a metric for a ticker on a given date.
+
+        Args:
+            ticker (str): The ticker.
+            metric (str): The metric.
+            date: The date as a string or timestamp.
+
+        Returns:
+            float: The value, or None if there is no observation on the date.
+        """
+        start, end = self._slice(ticker, metric)
+        day = self._to_days(date)
+        idx = start + np.searchsorted(self._dates[start:end], day)
+        if idx < end and self._dates[idx] == day:
+            return float(self._values[idx])
+        return None
+
+    def series(self, ticker: str, metric: str) -> pd.Series:
+        """Getting the full history of a metric for a ticker.
+
+        Args:
+            ticker (str): The ticker.
+            metric (str): The metric.
+
+        Returns:
+            pd.Series: The values indexed by date.
+        """
+        start, end = self._slice(ticker, metric)
+        return pd.Series(
+            self._values[start:end],
+            index=self._dates[start:end]
+            .astype("datetime64[D]")
+            .astype("datetime64[ns]"),
+            name=metric,
+        )
+
+    def latest(self, ticker: str, metric: str) -> tuple:
+        """Getting the most recent observation of a metric for a ticker.
+
+        Args:
+            ticker (str): The ticker.
+            metric (str): The metric.
+
+        Returns:
+            tuple: The date and the value, or (None, None) if there are no observations.
+        """
+        return self.snapshot.get(ticker, metric)
+
+    def latest_value(self, ticker: str, metric: str) -> float:
+        """Getting the most recent value of a metric for a ticker.
+
+        Args:
+            ticker (str): The ticker.
+            metric (str): The metric.
+
+        Returns:
+            float: The value, or None if there are no observations.
+        """
+        return self.snapshot.get(ticker, metric)[1]
+
+    def extend(self, data: pd.DataFrame) -> "MetricStore":
+        """Creating a new store with additional observations. The latest snapshot is updated with the new observations only.
+
+        Args:
+            data (pd.DataFrame): A long dataframe with a ticker, metric, date and value column.
+
+        Returns:
+            MetricStore: The new store.
+        """
+        snapshot = self.snapshot.copy()
+        snapshot.update(data)
+        current = self.to_frame()
+        # The constructor keeps the last of duplicate observations, i.e. the new ones.
+        combined = pd.concat([current, data[current.columns]])
+        return MetricStore(combined, value_dtype=self._values.dtype, snapshot=snapshot)
+
+    def metric_frame(self, metric: str) -> pd.DataFrame:
+        """Getting all observations of a metric.
+
+        Args:
+            metric (str): The metric.
+
+        Returns:
+            pd.DataFrame: A long dataframe with a ticker, metric, date and value column sorted by ticker and date.
+        """
+        metric_code = self._metric_index.get(metric)
+        rows = (
+            self._metric_rows[metric_code]
+            if metric_code is not None
+            else np.array([], dtype=np.int64)
+        )
+        return pd.DataFrame(
+            data={
+                "ticker": np.array(self.tickers, dtype=object)[
+                    self._ticker_codes[rows]
+                ],
+                "metric": metric,
+                "date": self._dates[rows]
+                .astype("datetime64[D]")
+                .astype("datetime64[ns]"),
+                "value": self._values[rows],
+            }
+        )
+
+    def coverage(self) -> pd.Series:
+        """Counting how many tickers that have observations of each metric.
+
+        Returns:
+            pd.Series: The number of tickers indexed by metric.
+        """
+        return self._coverage.copy()
+
+    def pivot(self, metric: str) -> pd.DataFrame:
+        """Getting the precomputed pivot of a metric.
+        The pivot is shared by all callers, so it shouldn't be modified.
+
+        Args:
+            metric (str): The metric.
+
+        Returns:
+            pd.DataFrame: The values with a date index, a column per ticker and NaN where a ticker has no observation.
+        """
+        metric_code = self._metric_index.get(metric)
+        if metric_code is None:
+            return pd.DataFrame(
+                columns=pd.Index(self.tickers, name="ticker"),
+                index=pd.DatetimeIndex([], name="date"),
+                dtype=self._values.dtype,
+            )
+        return self._pivots[metric_code]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Converting the store back into a long dataframe.
+
+        Returns:
+            pd.DataFrame: A long dataframe with a ticker, metric, date and value column.
+        """
+        return pd.DataFrame(
+            data={
+                "ticker": np.array(self.tickers, dtype=object)[self._ticker_codes],
+                "metric": np.array(self.metrics, dtype=object)[self._metric_codes],
+                "date": self._dates.astype("datetime64[D]").astype("datetime64[ns]"),
+                "value": self._values,
+            }
+        )
+
+
+if __name__ == "__main__":
+    df = pd.DataFrame(
+        data={
+            "ticker": ["AAPL", "AAPL", "AAPL", "MSFT"],
+            "metric": [
+                "quarterlyPeRatio",
+                "quarterlyPeRatio",
+                "quarterlyMarketCap",
+                "quarterlyPeRatio",
+            ],
+            "date": ["2022-12-31", "2023-03-31", "2023-03-31", "2023-03-31"],
+            "value": [24.0, 26.0, 2.6e12, 30.0],
+        }
+    )
+    store = MetricStore(df)
+    print(store.value("AAPL", "quarterlyPeRatio", "2023-03-31"))
+    print(store.latest("AAPL", "quarterlyPeRatio"))
+    print(store.metric_frame("quarterlyPeRatio"))
+    print(store.coverage())
+    print(store.pivot("quarterlyPeRatio"))
+    store = store.extend(
+        pd.DataFrame(
+            data={
+                "ticker": ["MSFT"],
+                "metric": ["quarterlyPeRatio"],
+                "date": ["2023-06-30"],
+                "value": [32.0],
+            }
+        )
+    )
+    print(store.latest("MSFT", "quarterlyPeRatio"))
+    print(store.snapshot.metric_frame("quarterlyPeRatio"))
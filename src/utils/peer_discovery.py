@@ -0,0 +1,128 @@
+from pathlib import Path
+import sys
+
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import pandas as pd
+from src.utils.yf_extractor import YahooExtractor
+
+
+class PeerDiscovery:
+    def __init__(
+        self,
+        max_depth: int = 2,
+        fan_out: int = 5,
+        max_workers: int = 16,
+        max_symbols: int = 500,
+        transport=None,
+    ) -> None:
+        """Discovering a peer universe by expanding the recommendation graph of yahoo breadth-first.
+        Every level of the graph is fetched concurrently, every symbol is only fetched once and the candidates are ranked
+        by how many of the crawled symbols recommend them.
+
+        Args:
+            max_depth (int, optional): How many levels of recommendations to follow from the ticker. Defaults to 2.
+            fan_out (int, optional): How many recommendations of each symbol to follow. Defaults to 5.
+            max_workers (int, optional): The maximum number of concurrent requests. Defaults to 16.
+            max_symbols (int, optional): The maximum number of symbols to fetch in one crawl. Defaults to 500.
+            transport (optional): The transport of the extractors, see src.utils.transport. Defaults to YahooExtractor.default_transport.
+        """
+        self.max_depth = max_depth
+        self.fan_out = fan_out
+        self.max_workers = max_workers
+        self.max_symbols = max_symbols
+        self.transport = transport
+        # The recommendations of the symbols fetched by earlier crawls.
+        self._recommendations = {}
+        self._lock = threading.Lock()
+
+    def recommendations(self, symbol: str) -> list:
+        """Getting the recommended symbols of a symbol, remembering the result for later crawls.
+
+        Args:
+            symbol (str): The symbol.
+
+        Returns:
+            list: The recommended symbols, empty if there are none.
+        """
+        with self._lock:
+            if symbol in self._recommendations:
+                return self._recommendations[symbol]
+        symbols = YahooExtractor(
+            symbol, cache=False, transport=self.transport
+        ).get_recommended_symbols()
+        symbols = symbols if symbols is not None else []
+        with self._lock:
+            self._recommendations[symbol] = symbols
+        return symbols
+
+    def discover(self, ticker: str, on_level=None) -> pd.DataFrame:
+        """Crawling the recommendation graph from a ticker and ranking the candidates.
+
+        Args:
+            ticker (str): The ticker to find peers for.
+            on_level (callable, optional): Called with the depth and the number of fetched symbols after each level. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The candidates with a symbol, co_occurrences and depth column, sorted with the best candidates first.
+                co_occurrences is the number of crawled symbols recommending the candidate and depth is the level it was first found at.
+        """
+        visited = {ticker}
+        depth_found = {}
+        counts = {}
+        frontier = [ticker]
+        fetched = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for depth in range(1, self.max_depth + 1):
+                frontier = frontier[: max(self.max_symbols - fetched, 0)]
+                if not frontier:
+                    break
+                fetched += len(frontier)
+
+                # map keeps the order of the frontier, so the crawl is deterministic.
+                next_frontier = []
+                for symbols in pool.map(self.recommendations, frontier):
+                    for symbol in dict.fromkeys(symbols[: self.fan_out]):
+                        if symbol == ticker:
+                            continue
+                        counts[symbol] = counts.get(symbol, 0) + 1
+                        depth_found.setdefault(symbol, depth)
+                        if symbol not in visited:
+                            visited.add(symbol)
+                            next_frontier.append(symbol)
+                frontier = next_frontier
+                if on_level is not None:
+                    on_level(depth, fetched)
+
+        candidates = pd.DataFrame(
+            data={
+                "symbol": list(counts),
+                "co_occurrences": list(counts.values()),
+                "depth": [depth_found[symbol] for symbol in counts],
+            }
+        )
+        # Ties keep the order the candidates were found in.
+        return candidates.sort_values(
+            by=["co_occurrences", "depth"], ascending=[False, True], kind="stable"
+        ).reset_index(drop=True)
+
+    def suggest(self, ticker: str, n_peers: int = 5) -> list:
+        """Suggesting a peer universe for a ticker.
+
+        Args:
+            ticker (str): The ticker to find peers for.
+            n_peers (int, optional): The number of peers. Defaults to 5.
+
+        Returns:
+            list: The best ranked candidates.
+        """
+        return self.discover(ticker)["symbol"].head(n_peers).tolist()
+
+
+if __name__ == "__main__":
+    discovery = PeerDiscovery(max_depth=2, fan_out=5)
+    print(discovery.discover("AAPL").head(10))
+    print(discovery.suggest("AAPL"))
@@ -0,0 +1,366 @@
+from pathlib import Path
+import sys
+
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from src.utils.instrumentation import instrumentation
+from src.utils.metric_store import MetricStore
+from src.utils.simulation import MonteCarloSimulation
+from src.utils.transport import ThrottledTransport
+from src.utils.yf_extractor import YahooExtractor
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# The kpis valued by the valuation page with the metric they are read from.
+VALUATION_KPIS = {
+    "PE": "quarterlyForwardPeRatio",
+    "PS": "quarterlyPsRatio",
+    "PB": "quarterlyPbRatio",
+}
+# The share of the tickers that must have a metric, as on the analysis page.
+COVERAGE_LIMIT = 0.75
+QUANTILES = [0.05, 0.5, 0.95]
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError(
+            "The pipeline needs pyarrow, install it with pip install stock-insights[pipeline]"
+        )
+
+
+@dataclass
+class Job:
+    """A primary ticker and its peers."""
+
+    ticker: str
+    peers: list = field(default_factory=list)
+
+    @property
+    def job_id(self) -> str:
+        """A file name safe id of the job which is the same across runs."""
+        safe_ticker = re.sub(r"[^A-Za-z0-9._-]", "_", self.ticker)
+        peers_hash = hashlib.sha1(",".join(self.peers).encode("utf-8")).hexdigest()
+        return f"{safe_ticker}_{peers_hash[:8]}"
+
+
+def load_jobs(path: str) -> list:
+    """Reading the jobs from a json or csv file.
+    A json file contains a list of objects with a ticker and a list of peers,
+    a csv file has a ticker column and a peers column with the peers separated by spaces, commas or semicolons.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        list: The jobs.
+    """
+    if str(path).endswith(".json"):
+        with open(path) as f:
+            return [
+                Job(job["ticker"], list(job.get("peers", []))) for job in json.load(f)
+            ]
+
+    df = pd.read_csv(path, dtype=str).fillna("")
+    jobs = []
+    for row in df.to_dict("records"):
+        peers = row.get("peers", "").strip()
+        jobs.append(
+            Job(row["ticker"].strip(), re.split(r"[\s,;]+", peers) if peers else [])
+        )
+    return jobs
+
+
+def select_metrics(store: MetricStore, n_tickers: int) -> list:
+    """Selecting the metrics that at least 75 % of the tickers have, like the analysis page.
+
+    Args:
+        store (MetricStore): The stats of the tickers.
+        n_tickers (int): The number of tickers of the job.
+
+    Returns:
+        list: The selected metrics.
+    """
+    coverage = store.coverage()
+    return coverage[coverage >= n_tickers * COVERAGE_LIMIT].index.tolist()
+
+
+def value_ticker(
+    store: MetricStore,
+    ticker: str,
+    periods: float = 1.0,
+    wanted_cagr: float = 0.0,
+    seed: int = None,
+) -> list:
+    """Simulating the valuation of a ticker for every kpi, estimating the kpi and financial at their current values with a standard deviation of 4 %.
+    Unlike the starting values of the valuation page, the estimates aren't rounded, since nobody adjusts them afterwards.
+
+    Args:
+        store (MetricStore): The stats of the tickers.
+        ticker (str): The ticker to value.
+        periods (float, optional): The number of periods until the estimates are realised. Defaults to 1.
+        wanted_cagr (float, optional): The wanted cagr. Defaults to 0.
+        seed (int, optional): The seed of the simulations. Defaults to None.
+
+    Returns:
+        list: A dictionary per kpi with the inputs, the valuation and cagr quantiles and the probability of beating the wanted cagr.
+    """
+    market_cap_date, market_cap = store.latest(ticker, "quarterlyMarketCap")
+    if market_cap is None:
+        return []
+
+    valuations = []
+    for kpi, metric in VALUATION_KPIS.items():
+        kpi_current = store.latest_value(ticker, metric)
+        if kpi_current is None or kpi_current == 0:
+            continue
+        financial_current = market_cap / kpi_current
+        sim = MonteCarloSimulation(
+            kpi_current=kpi_current,
+            kpi_estimated=kpi_current,
+            kpi_std=abs(kpi_current) / 25,
+            financial_current=financial_current,
+            financial_estimated=financial_current,
+            financial_std=abs(financial_current) / 25,
+            seed=seed,
+        )
+        result = sim.run(periods)
+        valuation = {
+            "kpi": kpi,
+            "metric": metric,
+            "date": str(market_cap_date.date()),
+            "market_cap": market_cap,
+            "kpi_current": kpi_current,
+            "probability_above": result.probability_above(wanted_cagr),
+        }
+        for q, value in zip(QUANTILES, np.quantile(result.valuation, QUANTILES)):
+            valuation[f"valuation_q{q:g}"] = float(value)
+        for q in QUANTILES:
+            valuation[f"cagr_q{q:g}"] = (
+                float(np.quantile(result.cagr, q)) if result.cagr is not None else None
+            )
+        valuations.append(valuation)
+    return valuations
+
+
+def run_job(
+    job: Job,
+    out_dir: Path,
+    max_workers: int = 8,
+    periods: float = 1.0,
+    wanted_cagr: float = 0.0,
+    transport=None,
+) -> dict:
+    """Running the extraction, the metric selection and the valuations of a job and writing its results.
+    The stats are written to <job_id>.parquet and the result to <job_id>.json, which is written last so it marks the job as done.
+
+    Args:
+        job (Job): The job.
+        out_dir (Path): The output directory.
+        max_workers (int, optional): The maximum number of tickers of the job fetched at the same time. Defaults to 8.
+        periods (float, optional): The number of periods of the valuations. Defaults to 1.
+        wanted_cagr (float, optional): The wanted cagr of the valuations. Defaults to 0.
+        transport (optional): The transport of the extractors. Defaults to YahooExtractor.default_transport.
+
+    Returns:
+        dict: The result of the job.
+    """
+    start = time.perf_counter()
+    tickers = [job.ticker] + [peer for peer in job.peers if peer != ""]
+    df = YahooExtractor.get_stats_many(
+        tickers, max_workers=max_workers, transport=transport
+    )
+    failed = df.attrs.get("failed_tickers", {})
+    if job.ticker in failed:
+        raise ValueError(
+            f"Couldn't extract the stats for {job.ticker}: {failed[job.ticker]}"
+        )
+    if len(df) == 0 or job.ticker not in set(df["ticker"]):
+        raise ValueError(f"No stats were found for {job.ticker}")
+    store = MetricStore(df)
+
+    # The same seed for the same ticker, so a resumed run gives the same result.
+    seed = zlib.crc32(job.ticker.encode("utf-8"))
+    result = {
+        "job_id": job.job_id,
+        "ticker": job.ticker,
+        "peers": job.peers,
+        "missing_tickers": [
+            ticker for ticker in tickers if ticker not in store.tickers
+        ],
+        "metrics": select_metrics(store, len(tickers)),
+        "valuations": value_ticker(
+            store, job.ticker, periods=periods, wanted_cagr=wanted_cagr, seed=seed
+        ),
+    }
+
+    store.to_frame().to_parquet(out_dir / f"{job.job_id}.parquet", index=False)
+    result["seconds"] = time.perf_counter() - start
+    tmp_path = out_dir / f"{job.job_id}.json.tmp"
+    tmp_path.write_text(json.dumps(result))
+    os.replace(tmp_path, out_dir / f"{job.job_id}.json")
+    return result
+
+
+def run_pipeline(
+    jobs: list,
+    out_dir: str,
+    max_jobs: int = 4,
+    max_workers: int = 8,
+    requests_per_second: float = None,
+    periods: float = 1.0,
+    wanted_cagr: float = 0.0,
+    resume: bool = True,
+    transport=None,
+) -> dict:
+    """Running jobs in parallel and writing a run summary and a table of all valuations.
+    Jobs that already have a result in the output directory are skipped when resuming, so a failed run can be started again.
+    With the instrumentation enabled the timings are added to the summary and written to metrics.prom.
+
+    Args:
+        jobs (list): The jobs.
+        out_dir (str): The output directory.
+        max_jobs (int, optional): The maximum number of jobs running at the same time. Defaults to 4.
+        max_workers (int, optional): The maximum number of tickers fetched at the same time per job. Defaults to 8.
+        requests_per_second (float, optional): A limit of the requests per second across all jobs. Defaults to no limit.
+        periods (float, optional): The number of periods of the valuations. Defaults to 1.
+        wanted_cagr (float, optional): The wanted cagr of the valuations. Defaults to 0.
+        resume (bool, optional): Whether to skip the jobs that are done. Defaults to True.
+        transport (optional): The transport of the extractors. Defaults to YahooExtractor.default_transport.
+
+    Returns:
+        dict: The run summary.
+
+    Raises:
+        ImportError: If pyarrow isn't installed.
+    """
+    _require_pyarrow()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if requests_per_second is not None:
+        transport = ThrottledTransport(
+            transport if transport is not None else YahooExtractor.default_transport,
+            rate=requests_per_second,
+        )
+
+    started = time.time()
+    jobs = list({job.job_id: job for job in jobs}.values())
+    done = {
+        job.job_id
+        for job in jobs
+        if resume and (out_dir / f"{job.job_id}.json").exists()
+    }
+    pending = [job for job in jobs if job.job_id not in done]
+
+    failures = {}
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+        futures = {
+            pool.submit(
+                run_job,
+                job,
+                out_dir,
+                max_workers=max_workers,
+                periods=periods,
+                wanted_cagr=wanted_cagr,
+                transport=transport,
+            ): job
+            for job in pending
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                future.result()
+                completed += 1
+            except Exception as e:
+                failures[job.job_id] = repr(e)
+                print(f"Job {job.job_id} failed: {e!r}")
+
+    # Collecting the valuations of every finished job, including the ones from earlier runs.
+    rows = []
+    for job in jobs:
+        path = out_dir / f"{job.job_id}.json"
+        if path.exists():
+            result = json.loads(path.read_text())
+            for valuation in result["valuations"]:
+                rows.append({"job_id": job.job_id, "ticker": job.ticker, **valuation})
+    pd.DataFrame(rows).to_parquet(out_dir / "valuations.parquet", index=False)
+
+    summary = {
+        "started": started,
+        "seconds": time.time() - started,
+        "jobs": len(jobs),
+        "completed": completed,
+        "skipped": len(done),
+        "failed": len(failures),
+        "failures": failures,
+        "settings": {
+            "max_jobs": max_jobs,
+            "max_workers": max_workers,
+            "requests_per_second": requests_per_second,
+            "periods": periods,
+            "wanted_cagr": wanted_cagr,
+        },
+    }
+    if instrumentation.enabled:
+        summary["instrumentation"] = instrumentation.snapshot()
+        (out_dir / "metrics.prom").write_text(instrumentation.to_prometheus())
+    (out_dir / "summary.json").write_text(json.dumps(summary, indent=2))
+    return summary
+
+
+def main(argv: list = None) -> int:
+    """Running the batch pipeline from the command line.
+
+    Returns:
+        int: The exit code, 1 if any job failed.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Extract, select metrics and value (ticker, peers) jobs without Streamlit."
+    )
+    parser.add_argument("jobs", help="A json or csv file with the jobs.")
+    parser.add_argument("out_dir", help="The directory of the results.")
+    parser.add_argument("--max-jobs", type=int, default=4)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--periods", type=float, default=1.0)
+    parser.add_argument("--wanted-cagr", type=float, default=0.0)
+    parser.add_argument(
+        "--no-resume", action="store_true", help="Run the jobs that are done again."
+    )
+    args = parser.parse_args(argv)
+
+    summary = run_pipeline(
+        load_jobs(args.jobs),
+        args.out_dir,
+        max_jobs=args.max_jobs,
+        max_workers=args.max_workers,
+        requests_per_second=args.requests_per_second,
+        periods=args.periods,
+        wanted_cagr=args.wanted_cagr,
+        resume=not args.no_resume,
+    )
+    print(
+        f"{summary['completed']} completed, {summary['skipped']} skipped and {summary['failed']} failed in {summary['seconds']:.1f} seconds"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
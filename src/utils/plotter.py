@@ -3,27 +3,213 @@ import sys
 path_root = Path(__file__).parents[2]
 sys.path.append(str(path_root))
 
-import plotly.express as px
+from collections import OrderedDict
+import hashlib
+import threading
 import plotly.colors as pc
 import plotly.graph_objects as go
+from src.utils.instrumentation import instrumentation
 from src.utils.styling import PrimaryColors, SecondaryColors, ColorList
+import numpy as np
 import pandas as pd
 
 
+def histogram_density(values, bins="auto", max_bins: int = 200) -> tuple:
+    """Binning the values on the server, so only the bin edges and densities have to be sent to the browser.
+
+    Args:
+        values (np.ndarray): The values, non-finite values are ignored.
+        bins (optional): The number of bins or a numpy binning rule such as "auto" or "fd". Defaults to "auto".
+        max_bins (int, optional): The maximum number of bins an adaptive rule may choose. Defaults to 200.
+
+    Returns:
+        np.ndarray: The bin edges.
+        np.ndarray: The probability density of each bin.
+    """
+    values = np.asarray(values)
+    values = values[np.isfinite(values)]
+    if len(values) == 0:
+        return np.array([0.0, 1.0]), np.array([0.0])
+    if isinstance(bins, str):
+        edges = np.histogram_bin_edges(values, bins=bins)
+        if len(edges) - 1 > max_bins:
+            edges = np.histogram_bin_edges(values, bins=max_bins)
+    else:
+        edges = np.histogram_bin_edges(values, bins=bins)
+    density, edges = np.histogram(values, bins=edges, density=True)
+    return edges, density
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int, lengths: list = None) -> np.ndarray:
+    """Downsampling series with the Largest-Triangle-Three-Buckets algorithm, which keeps the visual shape of the series.
+    The first and last points are always kept, and from every bucket in between the point spanning the largest triangle
+    with the previously kept point and the average of the next bucket is kept.
+    Multiple series are downsampled together, so the work is vectorized across the series and only loops over the buckets.
+
+    Args:
+        x (np.ndarray): The x values as numbers, sorted within each series.
+        y (np.ndarray): The y values.
+        n_out (int): The number of points to keep per series.
+        lengths (list, optional): The lengths of the series if x and y contain multiple series after each other. Defaults to a single series.
+
+    Returns:
+        np.ndarray: The sorted indices of the kept points.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    lengths = np.asarray([len(x)] if lengths is None else lengths, dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    if n_out < 3:
+        return np.arange(len(x))
+
+    # Series that are short enough are kept as they are.
+    keep = [
+        np.arange(offset, offset + length)
+        for offset, length in zip(offsets, lengths)
+        if length <= n_out
+    ]
+    long = lengths > n_out
+    n, offset = lengths[long][:, None], offsets[long][:, None]
+    if len(n):
+        # The bucket edges of every series, bucket i is [edges[:, i], edges[:, i + 1]).
+        # Integer division, so an edge isn't moved by one when (n - 2) * i / (n_out - 2) rounds just below an integer.
+        edges = np.empty((len(n), n_out), dtype=np.int64)
+        edges[:, :-1] = 1 + (n - 2) * np.arange(n_out - 1) // (n_out - 2)
+        edges[:, -1] = n[:, 0]
+        edges += offset
+
+        # The average point of every bucket from cumulative sums.
+        x_sum = np.r_[0, np.cumsum(x)]
+        y_sum = np.r_[0, np.cumsum(y)]
+        size = np.diff(edges, axis=1)
+        x_mean = (x_sum[edges[:, 1:]] - x_sum[edges[:, :-1]]) / size
+        y_mean = (y_sum[edges[:, 1:]] - y_sum[edges[:, :-1]]) / size
+
+        rows = np.arange(len(n))
+        window = np.arange(size[:, :-1].max())
+        selected = np.empty((len(n), n_out), dtype=np.int64)
+        selected[:, 0] = offset[:, 0]
+        selected[:, -1] = edges[:, -1] - 1
+        for i in range(n_out - 2):
+            # Points beyond the end of a bucket are clamped to its last point.
+            idx = np.minimum(edges[:, i, None] + window, edges[:, i + 1, None] - 1)
+            x_a = x[selected[:, i]][:, None]
+            y_a = y[selected[:, i]][:, None]
+            area = np.abs(
+                (x_a - x_mean[:, i + 1, None]) * (y[idx] - y_a)
+                - (x_a - x[idx]) * (y_mean[:, i + 1, None] - y_a)
+            )
+            selected[:, i + 1] = idx[rows, np.argmax(area, axis=1)]
+        keep.append(selected.ravel())
+    return np.sort(np.concatenate(keep))
+
+
 class Plotter:
-    def __init__(self, data: pd.DataFrame, primary_ticker: str, peers: list) -> None:
+    # Above this number of points the line plots are drawn with WebGL instead of SVG.
+    webgl_threshold = 1000
+
+    # The built figures are shared by all plotters and kept in a bounded LRU.
+    figure_cache_size = 64
+    cache_hits = 0
+    cache_misses = 0
+    _figures = OrderedDict()
+    _figures_lock = threading.Lock()
+
+    def __init__(
+        self,
+        data: pd.DataFrame,
+        primary_ticker: str,
+        peers: list,
+        render_mode: str = "auto",
+        width: int = 800,
+        points_per_pixel: float = 1.0,
+        data_version=None,
+    ) -> None:
         """Creating a plotting function primarily to ensure that the coloring is consistent across graphs.
 
         Args:
-            data (pd.DataFrame): A dataframe containing all data that can be plotted.
+            data (pd.DataFrame): A dataframe containing all data that can be plotted. Either long with a ticker and a date column,
+                or a pivot of a single metric with a date index and a column per ticker, e.g. from MetricStore.pivot.
             primary_ticker (str): The primary ticker used to make sure that this ticker is highlighted
             peers (list): A list of peers.
+            render_mode (str, optional): "svg", "webgl" or "auto" to use WebGL once a line plot has more than webgl_threshold points. Defaults to "auto".
+            width (int, optional): The expected width of the plots in pixels. Defaults to 800.
+            points_per_pixel (float, optional): The number of points kept per series for each pixel of width when downsampling. Defaults to 1.
+            data_version (optional): A hashable version of the data, e.g. the version of a MetricStore and the metric.
+                Built figures are reused as long as the version is the same. Defaults to a hash of the content of the data.
         """
+        if render_mode not in ("auto", "svg", "webgl"):
+            raise ValueError(f"Unknown render mode: {render_mode}")
         self.data = data
+        self.wide = "ticker" not in data.columns
         self.primary_ticker = primary_ticker
         self.peers = peers
+        self.render_mode = render_mode
+        self.width = width
+        self.points_per_pixel = points_per_pixel
+        self.data_version = (
+            data_version if data_version is not None else self._hash_data(data)
+        )
         self._create_color_dict()
 
+    @staticmethod
+    def _hash_data(data: pd.DataFrame) -> str:
+        """Hashing the content of a dataframe, so figures are rebuilt when the data changes.
+
+        Args:
+            data (pd.DataFrame): The dataframe.
+
+        Returns:
+            str: The hash of the columns and values.
+        """
+        digest = hashlib.sha1(str(list(data.columns)).encode("utf-8"))
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy())
+        return digest.hexdigest()
+
+    def _cached_figure(self, key: tuple, build) -> go.Figure:
+        """Getting a built figure from the figure cache or building and storing it.
+        The figures are shared, so they shouldn't be modified by the caller.
+
+        Args:
+            key (tuple): The key of the figure, the data version and the styling of the plotter are added to it.
+            build (callable): The function building the figure.
+
+        Returns:
+            go.Figure: The figure.
+        """
+        key = key + (
+            self.data_version,
+            str(self.primary_ticker),
+            tuple(self.peers),
+            self.render_mode,
+            self.width,
+            self.points_per_pixel,
+        )
+        cls = type(self)
+        with cls._figures_lock:
+            fig = cls._figures.get(key)
+            if fig is not None:
+                cls._figures.move_to_end(key)
+                cls.cache_hits += 1
+                instrumentation.count("plotter.figure_cache.hit")
+                return fig
+            cls.cache_misses += 1
+        instrumentation.count("plotter.figure_cache.miss")
+
+        with instrumentation.span(f"plotter.build.{key[0]}"):
+            fig = build()
+        with cls._figures_lock:
+            cls._figures[key] = fig
+            while len(cls._figures) > cls.figure_cache_size:
+                cls._figures.popitem(last=False)
+        return fig
+
+    @classmethod
+    def clear_figure_cache(cls) -> None:
+        """Removing all built figures from the figure cache."""
+        with cls._figures_lock:
+            cls._figures.clear()
+
     def _create_color_dict(self) -> None:
         """Creating a dictionary containing each ticker and a corresponding color to ensure that the coloring is consistent across graphs."""
         self.color_dict = {str(self.primary_ticker): PrimaryColors.ORANGE.value}
@@ -92,19 +278,40 @@ class Plotter:
             number_list = [str(round(val * 1.0 / 1, 1)) for val in number_list]
             return number_list
 
-    def bar(self, y_col: str, mask: list, **kwargs):
+    def bar(self, y_col: str, mask: list = None, **kwargs):
         """Creating a bar plot using the plotly.express.bar function.
         The kwargs go into the bar function.
+        The figure is reused from the figure cache if it has been built before for the same data, mask and arguments.
 
         Args:
             y_col (str): The y column that should be plotted from the dataframe inputted in the object.
             mask (list): Since the full dataframe contains observations for multiple dates, then a boolean list is inputted to filter the dataframe.
+                For a pivot the mask filters the dates. Defaults to all rows.
 
         Returns:
             go.Figure: The bar plot.
         """
-        df = self.data.copy()
-        df = df[mask].sort_values(by=[y_col], ascending=[False])
+        mask = np.ones(len(self.data), dtype=bool) if mask is None else mask
+        mask = np.asarray(mask, dtype=bool)
+        mask_hash = hashlib.sha1(np.packbits(mask).tobytes()).hexdigest()
+        key = ("bar", y_col, len(mask), mask_hash, repr(sorted(kwargs.items())))
+        return self._cached_figure(key, lambda: self._build_bar(y_col, mask, **kwargs))
+
+    def _build_bar(self, y_col: str, mask: np.ndarray, **kwargs) -> go.Figure:
+        """Building the bar plot of bar without copying the full dataframe."""
+        if self.wide:
+            # The observations of the masked dates with a row per (date, ticker).
+            df = self.data[mask].stack().rename(y_col).reset_index()
+            df.columns = ["date", "ticker", y_col]
+        else:
+            df = self.data[mask]
+        df = df.sort_values(by=[y_col], ascending=[False])
+        if "date" in df.columns:
+            # Showing the date of each observation, since they can differ between the tickers.
+            dates = df["date"]
+            if pd.api.types.is_datetime64_any_dtype(dates):
+                dates = dates.dt.strftime("%Y-%m-%d")
+            kwargs.setdefault("hovertext", dates.astype(str).tolist())
 
         # Creating the color list
         tickers = df["ticker"].drop_duplicates().tolist()
@@ -129,28 +336,97 @@ class Plotter:
         )
         return fig
 
+    def _series(self, y_col: str) -> tuple:
+        """Getting the finite observations of every ticker as flat arrays, with the series of the tickers after each other.
+
+        Args:
+            y_col (str): The y column that should be plotted.
+
+        Returns:
+            list: The tickers.
+            np.ndarray: The dates.
+            np.ndarray: The values.
+            np.ndarray: The number of observations of each ticker.
+        """
+        if self.wide:
+            values = self.data.to_numpy(dtype=np.float64)
+            finite = np.isfinite(values)
+            tickers = [str(ticker) for ticker in self.data.columns]
+            # Going through the pivot column by column, so the series of a ticker are contiguous.
+            rows, cols = np.nonzero(finite.T)
+            x = self.data.index.to_numpy()[cols]
+            y = values.T[rows, cols]
+            lengths = finite.sum(axis=0)
+        else:
+            df = self.data.sort_values(by=["ticker", "date"], kind="stable")
+            df = df[np.isfinite(df[y_col].to_numpy(dtype=np.float64))]
+            sizes = df.groupby("ticker", sort=False).size()
+            tickers = [str(ticker) for ticker in sizes.index]
+            x = df["date"].to_numpy()
+            y = df[y_col].to_numpy(dtype=np.float64)
+            lengths = sizes.to_numpy()
+        return tickers, x, y, np.asarray(lengths, dtype=np.int64)
+
     def line(self, y_col: str, **kwargs):
-        """Creating a line plot using the plotly.express.line function.
-        The kwargs go into the line function.
+        """Creating a line plot with a line per ticker.
+        The kwargs go into the line of every ticker.
+        Series that have more points than the width of the plot can show are downsampled with lttb,
+        and the plot is drawn with WebGL if it still has many points. The point budget is stored in the layout meta.
+        The figure is reused from the figure cache if it has been built before for the same data and arguments.
 
         Args:
-            y_col (str): The y column that should be plotted from the dataframe inputted in the object.
+            y_col (str): The y column that should be plotted from the dataframe inputted in the object, or the name of the metric of a pivot.
 
         Returns:
             go.Figure: The line plot.
         """
-        fig = px.line(
-            self.data,
-            x="date",
-            y=y_col,
-            color="ticker",
-            color_discrete_map=self.color_dict,
-            **kwargs,
+        key = ("line", y_col, repr(sorted(kwargs.items())))
+        return self._cached_figure(key, lambda: self._build_line(y_col, **kwargs))
+
+    def _build_line(self, y_col: str, **kwargs) -> go.Figure:
+        """Building the line plot of line."""
+        budget = max(int(self.width * self.points_per_pixel), 3)
+        tickers, x, y, lengths = self._series(y_col)
+        original_points = len(y)
+        if len(lengths) and lengths.max() > budget:
+            x_numbers = x
+            if np.issubdtype(x.dtype, np.datetime64):
+                x_numbers = x.astype("datetime64[ns]").astype(np.int64)
+            kept = lttb(x_numbers, y, budget, lengths=lengths)
+            offsets = np.r_[0, np.cumsum(lengths)]
+            lengths = np.diff(np.searchsorted(kept, offsets))
+            x, y = x[kept], y[kept]
+
+        render_mode = self.render_mode
+        if render_mode == "auto":
+            render_mode = "webgl" if len(y) > self.webgl_threshold else "svg"
+        trace = go.Scattergl if render_mode == "webgl" else go.Scatter
+
+        bounds = np.r_[0, np.cumsum(lengths)]
+        fig = go.Figure(
+            data=[
+                trace(
+                    x=x[start:end],
+                    y=y[start:end],
+                    name=ticker,
+                    mode="lines",
+                    line=dict(color=self.color_dict.get(ticker)),
+                    **kwargs,
+                )
+                for ticker, start, end in zip(tickers, bounds[:-1], bounds[1:])
+            ]
         )
         fig.update_layout(
             yaxis=dict(rangemode="tozero", title=None),
             xaxis=dict(title=None),
+            legend=dict(title="ticker"),
             title=f"Development in {y_col} by Ticker",
+            meta={
+                "points_per_series": budget,
+                "points": len(y),
+                "original_points": original_points,
+                "render_mode": render_mode,
+            },
         )
         return fig
 
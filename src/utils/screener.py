@@ -0,0 +1,273 @@
+from pathlib import Path
+import sys
+
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+import numpy as np
+import pandas as pd
+from src.utils.metric_store import MetricStore
+from src.utils.transport import ThrottledTransport
+from src.utils.yf_extractor import YahooExtractor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+FIELDS = ["value", "percentile", "zscore"]
+
+
+def load_watchlist(path: str, column: str = "ticker") -> list:
+    """Reading the tickers of a watchlist or an index from a csv file.
+
+    Args:
+        path (str): The path of the csv file.
+        column (str, optional): The column with the tickers. Defaults to "ticker", or the first column if there is no such column.
+
+    Returns:
+        list: The unique tickers in the order of the file.
+    """
+    df = pd.read_csv(path, dtype=str)
+    tickers = df[column] if column in df.columns else df.iloc[:, 0]
+    tickers = tickers.dropna().str.strip()
+    return list(dict.fromkeys(ticker for ticker in tickers if ticker != ""))
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError(
+            "The screener needs pyarrow, install it with pip install stock-insights[screener]"
+        )
+
+
+def ingest_watchlist(
+    tickers: list,
+    path: str,
+    max_workers: int = 8,
+    requests_per_second: float = 5.0,
+    batch_size: int = 100,
+    on_complete=None,
+    transport=None,
+) -> int:
+    """Fetching the stats of a universe of tickers in parallel and writing them into a parquet file.
+    The requests of all workers share one rate limit and the tickers are written in batches, so the memory doesn't grow with the universe.
+
+    Args:
+        tickers (list): The tickers.
+        path (str): The path of the parquet file.
+        max_workers (int, optional): The maximum number of tickers fetched at the same time. Defaults to 8.
+        requests_per_second (float, optional): The maximum number of requests per second. Defaults to 5.
+        batch_size (int, optional): The number of tickers fetched and written at a time. Defaults to 100.
+        on_complete (callable, optional): Called with the ticker, the number of completed tickers and the total as each ticker finishes. Defaults to None.
+        transport (optional): The transport used for the actual requests. Defaults to YahooExtractor.default_transport.
+
+    Returns:
+        int: The number of written rows.
+    """
+    _require_pyarrow()
+    tickers = list(dict.fromkeys(tickers))
+    throttled = ThrottledTransport(
+        transport if transport is not None else YahooExtractor.default_transport,
+        rate=requests_per_second,
+    )
+    schema = pa.schema(
+        [
+            ("ticker", pa.string()),
+            ("metric", pa.string()),
+            ("date", pa.timestamp("ns")),
+            ("value", pa.float64()),
+        ]
+    )
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    with pq.ParquetWriter(str(path), schema) as writer:
+        for start in range(0, len(tickers), batch_size):
+            batch = tickers[start : start + batch_size]
+
+            def progress(ticker, completed, total, offset=start):
+                if on_complete is not None:
+                    on_complete(ticker, offset + completed, len(tickers))
+
+            df = YahooExtractor.get_stats_many(
+                batch,
+                max_workers=max_workers,
+                on_complete=progress,
+                transport=throttled,
+            )
+            if len(df) == 0:
+                continue
+            df = pd.DataFrame(
+                data={
+                    "ticker": df["ticker"].astype(str),
+                    "metric": df["metric"].astype(str),
+                    "date": pd.to_datetime(df["date"]).astype("datetime64[ns]"),
+                    "value": df["value"].astype(np.float64),
+                }
+            )
+            writer.write_table(
+                pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+            )
+            rows += len(df)
+    return rows
+
+
+def load_universe(path: str) -> pd.DataFrame:
+    """Reading a universe written by ingest_watchlist.
+
+    Args:
+        path (str): The path of the parquet file.
+
+    Returns:
+        pd.DataFrame: A long dataframe with a ticker, metric, date and value column.
+    """
+    _require_pyarrow()
+    return pd.read_parquet(path)
+
+
+def cross_sectional_scores(pivot: pd.DataFrame) -> tuple:
+    """Calculating the percentile rank and the z-score of every ticker among all tickers on the same date.
+
+    Args:
+        pivot (pd.DataFrame): The values of a metric with a date index and a column per ticker.
+
+    Returns:
+        pd.DataFrame: The percentile ranks between 0 and 1, NaN where the ticker has no value.
+        pd.DataFrame: The z-scores, NaN where the ticker has no value or all tickers have the same value.
+    """
+    values = pivot.to_numpy(dtype=np.float64)
+    percentile = pivot.rank(axis=1, pct=True)
+
+    finite = np.isfinite(values)
+    count = finite.sum(axis=1, keepdims=True)
+    filled = np.where(finite, values, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=1, keepdims=True) / count
+        std = np.sqrt(
+            np.where(finite, (values - mean) ** 2, 0.0).sum(axis=1, keepdims=True)
+            / count
+        )
+        zscore = np.where(std > 0, (values - mean) / std, np.nan)
+    return percentile, pd.DataFrame(zscore, index=pivot.index, columns=pivot.columns)
+
+
+class Screener:
+    def __init__(self, store: MetricStore, min_coverage: float = 0.5) -> None:
+        """Screening a universe of tickers on the cross-sectional ranks of their metrics.
+        For every metric the most recent date that enough of the tickers have reported is used, so all tickers are compared on the same date.
+        The scores of all metrics and dates are calculated once and kept in scores, so filtering only masks a precomputed table.
+
+        Args:
+            store (MetricStore): The stats of the universe.
+            min_coverage (float, optional): The share of the tickers with the metric that must have a value on the screening date. Defaults to 0.5.
+        """
+        self.store = store
+        self.min_coverage = min_coverage
+        self.dates = {}
+        self.scores = {}
+
+        columns = {}
+        for metric in store.metrics:
+            pivot = store.pivot(metric)
+            if len(pivot) == 0:
+                continue
+            percentile, zscore = cross_sectional_scores(pivot)
+            self.scores[metric] = (percentile, zscore)
+
+            # The most recent date that enough of the tickers have reported.
+            reported = pivot.notna().to_numpy()
+            enough = (
+                reported.sum(axis=1) >= self.min_coverage * reported.any(axis=0).sum()
+            )
+            row = int(np.flatnonzero(enough)[-1]) if enough.any() else len(pivot) - 1
+            self.dates[metric] = pivot.index[row]
+
+            columns[(metric, "value")] = pivot.iloc[row]
+            columns[(metric, "percentile")] = percentile.iloc[row]
+            columns[(metric, "zscore")] = zscore.iloc[row]
+        self.table = pd.DataFrame(columns, index=pd.Index(store.tickers, name="ticker"))
+
+    @classmethod
+    def from_parquet(cls, path: str, min_coverage: float = 0.5) -> "Screener":
+        """Creating a screener of a universe written by ingest_watchlist.
+
+        Args:
+            path (str): The path of the parquet file.
+            min_coverage (float, optional): See Screener. Defaults to 0.5.
+
+        Returns:
+            Screener: The screener.
+        """
+        return cls(MetricStore(load_universe(path)), min_coverage=min_coverage)
+
+    def _check_metric(self, metric: str) -> None:
+        if metric not in self.dates:
+            raise ValueError(
+                f"Unknown metric: {metric}, the available metrics are {', '.join(self.dates)}"
+            )
+
+    def screen(
+        self,
+        filters: dict = None,
+        sort_by: str = None,
+        field: str = "percentile",
+        ascending: bool = False,
+    ) -> pd.DataFrame:
+        """Filtering the universe on the scores of one or more metrics.
+
+        Args:
+            filters (dict, optional): The lower and upper bound of the field of each metric, e.g. {"quarterlyPeRatio": (0, 0.25)}. Defaults to no filters.
+            sort_by (str, optional): A metric to sort the result by. Defaults to None.
+            field (str, optional): The field the filters and the sorting apply to, "value", "percentile" or "zscore". Defaults to "percentile".
+            ascending (bool, optional): Whether to sort the lowest values first, e.g. for valuation multiples where low is cheap. Defaults to False.
+
+        Raises:
+            ValueError: If the field or one of the metrics is unknown.
+
+        Returns:
+            pd.DataFrame: The tickers passing all filters with the value, percentile and zscore of every metric.
+        """
+        if field not in FIELDS:
+            raise ValueError(
+                f"Unknown field: {field}, the fields are {', '.join(FIELDS)}"
+            )
+        filters = filters or {}
+        for metric in list(filters) + ([sort_by] if sort_by is not None else []):
+            self._check_metric(metric)
+
+        mask = np.ones(len(self.table), dtype=bool)
+        for metric, (low, high) in filters.items():
+            values = self.table[(metric, field)].to_numpy()
+            mask &= (values >= low) & (values <= high)
+        result = self.table[mask]
+        if sort_by is not None:
+            result = result.sort_values(by=(sort_by, field), ascending=ascending)
+        return result
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(42)
+    tickers = [f"T{i}" for i in range(1000)]
+    dates = pd.date_range("2020-03-31", periods=12, freq="Q")
+    df = pd.DataFrame(
+        data={
+            "ticker": np.repeat(tickers, len(dates) * 2),
+            "metric": np.tile(
+                np.repeat(["quarterlyPeRatio", "quarterlyPsRatio"], len(dates)),
+                len(tickers),
+            ),
+            "date": np.tile(dates, len(tickers) * 2),
+            "value": rng.lognormal(2.5, 0.5, len(tickers) * len(dates) * 2),
+        }
+    )
+    screener = Screener(MetricStore(df))
+    print(screener.dates)
+    print(
+        screener.screen(
+            {"quarterlyPeRatio": (0, 0.25), "quarterlyPsRatio": (0, 0.5)},
+            sort_by="quarterlyPsRatio",
+        )
+    )
@@ -1,7 +1,394 @@
+from pathlib import Path
+import sys
+
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+import warnings
 import numpy as np
+import pandas as pd
+from src.utils.instrumentation import instrumentation
+
+# Coefficients of the rational approximations of the inverse normal cdf by Peter Acklam.
+_PPF_A = [
+    -39.69683028665376,
+    220.9460984245205,
+    -275.9285104469687,
+    138.3577518672690,
+    -30.66479806614716,
+    2.506628277459239,
+]
+_PPF_B = [
+    -54.47609879822406,
+    161.5858368580409,
+    -155.6989798598866,
+    66.80131188771972,
+    -13.28068155288572,
+]
+_PPF_C = [
+    -0.007784894002430293,
+    -0.3223964580411365,
+    -2.400758277161838,
+    -2.549732539343734,
+    4.374664141464968,
+    2.938163982698783,
+]
+_PPF_D = [
+    0.007784695709041462,
+    0.3224671290700398,
+    2.445134137142996,
+    3.754408661907416,
+]
+# Coefficients of the Chebyshev approximation of erfc from Numerical Recipes.
+_ERFC_COEFFICIENTS = [
+    0.17087277,
+    -0.82215223,
+    1.48851587,
+    -1.13520398,
+    0.27886807,
+    -0.18628806,
+    0.09678418,
+    0.37409196,
+    1.00002368,
+    -1.26551223,
+]
+
+_LEGENDRE = np.polynomial.legendre.leggauss(64)  # The quadrature nodes and weights.
+
+
+def norm_ppf(u: np.ndarray) -> np.ndarray:
+    """The inverse of the standard normal cdf with a relative error below 1.2e-9.
+
+    Args:
+        u (np.ndarray): Probabilities strictly between 0 and 1.
+
+    Returns:
+        np.ndarray: The standard normal quantiles.
+    """
+    u = np.asarray(u, dtype=np.float64)
+    x = np.empty_like(u)
+    low = u < 0.02425
+    high = u > 1 - 0.02425
+    mid = ~(low | high)
+
+    q = u[mid] - 0.5
+    r = q * q
+    x[mid] = np.polyval(_PPF_A, r) * q / np.polyval(_PPF_B + [1.0], r)
+    for mask, sign, tail in ((low, 1, u[low]), (high, -1, 1 - u[high])):
+        q = np.sqrt(-2 * np.log(tail))
+        x[mask] = sign * np.polyval(_PPF_C, q) / np.polyval(_PPF_D + [1.0], q)
+    return x
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """The standard normal cdf with a relative error below 1.2e-7.
+
+    Args:
+        x (np.ndarray): The values.
+
+    Returns:
+        np.ndarray: The probabilities.
+    """
+    z = np.abs(np.asarray(x, dtype=np.float64)) / np.sqrt(2)
+    t = 1 / (1 + 0.5 * z)
+    erfc = t * np.exp(-z * z + np.polyval(_ERFC_COEFFICIENTS, t))
+    # erfc(z) / 2 is the upper tail of |x|.
+    return np.where(np.asarray(x) < 0, 0.5 * erfc, 1 - 0.5 * erfc)
+
+
+def sobol(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """Drawing n points of a randomly shifted Sobol sequence in the unit cube.
+    One and two dimensions are generated directly, more dimensions require scipy (pip install stock-insights[qmc]).
+    Without scipy a Latin hypercube is drawn instead with a warning.
+
+    Args:
+        n (int): The number of points, preferably a power of two.
+        d (int): The number of dimensions.
+        rng (np.random.Generator): The generator of the random digital shift.
+
+    Returns:
+        np.ndarray: An array of shape (n, d) strictly inside the unit cube.
+    """
+    if d > 2:
+        try:
+            # Only imported when it is needed, since it is slow to import.
+            from scipy.stats import qmc
+        except ImportError:
+            warnings.warn(
+                "Sobol sampling of more than two factors requires scipy, install it with pip install stock-insights[qmc]. Using Latin hypercube sampling instead."
+            )
+            return latin_hypercube(n, d, rng)
+        return qmc.Sobol(d, scramble=True, seed=rng).random(n)
+
+    bits = 32
+    # The direction numbers of the first dimension (van der Corput) and of the primitive polynomial x + 1.
+    m = [1]
+    for _ in range(bits - 1):
+        m.append((m[-1] << 1) ^ m[-1])
+    directions = [
+        [1 << (bits - k) for k in range(1, bits + 1)],
+        [m[k - 1] << (bits - k) for k in range(1, bits + 1)],
+    ]
+
+    index = np.arange(n, dtype=np.uint64)
+    points = np.empty((n, d))
+    for dim in range(d):
+        x = np.zeros(n, dtype=np.uint64)
+        for k in range(int(n).bit_length()):
+            x ^= ((index >> np.uint64(k)) & np.uint64(1)) * np.uint64(
+                directions[dim][k]
+            )
+        x ^= np.uint64(rng.integers(0, 1 << bits))  # Random digital shift.
+        points[:, dim] = (x + 0.5) / 2.0**bits
+    return points
+
+
+def latin_hypercube(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """Drawing n points of a Latin hypercube in the unit cube, so every dimension has exactly one point in each of n equal strata.
+
+    Args:
+        n (int): The number of points.
+        d (int): The number of dimensions.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        np.ndarray: An array of shape (n, d) strictly inside the unit cube.
+    """
+    strata = rng.permuted(np.tile(np.arange(n), (d, 1)), axis=1).T
+    return (strata + rng.random((n, d))) / n
+
+
+def cagr_threshold(valuation_current: float, wanted_cagr: float, periods: float):
+    """Calculating the valuation that gives exactly the wanted cagr.
+    A cagr above the wanted cagr is the same as a valuation above this threshold, which avoids calculating the cagr of every draw.
+
+    Args:
+        valuation_current (float): The current valuation.
+        wanted_cagr (float): The wanted cagr.
+        periods (float): The number of periods until the estimates are realised.
+
+    Returns:
+        float: The threshold valuation.
+    """
+    return valuation_current * (1 + wanted_cagr) ** periods
+
+
+def _cagr(
+    valuation: np.ndarray, valuation_current: float, periods: float, dtype
+) -> np.ndarray:
+    """Calculating the cagr from the current valuation to each of the estimated valuations without changing the estimates.
+
+    Returns:
+        np.ndarray: The cagr of every valuation, or None if some of the valuations are negative.
+    """
+    if valuation.min() < 0:
+        print("It is not possible to calculate a cagr to a negative ending value")
+        return None
+    cagr = np.divide(valuation, valuation_current, dtype=dtype)
+    np.power(cagr, 1 / periods, out=cagr)
+    cagr -= 1
+    return cagr
+
+
+def _probability_above(cagr: np.ndarray, wanted_cagr: float) -> float:
+    """Calculating the share of the cagrs that are better than the wanted cagr.
+
+    Returns:
+        float: The probability, or None if the cagr couldn't be calculated.
+    """
+    if cagr is None:
+        return None
+    return float(np.mean(cagr > wanted_cagr))
+
+
+def _standard_normals(
+    rng: np.random.Generator, sampling: str, n_factors: int, n: int, dtype
+) -> np.ndarray:
+    """Drawing n standard normal values of each factor with pseudo-random or low-discrepancy sampling.
+
+    Returns:
+        np.ndarray: An array of shape (n_factors, n).
+    """
+    if sampling == "random":
+        return rng.standard_normal(size=(n_factors, n), dtype=dtype)
+    if sampling == "sobol":
+        u = sobol(n, n_factors, rng)
+    else:
+        u = latin_hypercube(n, n_factors, rng)
+    return np.ascontiguousarray(norm_ppf(u).T, dtype=dtype)
+
+
+@dataclass
+class SimulationResult:
+    """The draws of a simulation and the values derived from them.
+    All arrays come from the same draws, so the distributions are consistent with each other.
+    cagr is None if some of the estimated valuations are negative.
+    """
+
+    kpi: np.ndarray
+    financial: np.ndarray
+    valuation: np.ndarray
+    cagr: np.ndarray
+    periods: float
+
+    def probability_above(self, wanted_cagr: float) -> float:
+        """Calculating the probability of getting a better cagr than the wanted cagr.
+
+        Args:
+            wanted_cagr (float): The wanted cagr, e.g. 0.1 for 10 %.
+
+        Returns:
+            float: The probability, or None if the cagr couldn't be calculated.
+        """
+        return _probability_above(self.cagr, wanted_cagr)
+
+
+@dataclass
+class StreamingResult:
+    """The summary of a streamed simulation. Only running statistics are kept, so the draws themselves aren't available."""
+
+    n_draws: int
+    probability_above: float
+    standard_error: float
+    converged: bool
+    mean_valuation: float
+    std_valuation: float
+    valuation_quantiles: dict
+    cagr_quantiles: dict
+    mean_cagr: float
+    n_negative: int
+
+
+@dataclass
+class FactorSimulationResult:
+    """The draws of a factor simulation and the values derived from them.
+    cagr is None if some of the estimated valuations are negative.
+    """
+
+    names: list
+    draws: np.ndarray
+    valuation: np.ndarray
+    cagr: np.ndarray
+    periods: float
+
+    def factor(self, name: str) -> np.ndarray:
+        """Getting the draws of a single factor.
+
+        Args:
+            name (str): The name of the factor.
+
+        Returns:
+            np.ndarray: The draws of the factor.
+        """
+        return self.draws[self.names.index(name)]
+
+    def probability_above(self, wanted_cagr: float) -> float:
+        """Calculating the probability of getting a better cagr than the wanted cagr.
+
+        Args:
+            wanted_cagr (float): The wanted cagr, e.g. 0.1 for 10 %.
+
+        Returns:
+            float: The probability, or None if the cagr couldn't be calculated.
+        """
+        return _probability_above(self.cagr, wanted_cagr)
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = 0.005) -> None:
+        """A streaming quantile sketch with a bounded relative error (the DDSketch algorithm).
+        Values are counted in logarithmically sized buckets, so the memory only depends on the range of the values and not on how many values are added.
+
+        Args:
+            relative_accuracy (float, optional): The maximum relative error of a quantile. Defaults to 0.005.
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self._positive = {}
+        self._negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_to(self, buckets: dict, values: np.ndarray) -> None:
+        keys, counts = np.unique(
+            np.ceil(np.log(values) / self._log_gamma).astype(np.int64),
+            return_counts=True,
+        )
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def add(self, values: np.ndarray) -> None:
+        """Adding a block of values to the sketch.
+
+        Args:
+            values (np.ndarray): The values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self._add_to(self._positive, values[values > 0])
+        self._add_to(self._negative, -values[values < 0])
+        self.zero_count += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+
+    def quantile(self, q: float) -> float:
+        """Estimating a quantile of the added values.
+
+        Args:
+            q (float): The quantile between 0 and 1.
+
+        Returns:
+            float: The estimated quantile, or NaN if no values have been added.
+        """
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        # From the most negative bucket to the largest positive bucket.
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -2 * self.gamma**key / (self.gamma + 1)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self._positive) / (self.gamma + 1)
+
 
 class MonteCarloSimulation:
-    def __init__(self, kpi_current: float, kpi_estimated: float, kpi_std: float, financial_current: float, financial_estimated: float, financial_std: float) -> None:
+    def __init__(
+        self,
+        kpi_current: float,
+        kpi_estimated: float,
+        kpi_std: float,
+        financial_current: float,
+        financial_estimated: float,
+        financial_std: float,
+        seed: int = None,
+        dtype=np.float64,
+        sampling: str = "random",
+    ) -> None:
+        """A simulation of the valuation as the product of two independent normally distributed factors.
+
+        Args:
+            kpi_current (float): The current kpi, e.g. the PE.
+            kpi_estimated (float): The estimated future kpi.
+            kpi_std (float): The standard deviation of the future kpi.
+            financial_current (float): The current financial, e.g. the earnings.
+            financial_estimated (float): The estimated future financial.
+            financial_std (float): The standard deviation of the future financial.
+            seed (int, optional): The seed of the random generator. Defaults to None.
+            dtype (optional): The dtype of the draws, np.float32 halves the memory. Defaults to np.float64.
+            sampling (str, optional): "random" for pseudo-random draws, or "sobol" or "lhs" for low-discrepancy sampling. Defaults to "random".
+        """
+        if sampling not in ("random", "sobol", "lhs"):
+            raise ValueError(f"Unknown sampling: {sampling}")
         self.kpi_current = kpi_current
         self.kpi_estimated = kpi_estimated
         self.kpi_std = kpi_std
@@ -9,29 +396,664 @@ class MonteCarloSimulation:
         self.financial_estimated = financial_estimated
         self.financial_std = financial_std
         self.n_simulations = 100000
+        self.seed = seed
+        self.dtype = dtype
+        self.sampling = sampling
+        self.rng = np.random.default_rng(seed)
+
+    def _standard_normals(self, n_factors: int) -> np.ndarray:
+        """Drawing n_simulations standard normal values of each factor using the sampling of the simulation.
+
+        Returns:
+            np.ndarray: An array of shape (n_factors, n_simulations).
+        """
+        return _standard_normals(
+            self.rng, self.sampling, n_factors, self.n_simulations, self.dtype
+        )
+
+    def _draw(self, mean: float, std: float) -> np.ndarray:
+        """Drawing n_simulations normally distributed values in the dtype of the simulation."""
+        dist = self._standard_normals(1)[0]
+        dist *= std
+        dist += mean
+        return dist
 
     def get_kpi_distribution(self) -> np.ndarray:
-        dist_estimated = np.random.normal(self.kpi_estimated, self.kpi_std, size = self.n_simulations)
-        return dist_estimated
+        return self._draw(self.kpi_estimated, self.kpi_std)
 
     def get_financial_distribution(self) -> np.ndarray:
-        dist_estimated = np.random.normal(self.financial_estimated, self.financial_std, size = self.n_simulations)
-        return dist_estimated
+        return self._draw(self.financial_estimated, self.financial_std)
 
     def get_valuation_distribution(self) -> np.ndarray:
-        dist_valuation = self.get_kpi_distribution() * self.get_financial_distribution()
+        dist_valuation = self.get_kpi_distribution()
+        dist_valuation *= self.get_financial_distribution()
         return dist_valuation
-    
+
+    def _get_cagr(self, estimated_valuation: np.ndarray, periods: float) -> np.ndarray:
+        """Calculating the cagr from the current valuation to each of the estimated valuations without changing the estimates."""
+        return _cagr(
+            estimated_valuation,
+            self.kpi_current * self.financial_current,
+            periods,
+            self.dtype,
+        )
+
     def get_valuation_cagr_distribution(self, periods: float) -> np.ndarray:
+        return self._get_cagr(self.get_valuation_distribution(), periods)
+
+    @instrumentation.timed("simulation.run")
+    def run(self, periods: float) -> SimulationResult:
+        """Drawing each factor once and deriving the valuation and the cagr from the same draws.
+
+        Args:
+            periods (float): The number of periods until the estimates are realised.
+
+        Returns:
+            SimulationResult: The draws and the derived values.
+        """
+        # Drawing the factors together so low-discrepancy sampling covers their joint space.
+        kpi, financial = self._standard_normals(2)
+        kpi *= self.kpi_std
+        kpi += self.kpi_estimated
+        financial *= self.financial_std
+        financial += self.financial_estimated
+        valuation = np.multiply(kpi, financial)
+        cagr = self._get_cagr(valuation, periods)
+        return SimulationResult(
+            kpi=kpi,
+            financial=financial,
+            valuation=valuation,
+            cagr=cagr,
+            periods=periods,
+        )
+
+    def to_factor_model(self, corr: float = 0.0) -> "FactorModel":
+        """Creating a factor model of the kpi and the financial, e.g. to let the multiple move together with the earnings.
+
+        Args:
+            corr (float, optional): The correlation between the kpi and the financial. Defaults to 0.
+
+        Returns:
+            FactorModel: The factor model with a kpi and a financial factor.
+        """
+        model = FactorModel(
+            names=["kpi", "financial"],
+            means=[self.kpi_estimated, self.financial_estimated],
+            stds=[self.kpi_std, self.financial_std],
+            corr=[[1.0, corr], [corr, 1.0]],
+            seed=self.seed,
+            dtype=self.dtype,
+            sampling=self.sampling,
+        )
+        model.n_simulations = self.n_simulations
+        return model
+
+    def run_parallel(
+        self, periods: float, n_workers: int = None, executor: str = "thread"
+    ) -> SimulationResult:
+        """Splitting the draws over a pool of workers, each drawing from its own independent random stream.
+        The streams are spawned from one SeedSequence, so the result is reproducible for a given seed and number of workers.
+        Threads scale well since numpy releases the GIL while drawing and calculating, processes avoid the GIL entirely at the cost of copying the results.
+
+        Args:
+            periods (float): The number of periods until the estimates are realised.
+            n_workers (int, optional): The number of workers. Defaults to the number of cpus.
+            executor (str, optional): "thread" or "process". Defaults to "thread".
+
+        Returns:
+            SimulationResult: The draws of all workers and the derived values.
+        """
+        n_workers = n_workers if n_workers is not None else os.cpu_count()
+        seed = self.seed
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        streams = seed.spawn(n_workers)
+        sizes = [
+            len(block)
+            for block in np.array_split(np.arange(self.n_simulations), n_workers)
+        ]
+        params = {
+            "kpi_current": self.kpi_current,
+            "kpi_estimated": self.kpi_estimated,
+            "kpi_std": self.kpi_std,
+            "financial_current": self.financial_current,
+            "financial_estimated": self.financial_estimated,
+            "financial_std": self.financial_std,
+            "dtype": self.dtype,
+            "sampling": self.sampling,
+        }
+
+        pool_class = (
+            ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        )
+        with pool_class(max_workers=n_workers) as pool:
+            results = list(
+                pool.map(
+                    _run_block,
+                    [params] * n_workers,
+                    sizes,
+                    streams,
+                    [periods] * n_workers,
+                )
+            )
+
+        # Reducing the results of the workers into one result.
+        cagr = None
+        if all(result.cagr is not None for result in results):
+            cagr = np.concatenate([result.cagr for result in results])
+        return SimulationResult(
+            kpi=np.concatenate([result.kpi for result in results]),
+            financial=np.concatenate([result.financial for result in results]),
+            valuation=np.concatenate([result.valuation for result in results]),
+            cagr=cagr,
+            periods=periods,
+        )
+
+    def _probability_valuation_above(self, x) -> np.ndarray:
+        """Calculating P(valuation > x) by integrating over one factor with Gauss-Legendre quadrature.
+        Given one factor, the valuation is a scaled normal, so the conditional probability is a normal cdf.
+
+        Args:
+            x (array-like): The valuations.
+
+        Returns:
+            np.ndarray: The probabilities.
+        """
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))[:, None]
+        # A negative std draws the same normal distribution as its absolute value, e.g. the default std of a negative kpi.
+        factors = [
+            (self.kpi_estimated, abs(self.kpi_std)),
+            (self.financial_estimated, abs(self.financial_std)),
+        ]
+        # Integrating over the factor with the smaller relative spread keeps the integrand smooth.
+        factors.sort(key=lambda factor: factor[1] / max(abs(factor[0]), 1e-300))
+        (mean, std), (other_mean, other_std) = factors
+
+        if std == 0:
+            # One factor is constant, so the valuation is a scaled normal or a constant.
+            x = x[:, 0]
+            if other_std == 0:
+                return (mean * other_mean > x).astype(np.float64)
+            if mean > 0:
+                return norm_cdf((other_mean - x / mean) / other_std)
+            if mean < 0:
+                return norm_cdf((x / mean - other_mean) / other_std)
+            return (0 > x).astype(np.float64)
+
+        # Splitting the integral at zero where the conditional probability changes form.
+        lower, upper = mean - 9 * std, mean + 9 * std
+        edges = [lower, 0.0, upper] if lower < 0 < upper else [lower, upper]
+        base_nodes, base_weights = _LEGENDRE
+        nodes = []
+        weights = []
+        for a, b in zip(edges[:-1], edges[1:]):
+            nodes.append((b - a) / 2 * base_nodes + (a + b) / 2)
+            weights.append((b - a) / 2 * base_weights)
+        nodes = np.concatenate(nodes)[None, :]
+        weights = np.concatenate(weights)
+        weights *= np.exp(-0.5 * ((nodes[0] - mean) / std) ** 2) / (
+            std * np.sqrt(2 * np.pi)
+        )
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = x / nodes
+            z = np.where(
+                nodes > 0,
+                (other_mean - ratio) / other_std,
+                (ratio - other_mean) / other_std,
+            )
+            conditional = np.where(nodes == 0, (0 > x) * 1.0, norm_cdf(z))
+        return np.clip(conditional @ weights / weights.sum(), 0, 1)
+
+    def analytic_probability_above(self, wanted_cagr: float, periods: float) -> float:
+        """Calculating the probability of getting a better cagr than the wanted cagr without simulating.
+
+        Args:
+            wanted_cagr (float): The wanted cagr.
+            periods (float): The number of periods until the estimates are realised.
+
+        Returns:
+            float: The probability.
+        """
+        threshold = cagr_threshold(
+            self.kpi_current * self.financial_current, wanted_cagr, periods
+        )
+        return float(self._probability_valuation_above(threshold)[0])
+
+    def analytic_valuation_quantiles(self, quantiles: list) -> np.ndarray:
+        """Calculating quantiles of the valuation without simulating, by bisecting the numerically integrated distribution.
+
+        Args:
+            quantiles (list): The quantiles between 0 and 1.
+
+        Returns:
+            np.ndarray: The valuation quantiles.
+        """
+        targets = 1 - np.asarray(quantiles, dtype=np.float64)
+        kpi_std, financial_std = abs(self.kpi_std), abs(self.financial_std)
+        corners = [
+            k * f
+            for k in (
+                self.kpi_estimated - 9 * kpi_std,
+                self.kpi_estimated + 9 * kpi_std,
+            )
+            for f in (
+                self.financial_estimated - 9 * financial_std,
+                self.financial_estimated + 9 * financial_std,
+            )
+        ]
+        lower = np.full(len(targets), min(corners))
+        upper = np.full(len(targets), max(corners))
+        for _ in range(60):
+            middle = (lower + upper) / 2
+            above = self._probability_valuation_above(middle) > targets
+            lower = np.where(above, middle, lower)
+            upper = np.where(above, upper, middle)
+        return (lower + upper) / 2
+
+    def analytic_cagr_quantiles(self, quantiles: list, periods: float) -> np.ndarray:
+        """Calculating quantiles of the cagr without simulating. The cagr is an increasing function of the valuation.
+
+        Args:
+            quantiles (list): The quantiles between 0 and 1.
+            periods (float): The number of periods until the estimates are realised.
+
+        Returns:
+            np.ndarray: The cagr quantiles, NaN where the valuation quantile is negative.
+        """
+        valuation = self.analytic_valuation_quantiles(quantiles)
+        with np.errstate(invalid="ignore"):
+            cagr = (valuation / (self.kpi_current * self.financial_current)) ** (
+                1 / periods
+            ) - 1
+        return np.where(valuation >= 0, cagr, np.nan)
+
+    @instrumentation.timed("simulation.streaming")
+    def run_streaming(
+        self,
+        periods: float,
+        wanted_cagr: float = 0.0,
+        target_se: float = 0.001,
+        chunk_size: int = 100000,
+        max_draws: int = 10000000,
+        quantiles: list = [0.01, 0.05, 0.5, 0.95, 0.99],
+        relative_accuracy: float = 0.005,
+    ) -> StreamingResult:
+        """Drawing in fixed-size blocks until the probability of beating the wanted cagr is estimated with the requested standard error.
+        Only running moments and a quantile sketch are kept between the blocks, so the memory stays constant regardless of the number of draws.
+        Every block is drawn with the sampling of the simulation. With low-discrepancy sampling each block is an independently shifted point set,
+        so the standard error is that of pseudo-random draws, which overstates the actual error and stops conservatively.
+
+        Args:
+            periods (float): The number of periods until the estimates are realised.
+            wanted_cagr (float, optional): The wanted cagr. Defaults to 0.
+            target_se (float, optional): The standard error of the probability at which to stop. Defaults to 0.001.
+            chunk_size (int, optional): The number of draws per block, preferably a power of two for Sobol sampling. Defaults to 100000.
+            max_draws (int, optional): The maximum number of draws. Defaults to 10000000.
+            quantiles (list, optional): The quantiles of the valuation and cagr to report. Defaults to [0.01, 0.05, 0.5, 0.95, 0.99].
+            relative_accuracy (float, optional): The relative accuracy of the quantiles, see QuantileSketch. Defaults to 0.005.
+
+        Returns:
+            StreamingResult: The number of draws used, the achieved standard error and the estimated statistics.
+        """
         valuation_current = self.kpi_current * self.financial_current
-        estimated_valuation = self.get_valuation_distribution()
-        if min(estimated_valuation)<0:
-            print("It is not possible to calculate a cagr to a negative ending value")
-            return None
-        else:
-            cagr = (estimated_valuation / valuation_current)**(1/periods) - 1
-            return cagr
-        
+        threshold = cagr_threshold(valuation_current, wanted_cagr, periods)
+
+        sketch = QuantileSketch(relative_accuracy=relative_accuracy)
+        n = hits = n_negative = 0
+        mean = m2 = cagr_sum = 0.0
+        standard_error = np.inf
+        while n < max_draws:
+            size = min(chunk_size, max_draws - n)
+            valuation, financial = _standard_normals(
+                self.rng, self.sampling, 2, size, self.dtype
+            )
+            valuation *= self.kpi_std
+            valuation += self.kpi_estimated
+            financial *= self.financial_std
+            financial += self.financial_estimated
+            valuation *= financial
+
+            # Merging the moments of the block into the running moments.
+            block_mean = float(valuation.mean())
+            block_m2 = float(np.square(valuation - block_mean).sum())
+            delta = block_mean - mean
+            total = n + size
+            mean += delta * size / total
+            m2 += block_m2 + delta**2 * n * size / total
+
+            hits += int(np.count_nonzero(valuation > threshold))
+            sketch.add(valuation)
+            negative = valuation < 0
+            n_negative += int(np.count_nonzero(negative))
+            if n_negative == 0:
+                valuation /= valuation_current
+                np.power(valuation, 1 / periods, out=valuation)
+                cagr_sum += float(valuation.sum()) - size
+            n = total
+
+            # Using the adjusted proportion so a probability of 0 or 1 doesn't give a zero error.
+            p_adjusted = (hits + 1) / (n + 2)
+            standard_error = float(np.sqrt(p_adjusted * (1 - p_adjusted) / n))
+            if standard_error <= target_se:
+                break
+
+        valuation_quantiles = {q: sketch.quantile(q) for q in quantiles}
+        cagr_quantiles = {
+            q: (
+                (value / valuation_current) ** (1 / periods) - 1
+                if value >= 0
+                else np.nan
+            )
+            for q, value in valuation_quantiles.items()
+        }
+        return StreamingResult(
+            n_draws=n,
+            probability_above=hits / n,
+            standard_error=standard_error,
+            converged=standard_error <= target_se,
+            mean_valuation=mean,
+            std_valuation=float(np.sqrt(m2 / max(n - 1, 1))),
+            valuation_quantiles=valuation_quantiles,
+            cagr_quantiles=cagr_quantiles,
+            mean_cagr=cagr_sum / n if n_negative == 0 else np.nan,
+            n_negative=n_negative,
+        )
+
+
+class FactorModel:
+    def __init__(
+        self,
+        names: list,
+        means: list,
+        stds: list,
+        corr: np.ndarray = None,
+        seed: int = None,
+        dtype=np.float64,
+        sampling: str = "random",
+    ) -> None:
+        """A simulation of any number of correlated normally distributed factors, e.g. the multiple, the earnings, the share count and an fx rate.
+        All factors are drawn together through one Cholesky transform of independent standard normals, so adding a factor only adds a row of draws.
+
+        Args:
+            names (list): The names of the factors.
+            means (list): The estimated future value of each factor.
+            stds (list): The standard deviation of each factor.
+            corr (np.ndarray, optional): The correlation matrix of the factors. Defaults to independent factors.
+            seed (int, optional): The seed of the random generator. Defaults to None.
+            dtype (optional): The dtype of the draws. Defaults to np.float64.
+            sampling (str, optional): "random", "sobol" or "lhs". Defaults to "random".
+        """
+        if sampling not in ("random", "sobol", "lhs"):
+            raise ValueError(f"Unknown sampling: {sampling}")
+        self.names = list(names)
+        self.means = np.asarray(means, dtype=np.float64)
+        self.stds = np.asarray(stds, dtype=np.float64)
+        n_factors = len(self.names)
+        if self.means.shape != (n_factors,) or self.stds.shape != (n_factors,):
+            raise ValueError("There must be one mean and one std per factor")
+        self.corr = (
+            np.eye(n_factors) if corr is None else np.asarray(corr, dtype=np.float64)
+        )
+        if self.corr.shape != (n_factors, n_factors) or not np.allclose(
+            self.corr, self.corr.T
+        ):
+            raise ValueError("The correlation matrix must be square and symmetric")
+        try:
+            self._cholesky = np.linalg.cholesky(self.corr)
+        except np.linalg.LinAlgError:
+            raise ValueError("The correlation matrix must be positive definite")
+        self.n_simulations = 100000
+        self.seed = seed
+        self.dtype = dtype
+        self.sampling = sampling
+        self.rng = np.random.default_rng(seed)
+
+    def draw(self) -> np.ndarray:
+        """Drawing n_simulations correlated values of every factor.
+
+        Returns:
+            np.ndarray: An array of shape (n_factors, n_simulations) with a row per factor.
+        """
+        z = _standard_normals(
+            self.rng, self.sampling, len(self.names), self.n_simulations, self.dtype
+        )
+        draws = self._cholesky.astype(self.dtype) @ z
+        draws *= self.stds.astype(self.dtype)[:, None]
+        draws += self.means.astype(self.dtype)[:, None]
+        return draws
+
+    def evaluate(
+        self, draws: np.ndarray, formula="product", weights: list = None
+    ) -> np.ndarray:
+        """Evaluating the valuation formula for every draw.
+
+        Args:
+            draws (np.ndarray): The draws from draw.
+            formula (optional): "product" for the product of the factors raised to the weights, e.g. -1 for the share count,
+                "sum" for the sum of the factors times the weights, or a vectorized function taking a dict of factor draws. Defaults to "product".
+            weights (list, optional): The exponent or coefficient of each factor. Defaults to 1 for every factor.
+
+        Returns:
+            np.ndarray: The valuation of every draw.
+        """
+        if callable(formula):
+            return formula(dict(zip(self.names, draws)))
+        weights = (
+            np.ones(len(self.names))
+            if weights is None
+            else np.asarray(weights, dtype=np.float64)
+        )
+        if formula == "sum":
+            return weights.astype(self.dtype) @ draws
+        if formula != "product":
+            raise ValueError(f"Unknown formula: {formula}")
+        if np.all(weights == 1):
+            return np.prod(draws, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.prod(draws ** weights.astype(self.dtype)[:, None], axis=0)
+
+    @instrumentation.timed("simulation.factor_model")
+    def run(
+        self,
+        periods: float,
+        valuation_current: float,
+        formula="product",
+        weights: list = None,
+    ) -> FactorSimulationResult:
+        """Drawing the factors once and deriving the valuation and the cagr from the same draws.
+
+        Args:
+            periods (float): The number of periods until the estimates are realised.
+            valuation_current (float): The current valuation the cagr is calculated from.
+            formula (optional): The valuation formula, see evaluate. Defaults to "product".
+            weights (list, optional): The exponent or coefficient of each factor. Defaults to None.
+
+        Returns:
+            FactorSimulationResult: The draws and the derived values.
+        """
+        draws = self.draw()
+        valuation = self.evaluate(draws, formula=formula, weights=weights)
+        return FactorSimulationResult(
+            names=self.names,
+            draws=draws,
+            valuation=valuation,
+            cagr=_cagr(valuation, valuation_current, periods, self.dtype),
+            periods=periods,
+        )
+
+
+def _run_block(
+    params: dict, n: int, seed: np.random.SeedSequence, periods: float
+) -> SimulationResult:
+    """Running a simulation of n draws in a worker of MonteCarloSimulation.run_parallel."""
+    sim = MonteCarloSimulation(**params, seed=seed)
+    sim.n_simulations = n
+    return sim.run(periods=periods)
+
+
+@instrumentation.timed("simulation.scenarios")
+def simulate_scenarios(
+    kpi_current: float,
+    financial_current: float,
+    kpi_estimated,
+    kpi_std,
+    financial_estimated,
+    financial_std,
+    periods: float,
+    wanted_cagr: float = 0.0,
+    quantiles: list = [0.05, 0.5, 0.95],
+    n_simulations: int = 100000,
+    seed: int = None,
+    chunk_size: int = 16,
+    n_workers: int = 1,
+) -> pd.DataFrame:
+    """Simulating a grid of scenarios in one broadcasted computation.
+    The scenario parameters are broadcast against each other, so e.g. a column of kpi estimates and a row of financial estimates give every combination.
+    All scenarios share the same standard normal draws, which makes the differences between scenarios free of sampling noise.
+    The scenarios are evaluated chunk_size at a time to bound the memory.
+
+    Args:
+        kpi_current (float): The current kpi.
+        financial_current (float): The current financial.
+        kpi_estimated (array-like): The estimated kpi of each scenario.
+        kpi_std (array-like): The standard deviation of the kpi of each scenario.
+        financial_estimated (array-like): The estimated financial of each scenario.
+        financial_std (array-like): The standard deviation of the financial of each scenario.
+        periods (float): The number of periods until the estimates are realised.
+        wanted_cagr (float, optional): The wanted cagr. Defaults to 0.
+        quantiles (list, optional): The quantiles of the valuation and cagr to report. Defaults to [0.05, 0.5, 0.95].
+        n_simulations (int, optional): The number of draws per scenario. Defaults to 100000.
+        seed (int, optional): The seed of the draws. Defaults to None.
+        chunk_size (int, optional): The number of scenarios evaluated at a time. Defaults to 16.
+        n_workers (int, optional): The number of threads evaluating chunks in parallel. The result doesn't depend on it. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: One row per scenario with its parameters, the valuation and cagr quantiles, the mean cagr and the probability of beating the wanted cagr.
+            The cagr columns are NaN for scenarios with negative valuations.
+    """
+    params = np.broadcast_arrays(
+        *[
+            np.asarray(p, dtype=np.float64)
+            for p in (kpi_estimated, kpi_std, financial_estimated, financial_std)
+        ]
+    )
+    kpi_mean, kpi_sd, fin_mean, fin_sd = [p.ravel()[:, None] for p in params]
+    n_scenarios = len(kpi_mean)
+
+    rng = np.random.default_rng(seed)
+    kpi_z = rng.standard_normal(n_simulations)[None, :]
+    fin_z = rng.standard_normal(n_simulations)[None, :]
+
+    valuation_current = kpi_current * financial_current
+    threshold = cagr_threshold(valuation_current, wanted_cagr, periods)
+
+    valuation_quantiles = np.empty((n_scenarios, len(quantiles)))
+    probability = np.empty(n_scenarios)
+    mean_cagr = np.empty(n_scenarios)
+    min_valuation = np.empty(n_scenarios)
+
+    def evaluate_chunk(start: int) -> None:
+        end = min(start + chunk_size, n_scenarios)
+        valuation = kpi_z * kpi_sd[start:end]
+        valuation += kpi_mean[start:end]
+        valuation *= fin_z * fin_sd[start:end] + fin_mean[start:end]
+
+        valuation_quantiles[start:end] = np.quantile(valuation, quantiles, axis=1).T
+        probability[start:end] = np.mean(valuation > threshold, axis=1)
+        min_valuation[start:end] = valuation.min(axis=1)
+
+        valuation /= valuation_current
+        with np.errstate(invalid="ignore"):
+            np.power(valuation, 1 / periods, out=valuation)
+        mean_cagr[start:end] = valuation.mean(axis=1) - 1
+
+    starts = range(0, n_scenarios, chunk_size)
+    if n_workers > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            list(pool.map(evaluate_chunk, starts))
+    else:
+        for start in starts:
+            evaluate_chunk(start)
+
+    negative = min_valuation < 0
+    with np.errstate(invalid="ignore"):
+        cagr_quantiles = (valuation_quantiles / valuation_current) ** (1 / periods) - 1
+    cagr_quantiles[negative] = np.nan
+    mean_cagr[negative] = np.nan
+
+    df = pd.DataFrame(
+        data={
+            "kpi_estimated": kpi_mean.ravel(),
+            "kpi_std": kpi_sd.ravel(),
+            "financial_estimated": fin_mean.ravel(),
+            "financial_std": fin_sd.ravel(),
+        }
+    )
+    for i, q in enumerate(quantiles):
+        df[f"valuation_q{q:g}"] = valuation_quantiles[:, i]
+    for i, q in enumerate(quantiles):
+        df[f"cagr_q{q:g}"] = cagr_quantiles[:, i]
+    df["mean_cagr"] = mean_cagr
+    df["probability_above"] = probability
+    return df
+
+
+def benchmark_sampling(
+    simulation_kwargs: dict,
+    periods: float,
+    wanted_cagr: float = 0.0,
+    draw_counts: list = [1024, 4096, 16384, 65536],
+    repeats: int = 20,
+    seed: int = None,
+) -> pd.DataFrame:
+    """Comparing the error of the sampling modes against the analytic solution for different numbers of draws.
+
+    Args:
+        simulation_kwargs (dict): The arguments of MonteCarloSimulation (without seed and sampling).
+        periods (float): The number of periods until the estimates are realised.
+        wanted_cagr (float, optional): The wanted cagr. Defaults to 0.
+        draw_counts (list, optional): The numbers of draws to test. Defaults to [1024, 4096, 16384, 65536].
+        repeats (int, optional): The number of repeats per mode and number of draws. Defaults to 20.
+        seed (int, optional): The seed of the repeats. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The root mean squared error of the probability and the median valuation per mode and number of draws.
+    """
+    reference = MonteCarloSimulation(**simulation_kwargs)
+    probability = reference.analytic_probability_above(wanted_cagr, periods)
+    median = reference.analytic_valuation_quantiles([0.5])[0]
+
+    seeds = np.random.SeedSequence(seed).spawn(repeats)
+    rows = []
+    for sampling in ("random", "lhs", "sobol"):
+        for n in draw_counts:
+            probability_errors = []
+            median_errors = []
+            for child in seeds:
+                sim = MonteCarloSimulation(
+                    **simulation_kwargs, seed=child, sampling=sampling
+                )
+                sim.n_simulations = n
+                result = sim.run(periods=periods)
+                threshold = cagr_threshold(
+                    sim.kpi_current * sim.financial_current, wanted_cagr, periods
+                )
+                probability_errors.append(
+                    np.mean(result.valuation > threshold) - probability
+                )
+                median_errors.append(np.median(result.valuation) / median - 1)
+            rows.append(
+                {
+                    "sampling": sampling,
+                    "n_draws": n,
+                    "rmse_probability": np.sqrt(np.mean(np.square(probability_errors))),
+                    "rmse_median_relative": np.sqrt(np.mean(np.square(median_errors))),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
 if __name__ == "__main__":
     d = {
         "kpi_current": 15,
@@ -41,5 +1063,40 @@ if __name__ == "__main__":
         "financial_estimated": 280,
         "financial_std": 30,
     }
-    MC = MonteCarloSimulation(**d)
-    print(MC.get_valuation_cagr_distribution(periods=5))
\ No newline at end of file
+    MC = MonteCarloSimulation(**d, seed=42)
+    result = MC.run(periods=5)
+    print(result.cagr)
+    print(result.probability_above(0.1))
+    print(MC.run_parallel(periods=5, n_workers=4).probability_above(0.1))
+    print(MC.to_factor_model(corr=0.3).run(5, 15 * 200).probability_above(0.1))
+
+    model = FactorModel(
+        names=["pe", "eps", "shares", "fx"],
+        means=[20, 14, 1.05, 1.0],
+        stds=[3, 2, 0.02, 0.05],
+        corr=[
+            [1.0, 0.4, 0.0, 0.0],
+            [0.4, 1.0, 0.0, -0.2],
+            [0.0, 0.0, 1.0, 0.0],
+            [0.0, -0.2, 0.0, 1.0],
+        ],
+        seed=42,
+    )
+    print(model.run(5, 15 * 13, weights=[1, 1, -1, 1]).probability_above(0.05))
+    print(MC.run_streaming(periods=5, wanted_cagr=0.1, target_se=0.0005))
+    print(MC.analytic_probability_above(0.1, periods=5))
+    print(MC.analytic_cagr_quantiles([0.05, 0.5, 0.95], periods=5))
+    print(benchmark_sampling(d, periods=5, wanted_cagr=0.1, seed=42))
+
+    grid = simulate_scenarios(
+        kpi_current=15,
+        financial_current=200,
+        kpi_estimated=np.linspace(15, 25, 5)[:, None],
+        kpi_std=1,
+        financial_estimated=np.linspace(220, 320, 5)[None, :],
+        financial_std=30,
+        periods=5,
+        wanted_cagr=0.1,
+        seed=42,
+    )
+    print(grid)
@@ -0,0 +1,525 @@
+from pathlib import Path
+import sys
+
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import gzip
+import hashlib
+import http.client
+import io
+import json
+import queue
+import random
+import threading
+import time
+import zlib
+import urllib.error
+import urllib.parse
+import urllib.request as ur
+
+VOLATILE_PARAMS = ["period2"]  # Query parameters that change on every request.
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0",
+    "Accept": "application/json",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
+def fixture_key(url: str) -> str:
+    """Creating the key of a recorded response.
+    The scheme, host and volatile query parameters are left out, so a recording can be replayed later and served from a local stand-in server.
+
+    Args:
+        url (str): The requested url.
+
+    Returns:
+        str: The key of the fixture file.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = [
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if key not in VOLATILE_PARAMS
+    ]
+    normalized = parts.path + "?" + urllib.parse.urlencode(sorted(query))
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class UrlopenTransport:
+    def __init__(self, timeout: float = 30.0, base_url: str = None) -> None:
+        """Fetching urls with urllib.
+
+        Args:
+            timeout (float, optional): The timeout of a request in seconds. Defaults to 30.
+            base_url (str, optional): Replacing the scheme and host of every url, e.g. "http://127.0.0.1:8000" to use a local stand-in server. Defaults to None.
+        """
+        self.timeout = timeout
+        self.base_url = base_url
+
+    def fetch(self, url: str) -> bytes:
+        """Fetching the raw body of a url.
+
+        Args:
+            url (str): The url.
+
+        Returns:
+            bytes: The body of the response.
+        """
+        if self.base_url is not None:
+            parts = urllib.parse.urlsplit(url)
+            url = self.base_url.rstrip("/") + parts.path + "?" + parts.query
+        with ur.urlopen(url, timeout=self.timeout) as response:
+            return response.read()
+
+
+class PooledTransport:
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: float = 30.0,
+        base_url: str = None,
+        headers: dict = None,
+        max_redirects: int = 5,
+    ) -> None:
+        """Fetching urls over pooled keep-alive connections with compressed responses.
+        Idle connections are kept per host and reused by later requests, so only the first requests to a host pay for the TCP and TLS handshake.
+        The transport is thread safe and meant to be shared by all extractors.
+
+        Args:
+            pool_size (int, optional): The maximum number of idle connections kept per host. Defaults to 10.
+            timeout (float, optional): The timeout of connecting and reading in seconds. Defaults to 30.
+            base_url (str, optional): Replacing the scheme and host of every url, see UrlopenTransport. Defaults to None.
+            headers (dict, optional): The request headers. Defaults to DEFAULT_HEADERS.
+            max_redirects (int, optional): The maximum number of redirects followed per request, like urlopen. Defaults to 5.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.base_url = base_url
+        self.headers = headers if headers is not None else DEFAULT_HEADERS
+        self.max_redirects = max_redirects
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, scheme: str, netloc: str) -> queue.LifoQueue:
+        with self._lock:
+            key = (scheme, netloc)
+            if key not in self._pools:
+                self._pools[key] = queue.LifoQueue(maxsize=self.pool_size)
+            return self._pools[key]
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, pool: queue.LifoQueue, connection, response) -> None:
+        """Putting a connection back in the pool, or closing it if the pool is full or the server closes it."""
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _request(self, url: str) -> tuple:
+        """Sending a GET request over a pooled connection and reading the whole response.
+        If a reused connection turns out to be closed by the server, the request is sent once more on a new connection.
+
+        Args:
+            url (str): The url.
+
+        Returns:
+            http.client.HTTPResponse: The response.
+            bytes: The raw body of the response.
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        pool = self._pool(parts.scheme, parts.netloc)
+
+        try:
+            connection, reused = pool.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self._connect(parts.scheme, parts.netloc), False
+
+        try:
+            connection.request("GET", path, headers=self.headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            if not reused:
+                raise
+            # The server has closed the idle connection, so trying once more on a new one.
+            connection = self._connect(parts.scheme, parts.netloc)
+            try:
+                connection.request("GET", path, headers=self.headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+
+        self._release(pool, connection, response)
+        return response, body
+
+    def fetch(self, url: str) -> bytes:
+        """Fetching the raw (decompressed) body of a url, following redirects.
+
+        Args:
+            url (str): The url.
+
+        Raises:
+            urllib.error.HTTPError: If the server responds with an error status or redirects too many times.
+
+        Returns:
+            bytes: The body of the response.
+        """
+        if self.base_url is not None:
+            parts = urllib.parse.urlsplit(url)
+            url = self.base_url.rstrip("/") + parts.path + "?" + parts.query
+
+        for _ in range(self.max_redirects + 1):
+            response, body = self._request(url)
+            location = response.getheader("Location")
+            if response.status not in REDIRECT_STATUSES or location is None:
+                break
+            url = urllib.parse.urljoin(url, location)
+        else:
+            raise urllib.error.HTTPError(
+                url,
+                response.status,
+                f"More than {self.max_redirects} redirects",
+                response.headers,
+                io.BytesIO(body),
+            )
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.headers,
+                io.BytesIO(body),
+            )
+
+        encoding = response.getheader("Content-Encoding", "")
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # Some servers send a raw deflate stream without the zlib header.
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        return body
+
+    def close(self) -> None:
+        """Closing all idle connections."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            while True:
+                try:
+                    pool.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+class RecordingTransport:
+    def __init__(self, fixture_dir: str, transport=None) -> None:
+        """Fetching urls with another transport and saving every response as a fixture file.
+
+        Args:
+            fixture_dir (str): The directory of the fixture files.
+            transport (optional): The transport used for the actual requests. Defaults to a PooledTransport.
+        """
+        self.fixture_dir = Path(fixture_dir)
+        self.fixture_dir.mkdir(parents=True, exist_ok=True)
+        self.transport = transport if transport is not None else PooledTransport()
+
+    def fetch(self, url: str) -> bytes:
+        """Fetching the raw body of a url and recording it.
+
+        Args:
+            url (str): The url.
+
+        Returns:
+            bytes: The body of the response.
+        """
+        body = self.transport.fetch(url)
+        try:
+            fixture = {"url": url, "encoding": "utf-8", "body": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            fixture = {
+                "url": url,
+                "encoding": "base64",
+                "body": base64.b64encode(body).decode("ascii"),
+            }
+        path = self.fixture_dir / f"{fixture_key(url)}.json"
+        path.write_text(json.dumps(fixture))
+        return body
+
+
+class ThrottledTransport:
+    def __init__(self, transport=None, rate: float = 5.0, burst: int = 1) -> None:
+        """Limiting the request rate of another transport, so large universes can be fetched in parallel without being blocked.
+        Requests are spaced evenly at rate requests per second, while up to burst requests may start at once after an idle period.
+        The transport is thread safe, so all workers share the same limit.
+
+        Args:
+            transport (optional): The transport used for the actual requests. Defaults to a PooledTransport.
+            rate (float, optional): The maximum number of requests per second. Defaults to 5.
+            burst (int, optional): The number of requests that may start at once. Defaults to 1.
+        """
+        self.transport = transport if transport is not None else PooledTransport()
+        self.rate = rate
+        self.burst = burst
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str) -> bytes:
+        """Waiting for a free slot and fetching the raw body of a url.
+
+        Args:
+            url (str): The url.
+
+        Returns:
+            bytes: The body of the response.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now - (self.burst - 1) / self.rate)
+            self._next = slot + 1 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+        return self.transport.fetch(url)
+
+
+class ReplayTransport:
+    def __init__(
+        self,
+        fixture_dir: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = None,
+    ) -> None:
+        """Serving recorded responses without any network access.
+        A latency and a share of failing requests can be injected to reproduce slow or failing endpoints.
+
+        Args:
+            fixture_dir (str): The directory of the fixture files.
+            latency (float, optional): The delay of every response in seconds. Defaults to 0.
+            jitter (float, optional): A random extra delay between 0 and jitter seconds. Defaults to 0.
+            error_rate (float, optional): The probability of a request failing with a HTTP 503 error. Defaults to 0.
+            seed (int, optional): The seed of the injected jitter and errors. Defaults to None.
+        """
+        self.fixture_dir = Path(fixture_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def load(self, url: str) -> bytes:
+        """Loading the recorded body of a url.
+
+        Args:
+            url (str): The url.
+
+        Raises:
+            urllib.error.HTTPError: A 404 error if the url hasn't been recorded.
+
+        Returns:
+            bytes: The recorded body.
+        """
+        path = self.fixture_dir / f"{fixture_key(url)}.json"
+        if not path.exists():
+            raise urllib.error.HTTPError(
+                url, 404, "No recorded response", None, io.BytesIO()
+            )
+        fixture = json.loads(path.read_text())
+        if fixture["encoding"] == "base64":
+            return base64.b64decode(fixture["body"])
+        return fixture["body"].encode("utf-8")
+
+    def fetch(self, url: str) -> bytes:
+        """Replaying the recorded body of a url with the configured latency and errors.
+
+        Args:
+            url (str): The url.
+
+        Raises:
+            urllib.error.HTTPError: A 503 error if an error is injected, or a 404 error if the url hasn't been recorded.
+
+        Returns:
+            bytes: The recorded body.
+        """
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise urllib.error.HTTPError(url, 503, "Injected error", None, io.BytesIO())
+        return self.load(url)
+
+
+class FixtureServer:
+    def __init__(self, replay: ReplayTransport, host: str = "127.0.0.1", port: int = 0):
+        """A local HTTP stand-in for yahoo finance serving recorded responses.
+        Point a PooledTransport or UrlopenTransport at it with base_url=server.base_url.
+        Connections are kept alive and responses are gzipped when the client accepts it.
+
+        Args:
+            replay (ReplayTransport): The transport replaying the responses, including its latency and errors.
+            host (str, optional): The host to bind to. Defaults to "127.0.0.1".
+            port (int, optional): The port to bind to, 0 picks a free port. Defaults to 0.
+        """
+        self.replay = replay
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                try:
+                    body = replay.fetch(self.path)
+                except urllib.error.HTTPError as e:
+                    self.send_error(e.code, e.msg)
+                    return
+                self.send_response(200)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        """Starting the server in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serving requests in the current thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        """Stopping the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def run_benchmark(tickers: list, transport, repeats: int = 3) -> dict:
+    """Timing the fetch, parse and assembly of the stats of a list of tickers.
+    The persistent cache and the remembered results are bypassed so every repeat goes through the transport.
+
+    Args:
+        tickers (list): The tickers.
+        transport: The transport used by the extractor, e.g. a ReplayTransport.
+        repeats (int, optional): The number of repeats. Defaults to 3.
+
+    Returns:
+        dict: The best time in seconds of every stage and the number of rows.
+    """
+    from src.utils.yf_extractor import HISTORY_START, STAT_TYPES, YahooExtractor
+
+    timings = {"fetch": [], "parse": [], "build": [], "end_to_end": []}
+    rows = 0
+    for _ in range(repeats):
+        fetch = parse = build = 0.0
+        for ticker in tickers:
+            extractor = YahooExtractor(ticker, cache=False, transport=transport)
+            url = extractor._stats_url(STAT_TYPES, HISTORY_START, int(time.time()))
+            start = time.perf_counter()
+            body = transport.fetch(url)
+            fetch += time.perf_counter() - start
+            start = time.perf_counter()
+            stat_dict = extractor._decode_json(body)
+            parse += time.perf_counter() - start
+            start = time.perf_counter()
+            extractor._build_stats_frame(stat_dict)
+            build += time.perf_counter() - start
+        timings["fetch"].append(fetch)
+        timings["parse"].append(parse)
+        timings["build"].append(build)
+
+        YahooExtractor.flight.invalidate()  # Making sure every repeat is fetched.
+        start = time.perf_counter()
+        df = YahooExtractor.get_stats_many(tickers, cache=False, transport=transport)
+        timings["end_to_end"].append(time.perf_counter() - start)
+        rows = len(df)
+
+    result = {stage: min(values) for stage, values in timings.items()}
+    result["rows"] = rows
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Record yahoo responses or replay them for benchmarks."
+    )
+    parser.add_argument("mode", choices=["record", "replay", "serve"])
+    parser.add_argument("fixture_dir")
+    parser.add_argument("tickers", nargs="*", default=["AAPL", "MSFT", "GOOGL"])
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    from src.utils.yf_extractor import YahooExtractor
+
+    if args.mode == "record":
+        transport = RecordingTransport(args.fixture_dir)
+        for ticker in args.tickers:
+            extractor = YahooExtractor(ticker, cache=False, transport=transport)
+            extractor.get_stats(force_refresh=True)
+            extractor.get_recommended_symbols()
+        print(f"Recorded {len(args.tickers)} tickers to {args.fixture_dir}")
+    else:
+        replay = ReplayTransport(
+            args.fixture_dir,
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        )
+        if args.mode == "replay":
+            print(run_benchmark(args.tickers, replay, repeats=args.repeats))
+        else:
+            server = FixtureServer(replay, port=args.port)
+            print(f"Serving {args.fixture_dir} on {server.base_url}")
+            server.serve_forever()
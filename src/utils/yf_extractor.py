@@ -1,58 +1,359 @@
-from bs4 import BeautifulSoup
-import urllib.request as ur
+from pathlib import Path
+import sys
+path_root = Path(__file__).parents[2]
+sys.path.append(str(path_root))
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
+import time
+import numpy as np
 import pandas as pd
+from src.utils.cache import FundamentalsCache
+from src.utils.coalesce import SingleFlight
+from src.utils.instrumentation import instrumentation
+from src.utils.transport import PooledTransport
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+STAT_TYPES = [
+    "quarterlyMarketCap",
+    "trailingMarketCap",
+    "quarterlyEnterpriseValue",
+    "trailingEnterpriseValue",
+    "quarterlyPeRatio",
+    "trailingPeRatio",
+    "quarterlyForwardPeRatio",
+    "trailingForwardPeRatio",
+    "quarterlyPegRatio",
+    "trailingPegRatio",
+    "quarterlyPsRatio",
+    "trailingPsRatio",
+    "quarterlyPbRatio",
+    "trailingPbRatio",
+    "quarterlyEnterprisesValueRevenueRatio",
+    "trailingEnterprisesValueRevenueRatio",
+    "quarterlyEnterprisesValueEBITDARatio",
+    "trailingEnterprisesValueEBITDARatio",
+]
+HISTORY_START = 493590046  # The start of the full history (August 1985).
 
 
 class YahooExtractor:
-    def __init__(self, ticker: str):
+    default_transport = PooledTransport()  # Shared so connections are reused.
+    flight = SingleFlight()  # Shared so concurrent sessions share their requests.
+
+    def __init__(
+        self, ticker: str, cache: FundamentalsCache = None, transport=None
+    ) -> None:
+        """Extracting data for a ticker from yahoo finance.
+
+        Args:
+            ticker (str): The ticker to extract data for.
+            cache (FundamentalsCache, optional): The persistent cache of the stats. Defaults to the shared default cache, pass False to disable caching.
+            transport (optional): The object fetching the raw responses, see src.utils.transport. Defaults to YahooExtractor.default_transport.
+        """
         self.ticker = ticker
+        if cache is None:
+            cache = FundamentalsCache.default()
+        self.cache = cache if cache is not False else None
+        self.transport = transport if transport is not None else self.default_transport
 
-    def get_stats(self) -> pd.DataFrame:
+    def get_stats(
+        self, force_refresh: bool = False, incremental: bool = True
+    ) -> pd.DataFrame:
         """Extracting the stats for the selected ticker from yahoo finance.
+        Concurrent calls for the same ticker share one request and recent results are remembered, see YahooExtractor.flight.
+
+        Args:
+            force_refresh (bool, optional): Whether to skip the cache and download the full history again. Defaults to False.
+            incremental (bool, optional): Whether an expired cache entry should be refreshed incrementally. Defaults to True.
 
         Returns:
             pd.DataFrame: A dataframe containing the stats of the ticker.
+                The metrics that couldn't be extracted are in attrs["skipped_metrics"] with the reason, see get_skipped_metrics.
         """
-        url = f"https://query2.finance.yahoo.com/ws/fundamentals-timeseries/v1/finance/timeseries/{self.ticker}?lang=en-US&region=US&symbol={self.ticker}&padTimeSeries=true&type=quarterlyMarketCap%2CtrailingMarketCap%2CquarterlyEnterpriseValue%2CtrailingEnterpriseValue%2CquarterlyPeRatio%2CtrailingPeRatio%2CquarterlyForwardPeRatio%2CtrailingForwardPeRatio%2CquarterlyPegRatio%2CtrailingPegRatio%2CquarterlyPsRatio%2CtrailingPsRatio%2CquarterlyPbRatio%2CtrailingPbRatio%2CquarterlyEnterprisesValueRevenueRatio%2CtrailingEnterprisesValueRevenueRatio%2CquarterlyEnterprisesValueEBITDARatio%2CtrailingEnterprisesValueEBITDARatio&merge=false&period1=493590046&period2=1690014975&corsDomain=finance.yahoo.com"
+        return self._shared_stats(force_refresh, incremental).copy()
 
-        stat_dict = self._get_readable_json(url)
+    def get_skipped_metrics(self) -> dict:
+        """Getting the metrics that couldn't be extracted for the ticker and why.
+        The skips are stored with the stats, so they are also known when the stats come from the cache or a shared request.
 
-        # Starting to input data into the dataframe.
-        df = pd.DataFrame(columns=["metric", "date", "value"])
+        Returns:
+            dict: The reason of each skipped metric.
+        """
+        return dict(self._shared_stats().attrs.get("skipped_metrics", {}))
 
-        for i in range(len(stat_dict["timeseries"]["result"])):
-            # Looping through each metric and putting it into dataframe if possible.
-            stats = stat_dict["timeseries"]["result"][i]
+    def _shared_stats(
+        self, force_refresh: bool = False, incremental: bool = True
+    ) -> pd.DataFrame:
+        """Getting the stats through the shared single-flight layer. The returned dataframe is shared and must not be modified."""
+        key = ("stats", self.ticker, self.cache, self.transport)
+        return self.flight.do(
+            key,
+            lambda: self._load_stats(force_refresh, incremental),
+            refresh=force_refresh,
+        )
 
-            metric = stats["meta"]["type"][0]
+    def _load_stats(
+        self, force_refresh: bool = False, incremental: bool = True
+    ) -> pd.DataFrame:
+        """Loading the stats for the selected ticker from the cache or yahoo finance.
+        The stats are served from the persistent cache when there is a valid entry.
+        When the cached entry has expired and incremental is set, only the quarters after the last stored date of each metric are downloaded and merged into the cached data.
+        If that download fails, e.g. without a network, the expired entry is returned instead.
+
+        Args:
+            force_refresh (bool, optional): Whether to skip the cache and download the full history again. Defaults to False.
+            incremental (bool, optional): Whether an expired cache entry should be refreshed incrementally. Defaults to True.
 
+        Returns:
+            pd.DataFrame: A dataframe containing the stats of the ticker with the skipped metrics in attrs["skipped_metrics"].
+        """
+        cached = None
+        if self.cache is not None and not force_refresh:
+            df = self.cache.get(self.ticker, STAT_TYPES)
+            if df is not None:
+                instrumentation.count("cache.hit")
+                return self._with_dtypes(df)
+            instrumentation.count("cache.miss")
+            if incremental:
+                cached = self.cache.get(self.ticker, STAT_TYPES, allow_expired=True)
+                if cached is not None:
+                    instrumentation.count("cache.stale")
+                    cached = self._with_dtypes(cached)
+
+        period2 = int(time.time())
+        if cached is None or len(cached) == 0:
+            df, skipped = self._fetch_stats(STAT_TYPES, HISTORY_START, period2)
+        else:
             try:
-                stat_vals = stats[metric]
-
-                stat_dates = []
-                stat_values = []
-                for stat_val in stat_vals:
-                    stat_date = stat_val["asOfDate"]
-                    stat_value = stat_val["reportedValue"]["raw"]
-
-                    stat_dates.append(stat_date)
-                    stat_values.append(stat_value)
-
-                stat_metrics = [metric] * len(stat_values)
-                sub_df = pd.DataFrame(
-                    data={
-                        "metric": stat_metrics,
-                        "date": stat_dates,
-                        "value": stat_values,
-                    }
+                df, skipped = self._refresh_stats(cached, period2)
+            except Exception as e:
+                instrumentation.count("cache.stale_served")
+                print(
+                    f"Couldn't refresh the stats for {self.ticker}, using the stored stats: {e}"
                 )
+                return cached
+        df.attrs["skipped_metrics"] = skipped
+
+        if self.cache is not None and len(df) > 0:
+            self.cache.put(self.ticker, STAT_TYPES, df)
+
+        return df
+
+    def _refresh_stats(self, cached: pd.DataFrame, period2: int) -> pd.DataFrame:
+        """Downloading the stats after the last stored date of each metric and merging them into the stored stats.
+        Metrics with the same last date are requested together, and the last stored date is requested again since its value can still be revised.
+        Metrics without any stored data are requested for the full history.
+
+        Args:
+            cached (pd.DataFrame): The previously stored stats of the ticker.
+            period2 (int): The end of the requested window as a unix timestamp.
+
+        Returns:
+            pd.DataFrame: The merged stats.
+            dict: The metrics skipped by any of the downloads with the reason.
+        """
+        last_dates = cached.groupby("metric", observed=True)["date"].max()
+        metrics_by_start = {}
+        for metric in STAT_TYPES:
+            if metric in last_dates.index:
+                start = int(pd.Timestamp(last_dates[metric]).timestamp())
+            else:
+                start = HISTORY_START
+            metrics_by_start.setdefault(start, []).append(metric)
+
+        frames = [cached]
+        skipped = {}
+        for start, metrics in metrics_by_start.items():
+            df, fetch_skipped = self._fetch_stats(metrics, start, period2)
+            frames.append(df)
+            skipped.update(fetch_skipped)
+
+        with instrumentation.span("stats.concat"):
+            df = pd.concat(frames, ignore_index=True)
+            df = self._with_dtypes(df)
+        df = (
+            df.drop_duplicates(subset=["metric", "date"], keep="last")
+            .sort_values(by=["metric", "date"])
+            .reset_index(drop=True)
+        )
+        return df, skipped
+
+    def _fetch_stats(self, types: list, period1: int, period2: int) -> tuple:
+        """Downloading the stats of the given metrics within a window.
+
+        Args:
+            types (list): The metrics to download.
+            period1 (int): The start of the window as a unix timestamp.
+            period2 (int): The end of the window as a unix timestamp.
+
+        Returns:
+            pd.DataFrame: A dataframe containing the downloaded stats.
+            dict: The metrics that couldn't be extracted with the reason.
+        """
+        url = self._stats_url(types, period1, period2)
+        stat_dict = self._get_readable_json(url)
+
+        return self._build_stats_frame(stat_dict)
+
+    def _stats_url(self, types: list, period1: int, period2: int) -> str:
+        """Creating the url of the timeseries endpoint.
+
+        Args:
+            types (list): The metrics to request.
+            period1 (int): The start of the window as a unix timestamp.
+            period2 (int): The end of the window as a unix timestamp.
+
+        Returns:
+            str: The url.
+        """
+        types = "%2C".join(types)
+        return f"https://query2.finance.yahoo.com/ws/fundamentals-timeseries/v1/finance/timeseries/{self.ticker}?lang=en-US&region=US&symbol={self.ticker}&padTimeSeries=true&type={types}&merge=false&period1={period1}&period2={period2}&corsDomain=finance.yahoo.com"
+
+    @instrumentation.timed("stats.build")
+    def _build_stats_frame(self, stat_dict: dict) -> tuple:
+        """Flattening the timeseries results into column arrays and building the stats dataframe in one go.
+        Metrics that can't be extracted are returned separately together with the reason.
 
-                df = pd.concat([df, sub_df], ignore_index=True)
-            except:
-                # If it isn't possible to extract the data then continue to the next metric.
+        Args:
+            stat_dict (dict): The decoded response of the timeseries endpoint.
+
+        Returns:
+            pd.DataFrame: A dataframe with a categorical metric, a datetime date and a float value column.
+            dict: The metrics that couldn't be extracted with the reason.
+        """
+        metric_names = []
+        counts = []
+        dates = []
+        values = []
+        skipped = {}
+
+        for stats in stat_dict["timeseries"]["result"]:
+            metric = stats["meta"]["type"][0]
+            stat_vals = stats.get(metric)
+            if stat_vals is None:
+                skipped[metric] = "no data"
                 continue
 
+            try:
+                # Padded quarters are returned as None and are left out.
+                stat_dates = [val["asOfDate"] for val in stat_vals if val is not None]
+                stat_values = [
+                    val["reportedValue"]["raw"] for val in stat_vals if val is not None
+                ]
+            except (KeyError, TypeError) as e:
+                skipped[metric] = f"malformed entry: {e!r}"
+                print(f"Skipping {metric} for {self.ticker}, malformed entry: {e!r}")
+                continue
+
+            metric_names.append(metric)
+            counts.append(len(stat_values))
+            dates.extend(stat_dates)
+            values.extend(stat_values)
+
+        categories = STAT_TYPES + [m for m in metric_names if m not in STAT_TYPES]
+        codes = np.repeat(
+            np.array([categories.index(m) for m in metric_names], dtype=np.int8),
+            counts,
+        )
+        df = pd.DataFrame(
+            data={
+                "metric": pd.Categorical.from_codes(codes, categories=categories),
+                "date": pd.to_datetime(dates, format="%Y-%m-%d"),
+                "value": np.array(values, dtype=np.float64),
+            }
+        )
+        return df, skipped
+
+    @staticmethod
+    def _with_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+        """Making sure that a stored stats dataframe has the same dtypes as a freshly built one.
+
+        Args:
+            df (pd.DataFrame): The stats dataframe.
+
+        Returns:
+            pd.DataFrame: The stats dataframe with a categorical metric, a datetime date and a float value column.
+        """
+        extra_metrics = [m for m in df["metric"].unique() if m not in STAT_TYPES]
+        df["metric"] = pd.Categorical(
+            df["metric"], categories=STAT_TYPES + extra_metrics
+        )
+        if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+            df["date"] = pd.to_datetime(df["date"])
+        df["value"] = df["value"].astype(np.float64)
+        return df
+
+    @classmethod
+    def get_stats_many(
+        cls,
+        tickers: list,
+        max_workers: int = 8,
+        on_complete=None,
+        force_refresh: bool = False,
+        cache: FundamentalsCache = None,
+        transport=None,
+    ) -> pd.DataFrame:
+        """Extracting the stats for multiple tickers in parallel.
+        The requests are spread over a bounded pool of worker threads, so the total load time is close to the slowest single request.
+
+        Args:
+            tickers (list): The tickers to extract stats for. Duplicates are only fetched once.
+            max_workers (int, optional): The maximum number of concurrent requests. Defaults to 8.
+            on_complete (callable, optional): Called as on_complete(ticker, completed, total) each time a ticker has been fetched. Defaults to None.
+            force_refresh (bool, optional): Whether to skip the cache and download the stats again. Defaults to False.
+            cache (FundamentalsCache, optional): The persistent cache of the stats, see __init__. Defaults to None.
+            transport (optional): The object fetching the raw responses, see __init__. Defaults to None.
+
+        Returns:
+            pd.DataFrame: A dataframe containing the stats of all the tickers with an additional ticker column.
+                The skipped metrics of every ticker are in attrs["skipped_metrics"]
+                and the error of every ticker that couldn't be extracted is in attrs["failed_tickers"].
+        """
+        tickers = list(dict.fromkeys(tickers))
+        frames = {}
+        skipped = {}
+        failed = {}
+        if len(tickers) == 0:
+            return pd.DataFrame(columns=["metric", "date", "value", "ticker"])
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tickers))) as pool:
+            futures = {
+                pool.submit(
+                    cls(ticker, cache=cache, transport=transport).get_stats,
+                    force_refresh,
+                ): ticker
+                for ticker in tickers
+            }
+            for completed, future in enumerate(as_completed(futures), start=1):
+                ticker = futures[future]
+                try:
+                    ticker_df = future.result()
+                    ticker_df["ticker"] = ticker
+                    frames[ticker] = ticker_df
+                    if ticker_df.attrs.get("skipped_metrics"):
+                        skipped[ticker] = ticker_df.attrs["skipped_metrics"]
+                except Exception as e:
+                    instrumentation.count("stats.failed")
+                    failed[ticker] = repr(e)
+                    print(f"Couldn't extract the stats for {ticker}: {e}")
+
+                if on_complete is not None:
+                    on_complete(ticker, completed, len(tickers))
+
+        # Keeping the order of the input tickers regardless of completion order.
+        ordered = [frames[ticker] for ticker in tickers if ticker in frames]
+        if len(ordered) == 0:
+            df = pd.DataFrame(columns=["metric", "date", "value", "ticker"])
+        else:
+            with instrumentation.span("stats.concat"):
+                df = cls._with_dtypes(pd.concat(ordered, ignore_index=True))
+        df.attrs = {"skipped_metrics": skipped, "failed_tickers": failed}
         return df
 
     def get_potential_metrics(self) -> list:
@@ -61,12 +362,22 @@ class YahooExtractor:
         Returns:
             list: A list of unique metrics for the given ticker.
         """
-        df = self.get_stats()
+        df = self._shared_stats()
         return df["metric"].unique().tolist()
 
     def get_recommended_symbols(self) -> list:
         """Getting a list of symbols that yahoo calls recommended.
 
+        Returns:
+            list: The list of recommended tickers.
+        """
+        key = ("recommended", self.ticker, self.transport)
+        symbols = self.flight.do(key, self._load_recommended_symbols)
+        return list(symbols) if symbols is not None else None
+
+    def _load_recommended_symbols(self) -> list:
+        """Downloading the list of symbols that yahoo calls recommended.
+
         Returns:
             list: The list of recommended tickers.
         """
@@ -91,11 +402,45 @@ class YahooExtractor:
         Returns:
             dict: The url in a more readable format.
         """
-        read_data = ur.urlopen(url).read()
+        with instrumentation.span("yahoo.fetch"):
+            read_data = self.transport.fetch(url)
+        instrumentation.count("yahoo.bytes", len(read_data))
+        with instrumentation.span("yahoo.decode"):
+            return self._decode_json(read_data)
+
+    @staticmethod
+    def _decode_json(read_data: bytes) -> dict:
+        """Decoding the raw bytes of a response directly into json.
+        orjson is used when it is installed, and the html parser is only used as a fallback if the payload isn't plain json.
+
+        Args:
+            read_data (bytes): The raw response.
+
+        Returns:
+            dict: The decoded json.
+        """
+        try:
+            if orjson is not None:
+                return orjson.loads(read_data)
+            return json.loads(read_data)
+        except ValueError:
+            return YahooExtractor._decode_html(read_data)
+
+    @staticmethod
+    def _decode_html(read_data: bytes) -> dict:
+        """Extracting the json from a response that has been wrapped in html.
+
+        Args:
+            read_data (bytes): The raw response.
+
+        Returns:
+            dict: The decoded json.
+        """
+        from bs4 import BeautifulSoup  # Only imported when the fallback is needed.
+
+        instrumentation.count("yahoo.html_fallback")
         soup_stat = BeautifulSoup(read_data, "lxml")
-        output_string = str(soup_stat.find_all("p")[0])[
-            3:-4
-        ]  # Trimming the html string to a json convertible string
+        output_string = soup_stat.find_all("p")[0].get_text()
         output_json = json.loads(output_string)
 
         return output_json
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# The default cache directory is read on import, so it is pointed away from ~/.cache before any test imports src.
+os.environ.setdefault("STOCK_INSIGHTS_CACHE_DIR", tempfile.mkdtemp())
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import cache as cache_module
+from src.utils.cache import FundamentalsCache
+
+
+METRICS = ["quarterlyMarketCap", "quarterlyPeRatio"]
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        self.now += 1.0
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module, "time", clock)
+    return clock
+
+
+def stats_frame() -> pd.DataFrame:
+    return pd.DataFrame(
+        data={
+            "metric": pd.Categorical(["quarterlyMarketCap", "quarterlyPeRatio"]),
+            "date": pd.to_datetime(["2023-03-31", "2023-03-31"]),
+            "value": np.array([2.6e12, 26.0]),
+            "ticker": ["AAPL", "AAPL"],
+            "count": np.array([1, 2], dtype=np.int64),
+        }
+    )
+
+
+def test_round_trip_keeps_dtypes_and_attrs(tmp_path):
+    cache = FundamentalsCache(tmp_path)
+    df = stats_frame()
+    df.attrs["skipped_metrics"] = {"quarterlyPbRatio": "no data"}
+    cache.put("AAPL", METRICS, df)
+
+    cached = cache.get("AAPL", METRICS)
+    assert cached.dtypes.astype(str).to_dict() == df.dtypes.astype(str).to_dict()
+    pd.testing.assert_frame_equal(cached, df)
+    assert cached.attrs == df.attrs
+
+
+def test_metric_key_ignores_order(tmp_path):
+    cache = FundamentalsCache(tmp_path)
+    cache.put("AAPL", METRICS, stats_frame())
+    assert cache.get("AAPL", METRICS[::-1]) is not None
+    assert cache.get("AAPL", METRICS[:1]) is None
+
+
+def test_expired_entry_is_only_returned_when_allowed(tmp_path, clock):
+    cache = FundamentalsCache(tmp_path, ttl=10)
+    cache.put("AAPL", METRICS, stats_frame())
+    assert cache.get("AAPL", METRICS) is not None
+
+    clock.now += 60
+    assert cache.get("AAPL", METRICS) is None
+    assert cache.get("AAPL", METRICS, allow_expired=True) is not None
+
+
+def test_entry_ttl_overrides_the_cache_ttl(tmp_path, clock):
+    cache = FundamentalsCache(tmp_path, ttl=10)
+    cache.put("AAPL", METRICS, stats_frame(), ttl=100)
+    clock.now += 60
+    assert cache.get("AAPL", METRICS) is not None
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    size = len(FundamentalsCache._serialize(stats_frame()))
+    cache = FundamentalsCache(tmp_path, max_bytes=int(2.5 * size))
+    cache.put("AAPL", METRICS, stats_frame())
+    cache.put("MSFT", METRICS, stats_frame())
+    cache.get("AAPL", METRICS)  # AAPL is now more recently used than MSFT.
+
+    cache.put("GOOGL", METRICS, stats_frame())
+    assert cache.get("MSFT", METRICS) is None
+    assert cache.get("AAPL", METRICS) is not None
+    assert cache.get("GOOGL", METRICS) is not None
+    assert cache.size() <= cache.max_bytes
+
+
+def test_invalidate(tmp_path):
+    cache = FundamentalsCache(tmp_path)
+    cache.put("AAPL", METRICS, stats_frame())
+    cache.put("MSFT", METRICS, stats_frame())
+
+    cache.invalidate("AAPL")
+    assert cache.get("AAPL", METRICS) is None
+    assert cache.get("MSFT", METRICS) is not None
+
+    cache.invalidate()
+    assert cache.size() == 0
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+from src.utils.coalesce import SingleFlight
+
+N_CALLERS = 8
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        time.sleep(0.001)
+
+
+def run_concurrently(flight: SingleFlight, fn, release: threading.Event) -> list:
+    """Calling fn through the flight from N_CALLERS threads and releasing fn once all followers wait for the leader.
+
+    Returns:
+        list: The futures of the calls.
+    """
+    with ThreadPoolExecutor(max_workers=N_CALLERS) as pool:
+        futures = [pool.submit(flight.do, "key", fn) for _ in range(N_CALLERS)]
+        try:
+            wait_for(lambda: flight.shared == N_CALLERS - 1)
+        finally:
+            release.set()
+    return futures
+
+
+def test_followers_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait()
+        return object()
+
+    futures = run_concurrently(flight, fn, release)
+    results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert (flight.misses, flight.shared) == (1, N_CALLERS - 1)
+
+    # The result is remembered for later callers.
+    assert flight.do("key", fn) is results[0]
+    assert flight.hits == 1
+
+
+def test_exception_is_raised_to_every_caller_and_not_remembered():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait()
+        raise ValueError("yahoo is down")
+
+    futures = run_concurrently(flight, fail, release)
+    for future in futures:
+        with pytest.raises(ValueError, match="yahoo is down"):
+            future.result()
+
+    # The failed call is no longer in flight, so the next call runs again.
+    assert flight.do("key", lambda: 42) == 42
+
+
+def test_none_is_not_remembered():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: None) is None
+    assert flight.do("key", lambda: 1) == 1
+
+
+def test_result_expires_after_the_ttl():
+    flight = SingleFlight(ttl=0.0)
+    flight.do("key", lambda: 1)
+    assert flight.do("key", lambda: 2) == 2
+
+
+def test_refresh_and_invalidate_skip_the_remembered_result():
+    flight = SingleFlight()
+    flight.do("key", lambda: 1)
+    assert flight.do("key", lambda: 2, refresh=True) == 2
+    flight.invalidate("key")
+    assert flight.do("key", lambda: 3) == 3
+
+
+def test_least_recently_used_result_is_dropped():
+    flight = SingleFlight(maxsize=2)
+    flight.do("a", lambda: 1)
+    flight.do("b", lambda: 2)
+    flight.do("a", lambda: None)  # a is now more recently used than b.
+    flight.do("c", lambda: 3)
+    assert flight.do("a", lambda: -1) == 1
+    assert flight.do("b", lambda: -2) == -2
@@ -0,0 +1,90 @@
+import pytest
+
+from src.utils.instrumentation import Instrumentation
+
+
+def test_disabled_instance_records_nothing():
+    instance = Instrumentation(enabled=False)
+
+    @instance.timed("decorated")
+    def add(a, b):
+        return a + b
+
+    with instance.span("block"):
+        pass
+    assert add(1, 2) == 3
+    instance.count("counter")
+    instance.record("direct", 0.1)
+
+    assert instance.snapshot() == {"enabled": False, "spans": {}, "counters": {}}
+
+
+def test_spans_and_counters_are_collected():
+    instance = Instrumentation(enabled=True)
+
+    @instance.timed("decorated")
+    def fail():
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        fail()
+    with instance.span("block"):
+        pass
+    instance.count("counter")
+    instance.count("counter", 2)
+
+    snapshot = instance.snapshot()
+    assert snapshot["spans"]["decorated"]["count"] == 1
+    assert snapshot["spans"]["block"]["count"] == 1
+    assert snapshot["counters"] == {"counter": 3}
+
+    instance.reset()
+    assert instance.snapshot()["spans"] == {}
+
+
+def test_histogram_buckets_are_cumulative():
+    instance = Instrumentation(enabled=True)
+    for seconds in [0.003, 0.005, 0.2, 20.0]:
+        instance.record("span", seconds)
+
+    span = instance.snapshot()["spans"]["span"]
+    assert span["buckets"] == {
+        "0.001": 0,
+        "0.005": 2,  # A duration on a bound is counted in its bucket.
+        "0.01": 2,
+        "0.05": 2,
+        "0.1": 2,
+        "0.25": 3,
+        "0.5": 3,
+        "1.0": 3,
+        "2.5": 3,
+        "5.0": 3,
+        "10.0": 3,
+        "+Inf": 4,
+    }
+    assert span["count"] == 4
+    assert span["total_seconds"] == pytest.approx(20.208)
+    assert span["max_seconds"] == 20.0
+
+
+def test_prometheus_format():
+    instance = Instrumentation(enabled=True)
+    instance.record('a "quoted"\\span\nname', 0.5)
+    instance.count("cache.hit", 2)
+
+    lines = instance.to_prometheus(prefix="test").splitlines()
+    label = 'span="a \\"quoted\\"\\\\span\\nname"'
+    assert lines[:2] == [
+        "# HELP test_span_seconds The duration of the instrumented spans.",
+        "# TYPE test_span_seconds histogram",
+    ]
+    assert lines[2] == f'test_span_seconds_bucket{{{label},le="0.001"}} 0'
+    assert lines[8] == f'test_span_seconds_bucket{{{label},le="0.5"}} 1'
+    assert lines[13] == f'test_span_seconds_bucket{{{label},le="+Inf"}} 1'
+    assert lines[14:] == [
+        f"test_span_seconds_sum{{{label}}} 0.5",
+        f"test_span_seconds_count{{{label}}} 1",
+        "# HELP test_events_total The instrumented counters.",
+        "# TYPE test_events_total counter",
+        'test_events_total{name="cache.hit"} 2',
+    ]
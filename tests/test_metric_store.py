@@ -0,0 +1,100 @@
+import pandas as pd
+
+from src.utils.metric_store import MetricStore
+
+
+def test_every_accessor_uses_the_last_duplicate_observation():
+    df = pd.DataFrame(
+        data={
+            "ticker": ["AAPL", "AAPL", "AAPL", "MSFT"],
+            "metric": ["quarterlyPeRatio"] * 4,
+            "date": ["2023-03-31", "2022-12-31", "2023-03-31", "2023-03-31"],
+            "value": [25.0, 24.0, 26.0, 30.0],  # 26 restates the first observation.
+        }
+    )
+    store = MetricStore(df)
+
+    assert len(store) == 3
+    assert store.value("AAPL", "quarterlyPeRatio", "2023-03-31") == 26.0
+    assert store.series("AAPL", "quarterlyPeRatio").tolist() == [24.0, 26.0]
+    assert store.latest_value("AAPL", "quarterlyPeRatio") == 26.0
+    assert store.pivot("quarterlyPeRatio").loc["2023-03-31", "AAPL"] == 26.0
+
+    extended = store.extend(
+        pd.DataFrame(
+            data={
+                "ticker": ["AAPL"],
+                "metric": ["quarterlyPeRatio"],
+                "date": ["2023-03-31"],
+                "value": [27.0],
+            }
+        )
+    )
+    assert len(extended) == 3
+    assert extended.value("AAPL", "quarterlyPeRatio", "2023-03-31") == 27.0
+    assert extended.latest_value("AAPL", "quarterlyPeRatio") == 27.0
+    assert extended.pivot("quarterlyPeRatio").loc["2023-03-31", "AAPL"] == 27.0
+
+
+def observations(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["ticker", "metric", "date", "value"])
+
+
+def test_latest_snapshot_keeps_each_tickers_own_latest_quarter():
+    store = MetricStore(
+        observations(
+            [
+                ("MSFT", "quarterlyPeRatio", "2023-06-30", 30.0),
+                ("AAPL", "quarterlyPeRatio", "2023-03-31", 26.0),
+                ("GOOG", "quarterlyPeRatio", "2022-12-31", 20.0),
+                ("AAPL", "quarterlyPeRatio", "2022-12-31", 24.0),
+                ("MSFT", "quarterlyPeRatio", "2023-03-31", 29.0),
+                ("AAPL", "quarterlyPsRatio", "2023-03-31", 7.0),
+            ]
+        )
+    )
+    latest = store.snapshot.metric_frame("quarterlyPeRatio", ["AAPL", "MSFT", "GOOG"])
+    assert latest["date"].dt.strftime("%Y-%m-%d").tolist() == [
+        "2023-03-31",
+        "2023-06-30",
+        "2022-12-31",
+    ]
+    assert latest["value"].tolist() == [26.0, 30.0, 20.0]
+    # Tickers without the metric are left out.
+    assert store.snapshot.metric_frame("quarterlyPsRatio", ["MSFT", "AAPL"])[
+        "ticker"
+    ].tolist() == ["AAPL"]
+
+    extended = store.extend(
+        observations(
+            [
+                ("GOOG", "quarterlyPeRatio", "2023-06-30", 22.0),  # A newer quarter.
+                ("MSFT", "quarterlyPeRatio", "2023-03-31", 28.0),  # An older revision.
+                (
+                    "AAPL",
+                    "quarterlyPeRatio",
+                    "2023-03-31",
+                    25.0,
+                ),  # A same-day revision.
+                ("TSLA", "quarterlyPeRatio", "2023-03-31", 60.0),  # A new ticker.
+            ]
+        )
+    )
+    assert extended.latest_value("GOOG", "quarterlyPeRatio") == 22.0
+    assert extended.latest_value("MSFT", "quarterlyPeRatio") == 30.0
+    assert extended.latest_value("AAPL", "quarterlyPeRatio") == 25.0
+    assert extended.value("MSFT", "quarterlyPeRatio", "2023-03-31") == 28.0
+
+    # The incrementally updated snapshot equals one built from all the observations.
+    rebuilt = MetricStore(extended.to_frame()).snapshot
+    for metric in ["quarterlyPeRatio", "quarterlyPsRatio"]:
+        pd.testing.assert_frame_equal(
+            extended.snapshot.metric_frame(metric).sort_values(
+                "ticker", ignore_index=True
+            ),
+            rebuilt.metric_frame(metric).sort_values("ticker", ignore_index=True),
+        )
+
+    # The original store is unchanged.
+    assert store.latest_value("GOOG", "quarterlyPeRatio") == 20.0
+    assert store.latest("TSLA", "quarterlyPeRatio") == (None, None)
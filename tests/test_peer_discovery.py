@@ -0,0 +1,94 @@
+import json
+import re
+import threading
+
+import pytest
+
+from src.utils.peer_discovery import PeerDiscovery
+
+# The recommendations of every symbol, the ones after the fan-out of 3 are never followed.
+GRAPH = {
+    "ROOT": ["B", "C", "D"],
+    "B": ["C", "ROOT", "C", "E"],
+    "C": ["B", "E", "F"],
+    "D": ["E", "G", "H", "I"],
+    "E": ["ROOT", "J"],
+    "F": ["J"],
+    "G": [],
+    "H": ["K"],
+}
+
+
+class FakeRecommendations:
+    """Answering the recommendation requests from a graph and remembering the requested symbols."""
+
+    def __init__(self, graph: dict) -> None:
+        self.graph = graph
+        self.requested = []
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str) -> bytes:
+        symbol = re.search(r"/recommendationsbysymbol/([^?]+)\?", url).group(1)
+        with self._lock:
+            self.requested.append(symbol)
+        recommended = [{"symbol": s} for s in self.graph.get(symbol, [])]
+        body = {"finance": {"result": [{"recommendedSymbols": recommended}]}}
+        return json.dumps(body).encode("utf-8")
+
+
+@pytest.fixture
+def transport():
+    return FakeRecommendations(GRAPH)
+
+
+def test_candidates_are_ranked_by_co_occurrences_then_depth(transport):
+    candidates = PeerDiscovery(max_depth=2, fan_out=3, transport=transport).discover(
+        "ROOT"
+    )
+    # E is recommended as often as B and C but found a level later, and I is beyond the fan-out of D.
+    assert candidates["symbol"].tolist() == ["B", "C", "E", "D", "F", "G", "H"]
+    assert candidates["co_occurrences"].tolist() == [2, 2, 2, 1, 1, 1, 1]
+    assert candidates["depth"].tolist() == [1, 1, 2, 1, 2, 2, 2]
+
+
+def test_root_is_excluded_and_duplicates_are_counted_once(transport):
+    candidates = PeerDiscovery(max_depth=3, fan_out=3, transport=transport).discover(
+        "ROOT"
+    )
+    counts = dict(zip(candidates["symbol"], candidates["co_occurrences"]))
+    assert "ROOT" not in counts
+    # B recommends C twice within its fan-out, which counts once next to the root's recommendation.
+    assert counts["C"] == 2
+
+
+def test_every_symbol_is_fetched_once_up_to_the_depth(transport):
+    levels = []
+    discovery = PeerDiscovery(max_depth=3, fan_out=3, transport=transport)
+    candidates = discovery.discover(
+        "ROOT", on_level=lambda *level: levels.append(level)
+    )
+
+    assert sorted(transport.requested) == ["B", "C", "D", "E", "F", "G", "H", "ROOT"]
+    assert levels == [(1, 1), (2, 4), (3, 8)]
+    # Recommendations of the last level are counted but not followed.
+    assert "J" in set(candidates["symbol"])
+    assert "K" in set(candidates["symbol"])
+
+    # The recommendations are remembered for later crawls.
+    discovery.discover("ROOT")
+    assert len(transport.requested) == 8
+
+
+def test_depth_limits_the_crawl(transport):
+    candidates = PeerDiscovery(max_depth=1, transport=transport).discover("ROOT")
+    assert transport.requested == ["ROOT"]
+    assert candidates["symbol"].tolist() == ["B", "C", "D"]
+
+
+def test_crawl_stops_at_max_symbols(transport):
+    candidates = PeerDiscovery(
+        max_depth=3, fan_out=3, max_symbols=3, transport=transport
+    ).discover("ROOT")
+    assert sorted(transport.requested) == ["B", "C", "ROOT"]
+    # The recommendations of D are never fetched.
+    assert "G" not in set(candidates["symbol"])
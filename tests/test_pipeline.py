@@ -0,0 +1,156 @@
+import json
+import re
+
+import pandas as pd
+import pytest
+
+from src.utils import pipeline
+from src.utils.cache import FundamentalsCache
+from src.utils.metric_store import MetricStore
+from src.utils.pipeline import Job, run_pipeline, value_ticker
+
+
+def timeseries(observations: dict) -> bytes:
+    """Creating a response of the timeseries endpoint from {metric: value} on a single date."""
+    result = [
+        {
+            "meta": {"type": [metric]},
+            metric: [{"asOfDate": "2023-03-31", "reportedValue": {"raw": value}}],
+        }
+        for metric, value in observations.items()
+    ]
+    return json.dumps({"timeseries": {"result": result}}).encode("utf-8")
+
+
+class FakeYahoo:
+    """Answering the timeseries requests of the known tickers and failing for the others, as if yahoo was down."""
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+        self.requests = 0
+
+    def fetch(self, url: str) -> bytes:
+        self.requests += 1
+        ticker = re.search(r"/timeseries/([^?]+)\?", url).group(1)
+        if ticker not in self.stats:
+            raise ConnectionError(f"yahoo is down for {ticker}")
+        return timeseries(self.stats[ticker])
+
+
+def stats(market_cap: float, pe: float) -> dict:
+    return {
+        "quarterlyMarketCap": market_cap,
+        "quarterlyForwardPeRatio": pe,
+        "quarterlyPsRatio": pe / 5,
+    }
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """A fresh default cache, so no test sees the stats cached by another."""
+    cache = FundamentalsCache(tmp_path / "cache")
+    monkeypatch.setattr(FundamentalsCache, "_default", cache)
+    return cache
+
+
+@pytest.fixture
+def transport():
+    return FakeYahoo(
+        {
+            "AAPL": stats(3e12, 30.0),
+            "MSFT": stats(2.5e12, 35.0),
+            "GOOG": stats(1.5e12, 25.0),
+        }
+    )
+
+
+def test_resume_skips_the_jobs_that_are_done(tmp_path, transport):
+    jobs = [Job("AAPL", ["MSFT"]), Job("GOOG", ["MSFT"]), Job("AAPL", ["MSFT"])]
+    first = run_pipeline(jobs, tmp_path / "out", max_jobs=2, transport=transport)
+    assert (first["jobs"], first["completed"], first["skipped"]) == (2, 2, 0)
+
+    requests = transport.requests
+    second = run_pipeline(jobs, tmp_path / "out", transport=transport)
+    assert (second["completed"], second["skipped"], second["failed"]) == (0, 2, 0)
+    assert transport.requests == requests
+
+    # The valuations of the skipped jobs are still collected.
+    valuations = pd.read_parquet(tmp_path / "out" / "valuations.parquet")
+    assert set(valuations["ticker"]) == {"AAPL", "GOOG"}
+    assert set(valuations["kpi"]) == {"PE", "PS"}
+
+
+def test_failed_job_is_run_again(tmp_path, transport):
+    jobs = [Job("AAPL", ["MSFT"]), Job("NVDA", ["MSFT"])]
+    first = run_pipeline(jobs, tmp_path / "out", transport=transport)
+    failed_id = Job("NVDA", ["MSFT"]).job_id
+    assert (first["completed"], first["failed"]) == (1, 1)
+    # The summary holds the underlying error rather than only that the stats are missing.
+    assert "ConnectionError('yahoo is down for NVDA')" in first["failures"][failed_id]
+    assert not (tmp_path / "out" / f"{failed_id}.json").exists()
+
+    transport.stats["NVDA"] = stats(1e12, 50.0)
+    second = run_pipeline(jobs, tmp_path / "out", transport=transport)
+    assert (second["completed"], second["skipped"], second["failed"]) == (1, 1, 0)
+    assert second["failures"] == {}
+
+    result = json.loads((tmp_path / "out" / f"{failed_id}.json").read_text())
+    assert result["ticker"] == "NVDA"
+    assert [valuation["kpi"] for valuation in result["valuations"]] == ["PE", "PS"]
+
+
+def test_summary_is_written_with_the_settings(tmp_path, transport):
+    summary = run_pipeline(
+        [Job("AAPL", ["MSFT", "TSLA"])],
+        tmp_path / "out",
+        max_jobs=3,
+        max_workers=2,
+        periods=2.0,
+        wanted_cagr=0.1,
+        transport=transport,
+    )
+    assert json.loads((tmp_path / "out" / "summary.json").read_text()) == summary
+    assert (summary["jobs"], summary["completed"], summary["failed"]) == (1, 1, 0)
+    assert summary["settings"] == {
+        "max_jobs": 3,
+        "max_workers": 2,
+        "requests_per_second": None,
+        "periods": 2.0,
+        "wanted_cagr": 0.1,
+    }
+
+    result = json.loads(
+        (tmp_path / "out" / f"{Job('AAPL', ['MSFT', 'TSLA']).job_id}.json").read_text()
+    )
+    assert result["missing_tickers"] == ["TSLA"]
+    # Two of the three tickers have each metric, which is less than the coverage limit of 75 %.
+    assert result["metrics"] == []
+
+
+def test_missing_pyarrow_fails_before_any_job_runs(tmp_path, transport, monkeypatch):
+    monkeypatch.setattr(pipeline, "pa", None)
+    with pytest.raises(ImportError, match="stock-insights\\[pipeline\\]"):
+        run_pipeline([Job("AAPL")], tmp_path / "out", transport=transport)
+    assert transport.requests == 0
+
+
+def test_small_kpis_are_not_rounded_away():
+    store = MetricStore(
+        pd.DataFrame(
+            data={
+                "ticker": ["A"] * 3,
+                "metric": [
+                    "quarterlyMarketCap",
+                    "quarterlyPsRatio",
+                    "quarterlyPbRatio",
+                ],
+                "date": ["2023-03-31"] * 3,
+                "value": [1e9, 0.4, 1.4],
+            }
+        )
+    )
+    valuations = value_ticker(store, "A", seed=1)
+    assert [valuation["kpi"] for valuation in valuations] == ["PS", "PB"]
+    for valuation in valuations:
+        # The estimates are the current values, so the median valuation is the market cap.
+        assert valuation["valuation_q0.5"] == pytest.approx(1e9, rel=0.01)
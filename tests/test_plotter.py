@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from src.utils.plotter import lttb
+
+
+def reference_lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """A straightforward loop implementation of LTTB for a single series."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = 1 + (n - 2) * np.arange(n_out - 1) // (n_out - 2)
+    edges[-1] = n - 1
+    selected = [0]
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        x_mean = x[end:next_end].mean()
+        y_mean = y[end:next_end].mean()
+        a = selected[-1]
+        area = np.abs(
+            (x[a] - x_mean) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (y_mean - y[a])
+        )
+        selected.append(start + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.array(selected)
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(3)
+    x = np.arange(5000, dtype=np.float64)
+    y = np.cumsum(rng.normal(size=5000))
+    return x, y
+
+
+@pytest.mark.parametrize("n_out", [3, 10, 100, 999])
+def test_keeps_the_endpoints_and_the_point_budget(series, n_out):
+    x, y = series
+    idx = lttb(x, y, n_out)
+    assert len(idx) == n_out
+    assert idx[0] == 0
+    assert idx[-1] == len(x) - 1
+    assert (np.diff(idx) > 0).all()
+
+
+def test_matches_the_reference_implementation(series):
+    x, y = series
+    np.testing.assert_array_equal(lttb(x, y, 200), reference_lttb(x, y, 200))
+
+
+def test_keeps_the_extremes_of_a_spike():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[500] = 100.0
+    assert 500 in lttb(x, y, 20)
+
+
+def test_short_series_are_kept_as_they_are():
+    x = np.arange(5, dtype=np.float64)
+    np.testing.assert_array_equal(lttb(x, x, 10), np.arange(5))
+
+
+def test_multiple_series_are_downsampled_independently(series):
+    x, y = series
+    lengths = [5000, 50, 3000]
+    xs = np.concatenate([x, x[:50], x[:3000]])
+    ys = np.concatenate([y, y[:50], -y[:3000]])
+    idx = lttb(xs, ys, 100, lengths=lengths)
+
+    assert len(idx) == 100 + 50 + 100
+    first = idx[idx < 5000]
+    third = idx[idx >= 5050] - 5050
+    np.testing.assert_array_equal(first, reference_lttb(x, y, 100))
+    np.testing.assert_array_equal(third, reference_lttb(x[:3000], -y[:3000], 100))
+    # Every series keeps its own endpoints.
+    assert {0, 4999, 5000, 5049, 5050, 8049} <= set(idx.tolist())
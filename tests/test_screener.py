@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from src.utils.metric_store import MetricStore
+from src.utils.screener import Screener
+
+
+@pytest.fixture
+def screener():
+    df = pd.DataFrame(
+        data={
+            "ticker": ["A", "B", "C"],
+            "metric": ["quarterlyPeRatio"] * 3,
+            "date": ["2023-03-31"] * 3,
+            "value": [30.0, 10.0, 20.0],
+        }
+    )
+    return Screener(MetricStore(df))
+
+
+def test_sort_order(screener):
+    cheapest = screener.screen(sort_by="quarterlyPeRatio", ascending=True)
+    assert cheapest.index.tolist() == ["B", "C", "A"]
+    assert screener.screen(sort_by="quarterlyPeRatio").index.tolist() == [
+        "A",
+        "C",
+        "B",
+    ]
+
+
+def test_filters_on_the_percentile(screener):
+    result = screener.screen({"quarterlyPeRatio": (0.0, 0.5)})
+    assert result.index.tolist() == ["B"]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"sort_by": "quarterlyPsRatio"},
+        {"filters": {"quarterlyPsRatio": (0, 1)}},
+        {"field": "rank"},
+    ],
+)
+def test_unknown_metric_or_field_raises_value_error(screener, kwargs):
+    with pytest.raises(ValueError, match="quarterlyPeRatio|percentile"):
+        screener.screen(**kwargs)
@@ -0,0 +1,335 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.simulation import (
+    FactorModel,
+    MonteCarloSimulation,
+    QuantileSketch,
+    norm_cdf,
+    norm_ppf,
+    simulate_scenarios,
+    sobol,
+)
+
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.005])
+def test_sketch_quantiles_are_within_the_relative_accuracy(relative_accuracy):
+    values = np.random.default_rng(42).lognormal(3.0, 1.0, 100_000)
+    sketch = QuantileSketch(relative_accuracy=relative_accuracy)
+    sketch.add(values)
+
+    exact = np.sort(values)
+    for q in QUANTILES:
+        expected = exact[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=relative_accuracy)
+
+
+def test_sketch_handles_negative_and_zero_values():
+    values = np.r_[np.linspace(-100, -1, 500), np.zeros(100), np.linspace(1, 100, 500)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    sketch.add(values)
+
+    exact = np.sort(values)
+    assert sketch.count == len(values)
+    assert sketch.zero_count == 100
+    assert sketch.quantile(0.5) == 0.0
+    for q in [0.0, 0.1, 0.9, 1.0]:
+        expected = exact[int(q * (len(values) - 1))]
+        assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+
+
+def test_sketch_of_blocks_equals_sketch_of_all_values():
+    values = np.random.default_rng(1).normal(10.0, 3.0, 10_000)
+    whole = QuantileSketch()
+    whole.add(values)
+    blocks = QuantileSketch()
+    for block in np.array_split(values, 7):
+        blocks.add(block)
+
+    for q in QUANTILES:
+        assert blocks.quantile(q) == whole.quantile(q)
+
+
+def test_empty_sketch_returns_nan():
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def simulation(**kwargs) -> MonteCarloSimulation:
+    params = dict(
+        kpi_current=20.0,
+        kpi_estimated=22.0,
+        kpi_std=3.0,
+        financial_current=100.0,
+        financial_estimated=120.0,
+        financial_std=15.0,
+        seed=7,
+    )
+    params.update(kwargs)
+    sim = MonteCarloSimulation(**params)
+    sim.n_simulations = 400_000
+    return sim
+
+
+def test_norm_ppf_inverts_norm_cdf():
+    x = np.linspace(-5, 5, 101)
+    np.testing.assert_allclose(norm_ppf(norm_cdf(x)), x, atol=1e-6)
+    u = np.array([1e-10, 0.01, 0.5, 0.99, 1 - 1e-10])
+    np.testing.assert_allclose(norm_cdf(norm_ppf(u)), u, rtol=1e-6)
+
+
+@pytest.mark.parametrize("d", [1, 2])
+def test_sobol_points_are_stratified(d):
+    points = sobol(1024, d, np.random.default_rng(0))
+    assert points.shape == (1024, d)
+    assert ((points > 0) & (points < 1)).all()
+    # Every one of the 1024 equal intervals of each dimension holds exactly one point.
+    for dim in range(d):
+        counts = np.bincount((points[:, dim] * 1024).astype(int), minlength=1024)
+        assert (counts == 1).all()
+
+
+def test_sobol_without_scipy_falls_back_to_latin_hypercube(monkeypatch):
+    monkeypatch.setitem(sys.modules, "scipy", None)
+    monkeypatch.setitem(sys.modules, "scipy.stats", None)
+    with pytest.warns(UserWarning, match="requires scipy"):
+        points = sobol(100, 3, np.random.default_rng(0))
+    assert points.shape == (100, 3)
+    for dim in range(3):
+        assert (np.bincount((points[:, dim] * 100).astype(int)) == 1).all()
+
+
+@pytest.mark.parametrize("sampling", ["random", "sobol", "lhs"])
+@pytest.mark.parametrize("wanted_cagr", [0.0, 0.1, 0.3])
+def test_analytic_probability_matches_the_simulation(sampling, wanted_cagr):
+    sim = simulation(sampling=sampling)
+    periods = 2.0
+    result = sim.run(periods)
+    assert sim.analytic_probability_above(wanted_cagr, periods) == pytest.approx(
+        result.probability_above(wanted_cagr), abs=0.005
+    )
+
+
+def test_analytic_quantiles_match_the_simulation():
+    sim = simulation()
+    periods = 3.0
+    result = sim.run(periods)
+    quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+    np.testing.assert_allclose(
+        sim.analytic_valuation_quantiles(quantiles),
+        np.quantile(result.valuation, quantiles),
+        rtol=0.005,
+    )
+    np.testing.assert_allclose(
+        sim.analytic_cagr_quantiles(quantiles, periods),
+        np.quantile(result.cagr, quantiles),
+        atol=0.002,
+    )
+
+
+def test_analytic_cagr_quantile_of_a_negative_valuation_is_nan():
+    sim = simulation(kpi_estimated=1.0, kpi_std=5.0)
+    cagr = sim.analytic_cagr_quantiles([0.01, 0.99], periods=1.0)
+    assert np.isnan(cagr[0])
+    assert np.isfinite(cagr[1])
+
+
+def test_analytic_solution_of_negative_stds_matches_the_simulation():
+    # The defaults of the valuation page for a PE of -20 and a market cap of 1e9.
+    sim = simulation(
+        kpi_current=-20.0,
+        kpi_estimated=-20.0,
+        kpi_std=-0.8,
+        financial_current=-5e7,
+        financial_estimated=-5e7,
+        financial_std=-2e6,
+    )
+    result = sim.run(1.0)
+    quantiles = [0.05, 0.5, 0.95]
+
+    np.testing.assert_allclose(
+        sim.analytic_valuation_quantiles(quantiles),
+        np.quantile(result.valuation, quantiles),
+        rtol=0.005,
+    )
+    assert sim.analytic_probability_above(0.0, 1.0) == pytest.approx(
+        result.probability_above(0.0), abs=0.005
+    )
+
+
+def test_parallel_run_is_reproducible_for_a_seed_and_number_of_workers():
+    first = simulation().run_parallel(2.0, n_workers=3)
+    second = simulation().run_parallel(2.0, n_workers=3)
+
+    assert len(first.valuation) == 400_000
+    np.testing.assert_array_equal(first.valuation, second.valuation)
+    np.testing.assert_array_equal(first.cagr, second.cagr)
+    # Another number of workers gives other streams.
+    assert not np.array_equal(
+        simulation().run_parallel(2.0, n_workers=2).valuation, first.valuation
+    )
+
+
+def test_parallel_run_in_processes_matches_threads():
+    sim = simulation()
+    sim.n_simulations = 20_000
+    threads = sim.run_parallel(2.0, n_workers=2, executor="thread")
+    processes = sim.run_parallel(2.0, n_workers=2, executor="process")
+
+    assert len(processes.valuation) == 20_000
+    np.testing.assert_array_equal(processes.kpi, threads.kpi)
+    np.testing.assert_array_equal(processes.financial, threads.financial)
+    np.testing.assert_array_equal(processes.cagr, threads.cagr)
+
+
+def factor_model(**kwargs) -> FactorModel:
+    params = dict(
+        names=["multiple", "earnings", "shares"],
+        means=[20.0, 100.0, 10.0],
+        stds=[3.0, 15.0, 0.5],
+        corr=[[1.0, 0.6, 0.0], [0.6, 1.0, -0.3], [0.0, -0.3, 1.0]],
+        seed=11,
+    )
+    params.update(kwargs)
+    model = FactorModel(**params)
+    model.n_simulations = 200_000
+    return model
+
+
+@pytest.mark.parametrize("sampling", ["random", "lhs"])
+def test_factor_draws_have_the_requested_moments_and_correlation(sampling):
+    model = factor_model(sampling=sampling)
+    draws = model.draw()
+    assert draws.shape == (3, 200_000)
+    np.testing.assert_allclose(draws.mean(axis=1), model.means, rtol=0.005)
+    np.testing.assert_allclose(draws.std(axis=1), model.stds, rtol=0.01)
+    np.testing.assert_allclose(np.corrcoef(draws), model.corr, atol=0.01)
+
+
+def test_factor_formulas():
+    model = factor_model()
+    draws = model.draw()
+    multiple, earnings, shares = draws
+
+    np.testing.assert_allclose(model.evaluate(draws), multiple * earnings * shares)
+    np.testing.assert_allclose(
+        model.evaluate(draws, weights=[1, 1, -1]), multiple * earnings / shares
+    )
+    np.testing.assert_allclose(
+        model.evaluate(draws, formula="sum", weights=[2, 1, -1]),
+        2 * multiple + earnings - shares,
+    )
+    np.testing.assert_allclose(
+        model.evaluate(draws, formula=lambda f: f["multiple"] + f["shares"]),
+        multiple + shares,
+    )
+    with pytest.raises(ValueError, match="Unknown formula"):
+        model.evaluate(draws, formula="ratio")
+
+
+def test_factor_model_run_derives_the_cagr_from_the_valuation():
+    result = factor_model().run(2.0, valuation_current=200.0, weights=[1, 1, -1])
+    np.testing.assert_allclose(
+        result.valuation,
+        result.factor("multiple") * result.factor("earnings") / result.factor("shares"),
+    )
+    np.testing.assert_allclose(result.cagr, np.sqrt(result.valuation / 200.0) - 1)
+    assert result.probability_above(0.0) == np.mean(result.valuation > 200.0)
+
+    # A sum that can be negative has no cagr.
+    result = factor_model().run(
+        2.0, valuation_current=200.0, formula="sum", weights=[0, 0, -1]
+    )
+    assert result.cagr is None
+    assert result.probability_above(0.0) is None
+
+
+def test_correlation_matrix_must_be_positive_definite():
+    with pytest.raises(ValueError, match="positive definite"):
+        factor_model(corr=[[1.0, 0.9, -0.9], [0.9, 1.0, 0.9], [-0.9, 0.9, 1.0]])
+    with pytest.raises(ValueError, match="symmetric"):
+        factor_model(corr=[[1.0, 0.5, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+def test_single_scenario_matches_the_simulation():
+    sim = simulation()
+    result = sim.run(2.0)
+    df = simulate_scenarios(
+        kpi_current=20.0,
+        financial_current=100.0,
+        kpi_estimated=22.0,
+        kpi_std=3.0,
+        financial_estimated=120.0,
+        financial_std=15.0,
+        periods=2.0,
+        wanted_cagr=0.1,
+        n_simulations=400_000,
+        seed=3,
+    )
+    assert len(df) == 1
+    row = df.iloc[0]
+    assert row["probability_above"] == pytest.approx(
+        result.probability_above(0.1), abs=0.005
+    )
+    assert row["mean_cagr"] == pytest.approx(result.cagr.mean(), abs=0.002)
+    for q, expected in zip(
+        [0.05, 0.5, 0.95], np.quantile(result.valuation, [0.05, 0.5, 0.95])
+    ):
+        assert row[f"valuation_q{q:g}"] == pytest.approx(expected, rel=0.005)
+
+
+def scenario_grid(**kwargs):
+    params = dict(
+        kpi_current=20.0,
+        financial_current=100.0,
+        kpi_estimated=np.array([5.0, 15.0, 20.0, 25.0, 30.0])[:, None],
+        kpi_std=3.0,
+        financial_estimated=np.array([80.0, 100.0, 120.0]),
+        financial_std=15.0,
+        periods=2.0,
+        n_simulations=20_000,
+        seed=3,
+    )
+    params.update(kwargs)
+    return simulate_scenarios(**params)
+
+
+def test_chunks_and_workers_do_not_change_the_scenarios():
+    expected = scenario_grid(chunk_size=16)
+    assert len(expected) == 15
+    pd.testing.assert_frame_equal(scenario_grid(chunk_size=4), expected)
+    pd.testing.assert_frame_equal(scenario_grid(chunk_size=1, n_workers=3), expected)
+
+
+def test_scenarios_with_negative_valuations_have_no_cagr():
+    df = scenario_grid()
+    cagr_columns = [column for column in df.columns if column.startswith("cagr_q")] + [
+        "mean_cagr"
+    ]
+    # A kpi of 5 with a std of 3 draws negative kpis, the other scenarios practically never do.
+    negative = df["kpi_estimated"] == 5.0
+    assert df.loc[negative, cagr_columns].isna().all().all()
+    assert df.loc[~negative, cagr_columns].notna().all().all()
+    assert df.loc[negative, "probability_above"].notna().all()
+
+
+@pytest.mark.parametrize("sampling", ["random", "sobol", "lhs"])
+def test_streaming_uses_the_sampling_of_the_simulation(sampling):
+    sim = simulation(sampling=sampling)
+    result = sim.run_streaming(2.0, wanted_cagr=0.1, chunk_size=2**16, target_se=0.002)
+    assert result.converged
+    assert result.probability_above == pytest.approx(
+        sim.analytic_probability_above(0.1, 2.0), abs=0.006
+    )
+
+    # The same seed gives other draws with another sampling.
+    other = "random" if sampling != "random" else "sobol"
+    other_result = simulation(sampling=other).run_streaming(
+        2.0, wanted_cagr=0.1, chunk_size=2**16, target_se=0.002
+    )
+    assert other_result.mean_valuation != result.mean_valuation
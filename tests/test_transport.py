@@ -0,0 +1,134 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socket
+import threading
+import urllib.error
+import zlib
+
+import pytest
+
+from src.utils.transport import (
+    FixtureServer,
+    PooledTransport,
+    RecordingTransport,
+    ReplayTransport,
+)
+
+URL = "https://query2.finance.yahoo.com/v1/finance/timeseries/AAPL?type=quarterlyPeRatio&period2=1"
+BODY = b'{"timeseries": {"result": []}}'
+
+
+class StaticTransport:
+    def fetch(self, url: str) -> bytes:
+        return BODY
+
+
+class CountingReplay(ReplayTransport):
+    """A replay counting the requests that reach the server."""
+
+    def __init__(self, fixture_dir) -> None:
+        super().__init__(fixture_dir)
+        self.requests = 0
+
+    def fetch(self, url: str) -> bytes:
+        self.requests += 1
+        return super().fetch(url)
+
+
+@pytest.fixture
+def server(tmp_path):
+    RecordingTransport(tmp_path, transport=StaticTransport()).fetch(URL)
+    replay = CountingReplay(tmp_path)
+    with FixtureServer(replay) as server:
+        yield server
+
+
+def test_gzipped_response_is_decoded(server):
+    transport = PooledTransport(base_url=server.base_url)
+    assert "gzip" in transport.headers["Accept-Encoding"]
+    assert transport.fetch(URL) == BODY
+
+
+def test_connection_is_reused(server):
+    transport = PooledTransport(base_url=server.base_url)
+    transport.fetch(URL)
+    pool = transport._pool("http", server.base_url.split("//")[1])
+    connection = pool.queue[-1]
+
+    transport.fetch(URL)
+    assert pool.queue[-1] is connection
+    transport.close()
+
+
+def test_stale_connection_is_retried_on_a_new_connection(server):
+    transport = PooledTransport(base_url=server.base_url)
+    transport.fetch(URL)
+    pool = transport._pool("http", server.base_url.split("//")[1])
+    stale = pool.queue[-1]
+
+    # Replacing the socket of the idle connection with one the other end has closed,
+    # as if the server had timed out the keep-alive connection.
+    closed, peer = socket.socketpair()
+    peer.close()
+    stale.sock.close()
+    stale.sock = closed
+
+    assert transport.fetch(URL) == BODY
+    assert server.replay.requests == 2
+    assert pool.queue[-1] is not stale
+    transport.close()
+
+
+def test_error_status_raises(server):
+    transport = PooledTransport(base_url=server.base_url)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        transport.fetch(URL.replace("AAPL", "MSFT"))
+    assert error.value.code == 404
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/loop"):
+            self.send_response(302)
+            self.send_header("Location", "/loop")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path.startswith("/moved"):
+            self.send_response(301)
+            self.send_header("Location", "/raw-deflate")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            # A deflate stream without the zlib header.
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = compressor.compress(BODY) + compressor.flush()
+            self.send_response(200)
+            self.send_header("Content-Encoding", "deflate")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def redirect_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RedirectHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_redirect_is_followed_and_raw_deflate_is_decoded(redirect_server):
+    transport = PooledTransport()
+    assert transport.fetch(redirect_server + "/moved") == BODY
+
+
+def test_redirect_loop_raises(redirect_server):
+    transport = PooledTransport(max_redirects=3)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        transport.fetch(redirect_server + "/loop")
+    assert error.value.code == 302
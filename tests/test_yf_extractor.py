@@ -0,0 +1,166 @@
+import json
+
+import pandas as pd
+import pytest
+
+from src.utils import yf_extractor
+from src.utils.cache import FundamentalsCache
+from src.utils.instrumentation import Instrumentation
+from src.utils.transport import RecordingTransport, ReplayTransport
+from src.utils.yf_extractor import HISTORY_START, STAT_TYPES, YahooExtractor
+
+
+class StaticTransport:
+    """Answering every request with the same body, used to record fixtures."""
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+
+    def fetch(self, url: str) -> bytes:
+        return self.body
+
+
+def timeseries(observations: dict) -> bytes:
+    """Creating a response of the timeseries endpoint from {metric: [(date, value), ...]}."""
+    result = [
+        {
+            "meta": {"type": [metric]},
+            metric: [
+                {"asOfDate": date, "reportedValue": {"raw": value}}
+                for date, value in values
+            ],
+        }
+        for metric, values in observations.items()
+    ]
+    return json.dumps({"timeseries": {"result": result}}).encode("utf-8")
+
+
+def record(fixture_dir, extractor: YahooExtractor, types, period1, body: bytes):
+    url = extractor._stats_url(types, period1, 0)
+    RecordingTransport(fixture_dir, transport=StaticTransport(body)).fetch(url)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FundamentalsCache(tmp_path / "cache")
+
+
+def test_incremental_refresh_only_requests_and_merges_new_dates(tmp_path, cache):
+    fixture_dir = tmp_path / "fixtures"
+    stored = pd.DataFrame(
+        data={
+            "metric": ["quarterlyMarketCap", "quarterlyMarketCap"],
+            "date": pd.to_datetime(["2022-12-31", "2023-03-31"]),
+            "value": [1.0, 2.0],
+        }
+    )
+    cache.put("AAPL", STAT_TYPES, stored, ttl=-1)  # Expired, so it is refreshed.
+
+    # Only the windows of the incremental refresh are recorded, so requesting the full history of the
+    # stored metric would fail with a 404 from the replay.
+    extractor = YahooExtractor(
+        "AAPL", cache=cache, transport=ReplayTransport(fixture_dir)
+    )
+    last_date = int(pd.Timestamp("2023-03-31").timestamp())
+    record(
+        fixture_dir,
+        extractor,
+        ["quarterlyMarketCap"],
+        last_date,
+        timeseries({"quarterlyMarketCap": [("2023-03-31", 2.5), ("2023-06-30", 3.0)]}),
+    )
+    others = [metric for metric in STAT_TYPES if metric != "quarterlyMarketCap"]
+    record(
+        fixture_dir,
+        extractor,
+        others,
+        HISTORY_START,
+        timeseries({"quarterlyPeRatio": [("2023-06-30", 30.0)]}),
+    )
+
+    df = extractor.get_stats()
+
+    market_cap = df[df["metric"] == "quarterlyMarketCap"]
+    assert market_cap["date"].dt.strftime("%Y-%m-%d").tolist() == [
+        "2022-12-31",
+        "2023-03-31",
+        "2023-06-30",
+    ]
+    # The last stored quarter is requested again and its revised value wins.
+    assert market_cap["value"].tolist() == [1.0, 2.5, 3.0]
+    assert df.loc[df["metric"] == "quarterlyPeRatio", "value"].tolist() == [30.0]
+    assert isinstance(df["metric"].dtype, pd.CategoricalDtype)
+
+    # The merged stats are stored again with a new expiry.
+    assert len(cache.get("AAPL", STAT_TYPES)) == len(df)
+
+
+def test_fresh_cache_entry_is_served_without_requests(tmp_path, cache):
+    stored = pd.DataFrame(
+        data={
+            "metric": ["quarterlyMarketCap"],
+            "date": pd.to_datetime(["2023-03-31"]),
+            "value": [2.0],
+        }
+    )
+    cache.put("AAPL", STAT_TYPES, stored)
+    # An empty fixture directory, so any request fails.
+    extractor = YahooExtractor("AAPL", cache=cache, transport=ReplayTransport(tmp_path))
+    assert extractor.get_stats()["value"].tolist() == [2.0]
+
+
+class OfflineTransport:
+    def fetch(self, url: str) -> bytes:
+        raise OSError("Network is unreachable")
+
+
+def test_expired_entry_is_served_when_the_refresh_fails(cache, monkeypatch):
+    counters = Instrumentation(enabled=True)
+    monkeypatch.setattr(yf_extractor, "instrumentation", counters)
+    stored = pd.DataFrame(
+        data={
+            "metric": ["quarterlyMarketCap"],
+            "date": pd.to_datetime(["2023-03-31"]),
+            "value": [2.0],
+        }
+    )
+    cache.put("AAPL", STAT_TYPES, stored, ttl=-1)
+
+    extractor = YahooExtractor("AAPL", cache=cache, transport=OfflineTransport())
+    assert extractor.get_stats()["value"].tolist() == [2.0]
+    assert counters.snapshot()["counters"]["cache.stale_served"] == 1
+
+    # Without a stored entry there is nothing to fall back to.
+    with pytest.raises(OSError):
+        YahooExtractor("MSFT", cache=cache, transport=OfflineTransport()).get_stats()
+
+
+def test_skipped_metrics_are_kept_with_the_cached_stats(tmp_path, cache):
+    body = json.dumps(
+        {
+            "timeseries": {
+                "result": [
+                    {
+                        "meta": {"type": ["quarterlyMarketCap"]},
+                        "quarterlyMarketCap": [
+                            {"asOfDate": "2023-03-31", "reportedValue": {"raw": 1.0}}
+                        ],
+                    },
+                    {"meta": {"type": ["quarterlyPeRatio"]}},
+                ]
+            }
+        }
+    ).encode("utf-8")
+    extractor = YahooExtractor("AAPL", cache=cache, transport=StaticTransport(body))
+    expected = {"quarterlyPeRatio": "no data"}
+    assert extractor.get_stats().attrs["skipped_metrics"] == expected
+
+    # Served from the persistent cache by a new extractor with a transport that can't be reached.
+    YahooExtractor.flight.invalidate()
+    cached = YahooExtractor("AAPL", cache=cache, transport=ReplayTransport(tmp_path))
+    assert cached.get_skipped_metrics() == expected
+
+    df = YahooExtractor.get_stats_many(
+        ["AAPL"], cache=cache, transport=ReplayTransport(tmp_path)
+    )
+    assert df.attrs["skipped_metrics"] == {"AAPL": expected}